@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Label -> (position, node, index) lookup over the fiducial nodes of the scene.
+
+The index is filled once by scanning the Markups Fiducial nodes, then kept up to
+date by observers:
+  - PointAdded / PointRemoved / TransformModified mark that node for a rescan,
+  - PointModified of a single point updates its position in place (dragging does
+    not trigger a rescan), or marks the node for a rescan if its label changed,
+  - scene NodeAdded / NodeRemoved / EndClose add, drop or clear nodes.
+Rescans are lazy (next lookup) and limited to the nodes that changed, so a lookup
+is a dict access. Search order and visibility filtering are those of the original
+linear scan: first fiducial node in scene order, first point with that label.
+
+`version` changes with every edit and `labelsVersion` only with the edits that may
+change labels or nodes, so derived data (TrajectoryRegistry) can tell a moved point
+from a new plan.
+"""
+
+import numpy as np
+import vtk
+import slicer
+
+_FIDUCIAL_CLASS = "vtkMRMLMarkupsFiducialNode"
+
+
+class FiducialLabelIndex:
+
+    def __init__(self, scene=None):
+        self.scene = scene or slicer.mrmlScene
+        self._order = []      # node IDs in scene order
+        self._nodes = {}      # node ID -> node
+        self._entries = {}    # node ID -> {"labels": [...], "positions": (N,3), "first": {label: i}}; None = dirty
+        self._observers = {}  # node ID -> [tags]
+        self._merged = None   # label -> [node IDs], None = rebuild
+        self.version = 0          # ogni modifica
+        self.labelsVersion = 0    # punti/etichette/nodi aggiunti, rimossi o rinominati
+        self._sceneTags = [
+            self.scene.AddObserver(self.scene.NodeAddedEvent, self._onNodeAdded),
+            self.scene.AddObserver(self.scene.NodeRemovedEvent, self._onNodeRemoved),
+            self.scene.AddObserver(self.scene.EndCloseEvent, self._onSceneClosed),
+        ]
+        for node in slicer.util.getNodesByClass(_FIDUCIAL_CLASS, self.scene):
+            self._track(node)
+
+    # ---------------- public ----------------
+    @property
+    def numberOfNodes(self):
+        return len(self._order)
+
+    def find(self, label, onlyVisible=False):
+        """(positionWorld, node, index) of the first point labelled `label`, or None."""
+        merged = self._mergedIndex()
+        for nodeID in merged.get(label, ()):
+            node = self._nodes[nodeID]
+            if onlyVisible:
+                d = node.GetDisplayNode()
+                if d and not d.GetVisibility():
+                    continue
+            entry = self._entries[nodeID]
+            i = entry["first"][label]
+            return entry["positions"][i].tolist(), node, i
+        return None
+
+    def nodes(self):
+        """[(node, labels, positions)] of every tracked node in scene order.
+
+        positions is the (N, 3) world array of the index itself, updated in place while
+        points are dragged (until the next labelsVersion change): do not modify it.
+        """
+        self._mergedIndex()
+        return [(self._nodes[i], self._entries[i]["labels"], self._entries[i]["positions"]) for i in self._order]
+
+    def invalidate(self, node=None):
+        """Force a rescan of one node (or of every node) at the next lookup."""
+        ids = [node.GetID()] if node is not None else list(self._order)
+        for nodeID in ids:
+            if nodeID in self._entries:
+                self._entries[nodeID] = None
+        self._changed(labels=True)
+
+    def release(self):
+        for nodeID in list(self._order):
+            self._untrack(nodeID)
+        for tag in self._sceneTags:
+            self.scene.RemoveObserver(tag)
+        self._sceneTags = []
+
+    # ---------------- bookkeeping ----------------
+    def _track(self, node):
+        nodeID = node.GetID()
+        if nodeID in self._nodes:
+            return
+        self._order.append(nodeID)
+        self._nodes[nodeID] = node
+        self._entries[nodeID] = None
+        dirty = lambda caller, event: self.invalidate(caller)
+        self._observers[nodeID] = [
+            node.AddObserver(node.PointAddedEvent, dirty),
+            node.AddObserver(node.PointRemovedEvent, dirty),
+            node.AddObserver(slicer.vtkMRMLTransformableNode.TransformModifiedEvent, dirty),
+            node.AddObserver(node.PointModifiedEvent, self._onPointModified),
+        ]
+        self._changed(labels=True)
+
+    def _untrack(self, nodeID):
+        node = self._nodes.pop(nodeID, None)
+        for tag in self._observers.pop(nodeID, []):
+            node.RemoveObserver(tag)
+        self._entries.pop(nodeID, None)
+        if nodeID in self._order:
+            self._order.remove(nodeID)
+        self._changed(labels=True)
+
+    def _changed(self, labels):
+        self.version += 1
+        if labels:
+            self.labelsVersion += 1
+            self._merged = None
+
+    @staticmethod
+    def _scan(node):
+        n = node.GetNumberOfControlPoints()
+        labels = [node.GetNthControlPointLabel(i) for i in range(n)]
+        try:
+            positions = np.asarray(slicer.util.arrayFromMarkupsControlPoints(node, world=True), dtype=float).reshape(n, 3)
+        except Exception:
+            positions = np.zeros((n, 3))
+            p = [0.0, 0.0, 0.0]
+            for i in range(n):
+                node.GetNthControlPointPositionWorld(i, p)
+                positions[i] = p
+        first = {}
+        for i, label in enumerate(labels):
+            first.setdefault(label, i)
+        return {"labels": labels, "positions": positions, "first": first}
+
+    def _mergedIndex(self):
+        if self._merged is not None:
+            return self._merged
+        merged = {}
+        for nodeID in self._order:
+            entry = self._entries[nodeID]
+            if entry is None:
+                entry = self._entries[nodeID] = self._scan(self._nodes[nodeID])
+            for label in entry["first"]:
+                merged.setdefault(label, []).append(nodeID)
+        self._merged = merged
+        return merged
+
+    # ---------------- observers ----------------
+    @vtk.calldata_type(vtk.VTK_INT)
+    def _onPointModified(self, caller, event, index):
+        entry = self._entries.get(caller.GetID())
+        if entry is None:
+            return
+        if index is None or not (0 <= index < len(entry["labels"])) \
+                or caller.GetNthControlPointLabel(index) != entry["labels"][index]:
+            self.invalidate(caller)
+            return
+        p = [0.0, 0.0, 0.0]
+        caller.GetNthControlPointPositionWorld(index, p)
+        entry["positions"][index] = p
+        self._changed(labels=False)
+
+    @vtk.calldata_type(vtk.VTK_OBJECT)
+    def _onNodeAdded(self, caller, event, node):
+        if node is not None and node.IsA(_FIDUCIAL_CLASS):
+            self._track(node)
+
+    @vtk.calldata_type(vtk.VTK_OBJECT)
+    def _onNodeRemoved(self, caller, event, node):
+        if node is not None and node.GetID() in self._nodes:
+            self._untrack(node.GetID())
+
+    def _onSceneClosed(self, caller, event):
+        for nodeID in list(self._order):
+            self._untrack(nodeID)
+
+
+_shared = None
+
+
+def shared_index():
+    """Index of slicer.mrmlScene, shared by every PLATiN module."""
+    global _shared
+    if _shared is None or _shared.scene is not slicer.mrmlScene:
+        _shared = FiducialLabelIndex(slicer.mrmlScene)
+    return _shared
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Trajectory geometry in plain NumPy (no VTK, Qt or Slicer).
+
+Every function takes points/vectors as array-likes whose last axis is (x, y, z)
+and works on one trajectory or on a stack of them at once: an (N, 3) array of
+entries and one of targets give N axes, N MPR bases, N x n contact centres, ...
+The planner logics call these for single trajectories; batch code, tests,
+benchmarks and worker processes can call them directly.
+"""
+
+import numpy as np
+
+_EPS = 1e-9
+_Z = np.array([0.0, 0.0, 1.0])
+
+
+def unit(v):
+    """v / |v| along the last axis; (near) zero vectors map to +Z."""
+    v = np.asarray(v, dtype=float)
+    n = np.linalg.norm(v, axis=-1, keepdims=True)
+    return np.where(n < _EPS, _Z, v / np.where(n < _EPS, 1.0, n))
+
+
+def lengths(entries, targets):
+    """Entry-target distances (mm)."""
+    return np.linalg.norm(np.asarray(targets, dtype=float) - np.asarray(entries, dtype=float), axis=-1)
+
+
+def axes(entries, targets):
+    """Unit entry->target directions."""
+    return unit(np.asarray(targets, dtype=float) - np.asarray(entries, dtype=float))
+
+
+def rot_z_to_vec(u):
+    """(angleDeg, axis): rotation about `axis` bringing +Z onto u (vtkTransform.RotateWXYZ form).
+
+    u parallel to Z gives angle 0 and u antiparallel 180 degrees, both about +X.
+    """
+    v = unit(u)
+    axis = np.cross(_Z, v)
+    s = np.linalg.norm(axis, axis=-1, keepdims=True)
+    angle = np.degrees(np.arctan2(s[..., 0], v[..., 2]))
+    axis = np.where(s < 1e-12, np.array([1.0, 0.0, 0.0]), axis / np.where(s < 1e-12, 1.0, s))
+    return angle, axis
+
+
+def rotation_matrix(axis, angleRad):
+    """Rodrigues rotation matrices (..., 3, 3) of angleRad about axis."""
+    k = unit(axis)
+    a = np.asarray(angleRad, dtype=float)[..., None, None]
+    K = np.zeros(k.shape[:-1] + (3, 3))
+    K[..., 0, 1] = -k[..., 2]; K[..., 0, 2] = k[..., 1]
+    K[..., 1, 0] = k[..., 2]; K[..., 1, 2] = -k[..., 0]
+    K[..., 2, 0] = -k[..., 1]; K[..., 2, 1] = k[..., 0]
+    return np.eye(3) + np.sin(a) * K + (1.0 - np.cos(a)) * (K @ K)
+
+
+def rotate_around_axis(vec, axis, angleRad):
+    """vec rotated by angleRad about axis (Rodrigues)."""
+    return (rotation_matrix(axis, angleRad) @ np.asarray(vec, dtype=float)[..., None])[..., 0]
+
+
+def frame_from_axis(u):
+    """Minimal rotation (..., 3, 3) bringing +Z onto u (Rodrigues); -Z gives diag(1, -1, -1)."""
+    u = unit(u)
+    c = u[..., 2]
+    K = np.zeros(u.shape[:-1] + (3, 3))
+    # K = [Z x u]_x, con Z x u = (-u_y, u_x, 0)
+    K[..., 0, 2] = u[..., 0]; K[..., 1, 2] = u[..., 1]
+    K[..., 2, 0] = -u[..., 0]; K[..., 2, 1] = -u[..., 1]
+    anti = c < -1.0 + 1e-12
+    R = np.eye(3) + K + (K @ K) / np.where(anti, 1.0, 1.0 + c)[..., None, None]
+    return np.where(anti[..., None, None], np.diag([1.0, -1.0, -1.0]), R)
+
+
+def mpr_basis(entries, targets):
+    """(axis, v, w) of the trajectory MPR: axis entry->target, v = axis x ref, w = axis x v.
+
+    ref is +Z, or +Y when the axis is within ~18 degrees of Z.
+    """
+    axis = axes(entries, targets)
+    ref = np.where((np.abs(axis[..., 2]) > 0.95)[..., None], np.array([0.0, 1.0, 0.0]), _Z)
+    v = unit(np.cross(axis, ref))
+    w = unit(np.cross(axis, v))
+    return axis, v, w
+
+
+def mpr_slice_to_ras(axis, v, w, center, mirror=True):
+    """SliceToRAS (..., 3, 4, 4) of the Red/Green/Yellow MPR views.
+
+    Red has normal=axis, transverse=v; Green normal=v and Yellow normal=w, both with
+    transverse=axis. mirror=True flips Green/Yellow transverse and normal (same plane,
+    no left-right mirroring, still right-handed).
+    """
+    axis, v, w = (np.asarray(x, dtype=float) for x in (axis, v, w))
+    N = unit(np.stack([axis, v, w], axis=-2))
+    T = unit(np.stack([v, axis, axis], axis=-2))
+    if mirror:
+        flip = np.array([1.0, -1.0, -1.0])[:, None]
+        N = N * flip; T = T * flip
+    Y = unit(np.cross(N, T))
+    M = np.zeros(N.shape[:-1] + (4, 4))
+    M[..., :3, 0] = T; M[..., :3, 1] = Y; M[..., :3, 2] = N
+    M[..., :3, 3] = np.asarray(center, dtype=float)[..., None, :]
+    M[..., 3, 3] = 1.0
+    return M
+
+
+def contact_distances(nContacts, contactLenMm, gapLenMm):
+    """Distances (mm) of the contact centres from the target, first contact at the tip."""
+    return contactLenMm * 0.5 + (contactLenMm + gapLenMm) * np.arange(int(nContacts), dtype=float)
+
+
+def contact_centers(entries, targets, nContacts, contactLenMm, gapLenMm):
+    """Contact centres (..., nContacts, 3), counted back from the target along target->entry."""
+    t = np.asarray(targets, dtype=float)
+    u = axes(entries, t)
+    d = contact_distances(nContacts, contactLenMm, gapLenMm)
+    return t[..., None, :] - d[:, None] * u[..., None, :]
+
+
+def necrosis_centers(entries, targets, offsetsMm, lengthMm):
+    """Ellipsoid centres (..., len(offsets), 3): each starts offsetsMm (>= 0) before the target."""
+    t = np.asarray(targets, dtype=float)
+    u = axes(entries, t)
+    d = np.maximum(np.asarray(offsetsMm, dtype=float), 0.0) + max(float(lengthMm) * 0.5, 0.01)
+    return t[..., None, :] - d[:, None] * u[..., None, :]
+
+
+def suggest_contacts(distancesMm, allowed, contactLenMm, gapLenMm):
+    """Smallest allowed contact count whose span covers each distance (largest if none does)."""
+    counts = np.sort(np.asarray(list(allowed), dtype=int))
+    spans = counts * contactLenMm + np.maximum(0, counts - 1) * gapLenMm
+    # Primo span >= distanza (tolleranza 1e-6 come nella versione scalare)
+    idx = np.searchsorted(spans, np.asarray(distancesMm, dtype=float) - 1e-6, side="left")
+    return counts[np.minimum(idx, len(counts) - 1)]
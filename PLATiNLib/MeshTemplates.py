@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Cached template meshes and batched instancing for PLATiN models.
+
+Every template lives in a local frame with its long axis on +Z, centred on the
+origin. Placing N copies (the contacts of an electrode, the necroses of a LiTT
+plan) is one NumPy affine transform into a single preallocated point array; the
+cells are the template connectivity shifted per instance. No VTK pipeline is
+built per instance.
+
+Tessellation follows a level-of-detail policy: the number of sides of a round
+section is the smallest one keeping the chord error (distance between the true
+surface and the polygon) under the tolerance of the requested quality, so a
+0.4 mm contact gets far fewer sides than a 5 mm ablation.
+"""
+
+import functools
+import math
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+_ID_DTYPE = np.int64 if vtk.vtkIdTypeArray().GetDataTypeSize() == 8 else np.int32
+
+
+class MeshTemplate:
+    """Read-only points/normals/polygons of one cached source output."""
+
+    __slots__ = ("points", "normals", "offsets", "connectivity")
+
+    def __init__(self, points, normals, offsets, connectivity):
+        self.points = points
+        self.normals = normals
+        self.offsets = offsets
+        self.connectivity = connectivity
+        for a in (points, normals, offsets, connectivity):
+            if a is not None:
+                a.flags.writeable = False
+
+    @property
+    def numberOfPoints(self):
+        return self.points.shape[0]
+
+    @property
+    def numberOfCells(self):
+        return self.offsets.shape[0] - 1
+
+
+def _template_from_polydata(poly, rotation=None):
+    pts = numpy_support.vtk_to_numpy(poly.GetPoints().GetData()).astype(np.float64)
+    nrm = poly.GetPointData().GetNormals()
+    nrm = None if nrm is None else numpy_support.vtk_to_numpy(nrm).astype(np.float64)
+    if rotation is not None:
+        pts = pts @ rotation.T
+        if nrm is not None:
+            nrm = nrm @ rotation.T
+    polys = poly.GetPolys()
+    offsets = numpy_support.vtk_to_numpy(polys.GetOffsetsArray()).astype(np.int64)
+    connectivity = numpy_support.vtk_to_numpy(polys.GetConnectivityArray()).astype(np.int64)
+    return MeshTemplate(np.ascontiguousarray(pts), None if nrm is None else np.ascontiguousarray(nrm),
+                        offsets, connectivity)
+
+
+# vtkCylinderSource is built along Y: ruota Y -> Z (x, y, z) -> (x, -z, y)
+_Y_TO_Z = np.array([[1.0, 0.0, 0.0],
+                    [0.0, 0.0, -1.0],
+                    [0.0, 1.0, 0.0]])
+
+
+# Errore di corda massimo (mm) per qualità: "preview" durante il trascinamento, "final" altrimenti
+CHORD_ERROR_MM = {"preview": 0.05, "final": 0.01}
+DEFAULT_QUALITY = "final"
+MIN_SIDES = 8
+MAX_SIDES = 64
+
+
+def chord_error_for(quality):
+    """Chord tolerance (mm) of a quality name; unknown names fall back to "final"."""
+    return CHORD_ERROR_MM.get(quality, CHORD_ERROR_MM[DEFAULT_QUALITY])
+
+
+def sides_for_radius(radius, chordErrorMm, minSides=MIN_SIDES, maxSides=MAX_SIDES):
+    """Fewest sides of a regular polygon inscribed in a circle of `radius` mm whose
+    chord error r*(1 - cos(pi/n)) stays within chordErrorMm, clamped to [minSides, maxSides]."""
+    r = float(radius); e = float(chordErrorMm)
+    if r <= 0.0 or e <= 0.0:
+        return int(maxSides)
+    if e >= r:
+        return int(minSides)
+    n = math.ceil(math.pi / math.acos(1.0 - e / r) - 1e-9)
+    return int(min(max(n, minSides), maxSides))
+
+
+def cylinder_resolution(radius, quality=DEFAULT_QUALITY):
+    """Number of sides of a cylinder/tube of the given radius at `quality`."""
+    return sides_for_radius(radius, chord_error_for(quality))
+
+
+def ellipsoid_resolution(radiusXY, radiusZ, quality=DEFAULT_QUALITY):
+    """(u, v) resolution of an ellipsoid: u around the axis (full circle of radiusXY),
+    v pole to pole (half meridian, sized on the larger semi-axis)."""
+    e = chord_error_for(quality)
+    u = sides_for_radius(radiusXY, e)
+    v = max(MIN_SIDES // 2, math.ceil(sides_for_radius(max(radiusXY, radiusZ), e) / 2))
+    return u, v
+
+
+@functools.lru_cache(maxsize=128)
+def cylinder_template(radius, height, resolution):
+    """Capped cylinder of the given radius/height along Z, centred on the origin."""
+    src = vtk.vtkCylinderSource()
+    src.SetRadius(float(radius)); src.SetHeight(float(height))
+    src.SetResolution(int(resolution)); src.CappingOn(); src.Update()
+    return _template_from_polydata(src.GetOutput(), _Y_TO_Z)
+
+
+@functools.lru_cache(maxsize=64)
+def ellipsoid_template(radiusXY, radiusZ, resolution, vResolution=None):
+    """Ellipsoid with semi-axes (radiusXY, radiusXY, radiusZ), centred on the origin.
+
+    `resolution` is the U (around Z) resolution; V (pole to pole) defaults to the same.
+    """
+    ell = vtk.vtkParametricEllipsoid()
+    ell.SetXRadius(float(radiusXY)); ell.SetYRadius(float(radiusXY)); ell.SetZRadius(float(radiusZ))
+    src = vtk.vtkParametricFunctionSource()
+    src.SetParametricFunction(ell)
+    src.SetUResolution(int(resolution)); src.SetVResolution(int(vResolution or resolution)); src.Update()
+    return _template_from_polydata(src.GetOutput())
+
+
+def lod_cylinder_template(radius, height, quality=DEFAULT_QUALITY):
+    """cylinder_template with the LOD resolution of `radius` at `quality`."""
+    return cylinder_template(radius, height, cylinder_resolution(radius, quality))
+
+
+def lod_ellipsoid_template(radiusXY, radiusZ, quality=DEFAULT_QUALITY):
+    """ellipsoid_template with the LOD (u, v) resolution of its semi-axes at `quality`."""
+    u, v = ellipsoid_resolution(radiusXY, radiusZ, quality)
+    return ellipsoid_template(radiusXY, radiusZ, u, v)
+
+
+def instance_arrays(parts, points=None, normals=None):
+    """Transform all template instances at once.
+
+    parts: iterable of (template, rotation 3x3, centers Nx3[, axialScale]).
+    Returns (points, normals or None, offsets, connectivity) for the whole batch,
+    with points/normals written into a single preallocated array each. Existing
+    (nPoints, 3) float64 buffers passed as points/normals are filled in place.
+    """
+    parts = [(p[0], np.asarray(p[1], dtype=np.float64), np.asarray(p[2], dtype=np.float64).reshape(-1, 3),
+              float(p[3]) if len(p) > 3 else 1.0) for p in parts]
+    nPts = sum(t.numberOfPoints * len(c) for t, _, c, _ in parts)
+    nCells = sum(t.numberOfCells * len(c) for t, _, c, _ in parts)
+    nConn = sum(t.connectivity.shape[0] * len(c) for t, _, c, _ in parts)
+    withNormals = all(t.normals is not None for t, _, _, _ in parts)
+
+    if points is None or points.shape != (nPts, 3):
+        points = np.empty((nPts, 3), dtype=np.float64)
+    if not withNormals:
+        normals = None
+    elif normals is None or normals.shape != (nPts, 3):
+        normals = np.empty((nPts, 3), dtype=np.float64)
+    offsets = np.empty(nCells + 1, dtype=np.int64)
+    connectivity = np.empty(nConn, dtype=np.int64)
+    offsets[0] = 0
+
+    p0 = c0 = k0 = 0
+    for t, rot, centers, axialScale in parts:
+        n = len(centers)
+        if n == 0:
+            continue
+        P, C, K = t.numberOfPoints, t.numberOfCells, t.connectivity.shape[0]
+        local = t.points
+        if axialScale != 1.0:
+            local = local * (1.0, 1.0, axialScale)
+        out = points[p0:p0 + n * P].reshape(n, P, 3)
+        np.matmul(local, rot.T, out=out[0])
+        out[1:] = out[0]
+        out += centers[:, None, :]
+        if withNormals:
+            # Rotazione pura (la scala assiale non cambia normali radiali/assiali)
+            nout = normals[p0:p0 + n * P].reshape(n, P, 3)
+            np.matmul(t.normals, rot.T, out=nout[0])
+            nout[1:] = nout[0]
+        conn = connectivity[k0:k0 + n * K].reshape(n, K)
+        np.add(t.connectivity, (p0 + P * np.arange(n, dtype=np.int64))[:, None], out=conn)
+        offs = offsets[c0 + 1:c0 + 1 + n * C].reshape(n, C)
+        np.add(t.offsets[1:], (k0 + K * np.arange(n, dtype=np.int64))[:, None], out=offs)
+        p0 += n * P; c0 += n * C; k0 += n * K
+    return points, normals, offsets, connectivity
+
+
+def polydata_from_arrays(points, normals, offsets, connectivity):
+    poly = vtk.vtkPolyData()
+    vtkPts = vtk.vtkPoints()
+    vtkPts.SetData(numpy_support.numpy_to_vtk(points, deep=1))
+    poly.SetPoints(vtkPts)
+    cells = vtk.vtkCellArray()
+    cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets.astype(_ID_DTYPE, copy=False), deep=1),
+                  numpy_support.numpy_to_vtkIdTypeArray(connectivity.astype(_ID_DTYPE, copy=False), deep=1))
+    poly.SetPolys(cells)
+    if normals is not None:
+        vtkNormals = numpy_support.numpy_to_vtk(normals, deep=1)
+        vtkNormals.SetName("Normals")
+        poly.GetPointData().SetNormals(vtkNormals)
+    return poly
+
+
+def instance_polydata(parts):
+    """One vtkPolyData with every (template, rotation, centers[, axialScale]) instance."""
+    return polydata_from_arrays(*instance_arrays(parts))
+
+
+def _double_view(array):
+    if array is None or array.GetDataType() != vtk.VTK_DOUBLE or array.GetNumberOfComponents() != 3:
+        return None
+    return numpy_support.vtk_to_numpy(array)
+
+
+def update_polydata(poly, parts):
+    """Rewrite `poly` in place with the instances of parts (same vtkPolyData object).
+
+    Points and normals are written straight into the existing arrays when their size
+    matches; the cells are replaced only if the connectivity changed (e.g. a different
+    number of contacts). Observers (model nodes) see a single Modified on poly.
+    Returns True when the topology was unchanged.
+    """
+    vtkPts = poly.GetPoints()
+    ptsView = _double_view(vtkPts.GetData() if vtkPts is not None else None)
+    vtkNormals = poly.GetPointData().GetNormals()
+    nrmView = _double_view(vtkNormals)
+    points, normals, offsets, connectivity = instance_arrays(parts, ptsView, nrmView)
+
+    if points is ptsView:
+        vtkPts.GetData().Modified(); vtkPts.Modified()
+    else:
+        newPts = vtk.vtkPoints()
+        newPts.SetData(numpy_support.numpy_to_vtk(points, deep=1))
+        poly.SetPoints(newPts)
+    if normals is None:
+        poly.GetPointData().SetNormals(None)
+    elif normals is nrmView:
+        vtkNormals.Modified()
+    else:
+        newNormals = numpy_support.numpy_to_vtk(normals, deep=1)
+        newNormals.SetName("Normals")
+        poly.GetPointData().SetNormals(newNormals)
+
+    polys = poly.GetPolys()
+    sameTopology = (polys is not None and polys.GetNumberOfCells() == offsets.shape[0] - 1
+                    and np.array_equal(numpy_support.vtk_to_numpy(polys.GetConnectivityArray()), connectivity))
+    if not sameTopology:
+        cells = vtk.vtkCellArray()
+        cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets.astype(_ID_DTYPE, copy=False), deep=1),
+                      numpy_support.numpy_to_vtkIdTypeArray(connectivity.astype(_ID_DTYPE, copy=False), deep=1))
+        poly.SetPolys(cells)
+    poly.Modified()
+    return sameTopology
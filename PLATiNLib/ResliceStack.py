@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Thin oblique volumes resampled along a trajectory.
+
+A stack is the box [-h, h] x [-h, h] x [-margin, length + margin] of a trajectory
+frame (X, Y across the trajectory, Z along it from the entry), resampled once from
+the reference volume with vtkImageReslice. Its k-slices are the cross-sections
+perpendicular to the axis, so stepping along the trajectory only reslices the
+stack, never the full reference volume.
+"""
+
+import math
+
+import numpy as np
+import vtk
+
+
+def _vtk_matrix(array):
+    m = vtk.vtkMatrix4x4()
+    m.DeepCopy([float(x) for x in np.asarray(array, dtype=float).ravel()])
+    return m
+
+
+def stack_geometry(lengthMm, halfWidthMm, spacingMm, marginMm=0.0):
+    """(dimensions (i, j, k), origin in the trajectory frame (mm)) of a stack."""
+    s = float(spacingMm)
+    nXY = int(math.ceil(2.0 * float(halfWidthMm) / s)) + 1
+    nZ = int(math.ceil((float(lengthMm) + 2.0 * float(marginMm)) / s)) + 1
+    return (nXY, nXY, nZ), (-float(halfWidthMm), -float(halfWidthMm), -float(marginMm))
+
+
+def reslice_stack(imageData, rasToIJK, frame, lengthMm, halfWidthMm, spacingMm, marginMm=0.0,
+                  backgroundLevel=None):
+    """Resample imageData (a Slicer volume: IJK grid, origin 0, spacing 1) on a trajectory stack.
+
+    frame: 4x4 RAS matrix with columns X, Y, Z (unit, Z along the trajectory) and the
+    origin (the entry point). Returns (vtkImageData with origin 0 / spacing 1,
+    ijkToRAS 4x4 NumPy) ready for a scalar volume node. Voxels outside the volume
+    take backgroundLevel (default: the minimum of the input).
+    """
+    dims, origin = stack_geometry(lengthMm, halfWidthMm, spacingMm, marginMm)
+    s = float(spacingMm)
+    frame = np.asarray(frame, dtype=float)
+
+    reslice = vtk.vtkImageReslice()
+    reslice.SetInputData(imageData)
+    # Coordinate del frame (mm) -> IJK del volume di riferimento
+    reslice.SetResliceAxes(_vtk_matrix(np.asarray(rasToIJK, dtype=float) @ frame))
+    reslice.SetOutputSpacing(s, s, s)
+    reslice.SetOutputOrigin(*origin)
+    reslice.SetOutputExtent(0, dims[0] - 1, 0, dims[1] - 1, 0, dims[2] - 1)
+    reslice.SetInterpolationModeToLinear()
+    reslice.SetBackgroundLevel(float(imageData.GetScalarRange()[0] if backgroundLevel is None else backgroundLevel))
+    reslice.Update()
+
+    out = vtk.vtkImageData()
+    out.DeepCopy(reslice.GetOutput())
+    out.SetOrigin(0.0, 0.0, 0.0)
+    out.SetSpacing(1.0, 1.0, 1.0)
+
+    voxelToFrame = np.diag([s, s, s, 1.0])
+    voxelToFrame[:3, 3] = origin
+    return out, frame @ voxelToFrame
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""MRML scene helpers shared by the PLATiN modules."""
+
+import contextlib
+
+import slicer
+
+
+def schedule_render_all_views():
+    """Ask every 3D and slice view for one (coalesced) repaint."""
+    try:
+        lm = slicer.app.layoutManager()
+    except AttributeError:
+        lm = None
+    if lm is None:  # --no-main-window
+        return
+    for i in range(lm.threeDViewCount):
+        lm.threeDWidget(i).threeDView().scheduleRender()
+    for name in lm.sliceViewNames():
+        lm.sliceWidget(name).sliceView().scheduleRender()
+
+
+@contextlib.contextmanager
+def batch_processing(scene=None, render=True):
+    """Run a block (or, as a decorator, a function) with the scene in BatchProcessState.
+
+    Views and observers get a single update when the outermost batch ends instead of
+    one per added/modified node; with render=True the views are then repainted once.
+    Nested uses are fine: only the outermost one ends the batch.
+    """
+    scene = scene or slicer.mrmlScene
+    scene.StartState(scene.BatchProcessState)
+    try:
+        yield scene
+    finally:
+        scene.EndState(scene.BatchProcessState)
+        if render and not scene.IsBatchProcessing():
+            schedule_render_all_views()
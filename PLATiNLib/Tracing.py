@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""Opt-in per-stage tracing of planner and fusion runs.
+
+Code marks its stages with
+
+    with Tracing.stage("rasterization") as s:
+        ...
+        s["voxels"] = mask.voxelCount
+
+and every finished stage records wall time, the peak of Python allocations during
+the stage (tracemalloc, process-wide, only when enabled with memory=True), the
+resident set size and the counts put in `s`. Stages nest (a fusion run contains
+the rasterization, fusion and save of each trajectory) and may run on worker
+threads. Tracing is off by default: stage() then returns a shared no-op context.
+
+The records can be summarized per stage name (summary(), TracePanel) or written
+as a Chrome trace (write_chrome_trace(), open it in chrome://tracing or Perfetto).
+
+Module startup (import and panel setup) is timed separately and always, since it
+happens before tracing can be switched on: see note_startup().
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+_MB = 1024.0 * 1024.0
+
+
+def _rss_bytes():
+    """(current, peak) resident set size of the process in bytes; None where unknown."""
+    current = peak = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = maxrss if sys.platform == "darwin" else maxrss * 1024  # macOS: byte, Linux: KiB
+    except (ImportError, OSError):
+        pass
+    return current, peak
+
+
+class _NullStage:
+    """Context of a stage while tracing is off: counts go to a throwaway dict."""
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+
+    __slots__ = ("tracer", "name", "category", "counts", "t0", "memStart", "memPeak")
+
+    def __init__(self, tracer, name, category, counts):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.counts = counts
+
+    def __enter__(self):
+        self.memStart = self.memPeak = None
+        if self.tracer.memory and tracemalloc.is_tracing():
+            self.memStart = self.memPeak = self.tracer._foldPeak(self, opening=True)
+        self.t0 = time.perf_counter()
+        return self.counts
+
+    def __exit__(self, excType, exc, tb):
+        t1 = time.perf_counter()
+        args = dict(self.counts)
+        if self.memStart is not None:
+            self.tracer._foldPeak(self, opening=False)
+            args["allocPeakMB"] = round((self.memPeak - self.memStart) / _MB, 3)
+        rss, rssPeak = _rss_bytes()
+        if rss is not None:
+            args["rssMB"] = round(rss / _MB, 1)
+        if rssPeak is not None:
+            args["rssPeakMB"] = round(rssPeak / _MB, 1)
+        if excType is not None:
+            args["error"] = excType.__name__
+        self.tracer._record(self.name, self.category, self.t0, t1, args)
+        return False
+
+
+class Tracer:
+    """Collects the stages of every thread; one shared instance (see tracer())."""
+
+    # Valori registrati dai contesti: non sono conteggi da sommare nel riepilogo
+    MEMORY_KEYS = ("allocPeakMB", "rssMB", "rssPeakMB")
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.events = []
+        self._lock = threading.Lock()
+        self._open = []            # stadi aperti (tutti i thread), per i picchi tracemalloc
+        self._threads = {}         # thread id -> name
+        self._origin = time.perf_counter()
+        self._startedTracemalloc = False
+
+    def enable(self, memory=False):
+        """Start recording; memory=True also tracks Python allocations (tracemalloc, slower)."""
+        self.memory = bool(memory)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._startedTracemalloc = True
+        elif not self.memory and self._startedTracemalloc:
+            tracemalloc.stop()
+            self._startedTracemalloc = False
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if self._startedTracemalloc:
+            tracemalloc.stop()
+            self._startedTracemalloc = False
+        self.memory = False
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+            self._threads = {}
+            self._origin = time.perf_counter()
+
+    def stage(self, name, category="stage", **counts):
+        """Context manager timing one stage; yields a dict for counts known only at the end."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, category, counts)
+
+    def record(self, name, t0, t1, category="stage", **args):
+        """Record a stage timed elsewhere (time.perf_counter() seconds), e.g. a child process."""
+        if self.enabled:
+            self._record(name, category, t0, t1, args)
+
+    # ---------------- recording ----------------
+    def _foldPeak(self, stage, opening):
+        # Il picco di tracemalloc è globale: prima di azzerarlo (apertura di uno stadio)
+        # lo si riporta su tutti gli stadi aperti, così ognuno vede il massimo della sua durata
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            for s in self._open:
+                s.memPeak = max(s.memPeak, peak)
+            if opening:
+                tracemalloc.reset_peak()
+                self._open.append(stage)
+            else:
+                stage.memPeak = max(stage.memPeak, peak)
+                if stage in self._open:
+                    self._open.remove(stage)
+            return current
+
+    def _record(self, name, category, t0, t1, args):
+        thread = threading.current_thread()
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self.events.append({"name": name, "cat": category, "ts": (t0 - self._origin) * 1e6,
+                                "dur": (t1 - t0) * 1e6, "tid": thread.ident, "args": args})
+
+    # ---------------- output ----------------
+    def summary(self):
+        """One row per stage name (first-seen order): calls, total/max seconds, memory peaks, summed counts."""
+        with self._lock:
+            events = list(self.events)
+        rows = {}
+        for e in sorted(events, key=lambda e: e["ts"]):
+            row = rows.setdefault(e["name"], {"stage": e["name"], "category": e["cat"], "calls": 0,
+                                              "totalS": 0.0, "maxS": 0.0, "allocPeakMB": None,
+                                              "rssPeakMB": None, "counts": {}})
+            seconds = e["dur"] / 1e6
+            row["calls"] += 1
+            row["totalS"] += seconds
+            row["maxS"] = max(row["maxS"], seconds)
+            for key in ("allocPeakMB", "rssPeakMB"):
+                if e["args"].get(key) is not None:
+                    row[key] = max(row[key] or 0.0, e["args"][key])
+            for key, value in e["args"].items():
+                if key not in self.MEMORY_KEYS and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    row["counts"][key] = row["counts"].get(key, 0) + value
+        return list(rows.values())
+
+    def chrome_trace(self):
+        """The records as a Chrome trace event dict (complete "X" events, microseconds)."""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for tid, name in threads.items()]
+        trace += [{"name": e["name"], "cat": e["cat"], "ph": "X", "ts": round(e["ts"], 3), "dur": round(e["dur"], 3),
+                   "pid": pid, "tid": e["tid"], "args": e["args"]} for e in events]
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, indent=1)
+        return path
+
+
+_tracer = Tracer()
+
+
+def tracer():
+    """Tracer shared by every PLATiN module."""
+    return _tracer
+
+
+def enabled():
+    """True while the shared tracer records (guard counts that cost a pass over the data)."""
+    return _tracer.enabled
+
+
+def stage(name, category="stage", **counts):
+    """Shortcut for tracer().stage(...)."""
+    return _tracer.stage(name, category, **counts)
+
+
+def traced(name, category="stage"):
+    """Decorator running the whole function as one stage."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _tracer.stage(name, category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+_startup = {}  # modulo -> {fase: secondi}, in ordine di registrazione
+
+
+def note_startup(module, phase, seconds):
+    """Remember how long `module` took for a startup phase ("import", "setup", ...).
+
+    The "setup" phase closes the module startup and prints its one-line report.
+    """
+    _startup.setdefault(module, {})[phase] = float(seconds)
+    if phase == "setup":
+        print(f"[{module}] Startup: {startup_report(module)}")
+
+
+def startup_times():
+    """{module: {phase: seconds}} of every module started in this session."""
+    return {module: dict(phases) for module, phases in _startup.items()}
+
+
+def startup_report(module=None):
+    """'import 12 ms, setup 85 ms' for one module, or 'Module: ...; Other: ...' for all."""
+    if module is not None:
+        return ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in _startup.get(module, {}).items())
+    return "; ".join(f"{name}: {startup_report(name)}" for name in _startup)
+
+
+class TracePanel:
+    """Collapsible "Profiling" section of a module panel for the shared tracer.
+
+    Enables tracing, shows the module startup times and summary() as a table
+    (refresh() after each run) and saves the Chrome trace.
+    """
+
+    COLUMNS = ("Stage", "Calls", "Total (s)", "Max (s)", "Alloc peak (MB)", "RSS peak (MB)", "Counts")
+
+    def __init__(self, layout, title="Profiling"):
+        import ctk
+        import qt
+        self.box = ctk.ctkCollapsibleButton()
+        self.box.text = title
+        self.box.collapsed = True
+        layout.addWidget(self.box)
+        boxLayout = qt.QVBoxLayout(self.box)
+
+        self.enableCheck = qt.QCheckBox("Trace stages (wall time, memory, voxel/polygon counts)")
+        self.memoryCheck = qt.QCheckBox("Track Python allocations (tracemalloc, slower)")
+        boxLayout.addWidget(self.enableCheck)
+        boxLayout.addWidget(self.memoryCheck)
+
+        self.startupLabel = qt.QLabel()
+        self.startupLabel.wordWrap = True
+        boxLayout.addWidget(self.startupLabel)
+
+        self.table = qt.QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(list(self.COLUMNS))
+        self.table.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.verticalHeader().setVisible(False)
+        boxLayout.addWidget(self.table)
+
+        row = qt.QHBoxLayout()
+        self.refreshButton = qt.QPushButton("Refresh")
+        self.saveButton = qt.QPushButton("Save Chrome trace...")
+        self.saveButton.toolTip = "JSON for chrome://tracing or ui.perfetto.dev"
+        self.clearButton = qt.QPushButton("Clear")
+        for b in (self.refreshButton, self.saveButton, self.clearButton):
+            row.addWidget(b)
+        boxLayout.addLayout(row)
+
+        self.enableCheck.toggled.connect(self._onToggled)
+        self.memoryCheck.toggled.connect(self._onToggled)
+        self.refreshButton.clicked.connect(self.refresh)
+        self.saveButton.clicked.connect(self._onSave)
+        self.clearButton.clicked.connect(self._onClear)
+        self.refresh()
+
+    def _onToggled(self, *_):
+        if self.enableCheck.checked:
+            _tracer.enable(memory=self.memoryCheck.checked)
+        else:
+            _tracer.disable()
+
+    def _onClear(self):
+        _tracer.clear()
+        self.refresh()
+
+    def _onSave(self):
+        import qt
+        import slicer
+        path = qt.QFileDialog.getSaveFileName(slicer.util.mainWindow(), "Save Chrome trace",
+                                              "platin_trace.json", "Chrome trace (*.json)")
+        if path:
+            _tracer.write_chrome_trace(path)
+            print(f"[PLATiN] Trace written to {path} ({len(_tracer.events)} stages)")
+
+    def refresh(self):
+        """Show the current summary (and the tracer state, shared by every panel)."""
+        import qt
+        for check, state in ((self.enableCheck, _tracer.enabled), (self.memoryCheck, _tracer.memory)):
+            if check.checked != state:
+                check.blockSignals(True)
+                check.checked = state
+                check.blockSignals(False)
+        self.startupLabel.text = "Startup: " + (startup_report() or "-")
+        rows = _tracer.summary()
+        self.table.setRowCount(len(rows))
+        fmt = lambda v, spec: "" if v is None else format(v, spec)
+        for r, row in enumerate(rows):
+            counts = ", ".join(f"{k}={v:g}" for k, v in row["counts"].items())
+            values = (row["stage"], str(row["calls"]), fmt(row["totalS"], ".3f"), fmt(row["maxS"], ".3f"),
+                      fmt(row["allocPeakMB"], ".1f"), fmt(row["rssPeakMB"], ".0f"), counts)
+            for c, text in enumerate(values):
+                self.table.setItem(r, c, qt.QTableWidgetItem(text))
+        self.table.resizeColumnsToContents()
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Entry/target pairs from fiducial labels (naming convention A = entry, A_1 = target)."""
+
+
+def collect_trajectories(markupNode):
+    """{base: {"entry", "entryLabel", "target", "targetLabel"}} for every labelled point."""
+    traj = {}
+    for i in range(markupNode.GetNumberOfControlPoints()):
+        label = markupNode.GetNthControlPointLabel(i)
+        pos = [0.0, 0.0, 0.0]
+        markupNode.GetNthControlPointPositionWorld(i, pos)
+
+        if "_" in label:
+            base = label.split("_")[0]
+            traj.setdefault(base, {})["target"] = list(pos)
+            traj.setdefault(base, {})["targetLabel"] = label
+        else:
+            traj.setdefault(label, {})["entry"] = list(pos)
+            traj.setdefault(label, {})["entryLabel"] = label
+    return traj
+
+
+def complete_pairs(traj):
+    """Sorted list of (base, entry, target) for the trajectories with both points."""
+    return [(key, pts["entry"], pts["target"]) for key, pts in sorted(traj.items())
+            if "entry" in pts and "target" in pts]
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""Array-backed registry of the trajectories of the scene.
+
+One row per trajectory, stored column-wise: entry and target world positions as
+(N, 3) float64 arrays, a kind (KIND_MARKUPS, KIND_SEEG, KIND_LITT) and float
+parameter columns (PARAMS, NaN where not set), next to the names and labels.
+Whole plans are queried with NumPy (lengths(), axes(), rows(kind=...), column()).
+
+Rows come from the fiducial labels:
+  - every A / A_<n> pair of a Markups Fiducial node (Trajectories naming rule,
+    same order and same "last point wins" as collect_trajectories), per node,
+  - every entry/target label pair the planner asked for (endpoints()) or planned
+    (register()), resolved like FiducialLabelIndex.find; a pair that resolves to
+    the points of a markups row shares that row. Looked-up pairs are kept only
+    while both labels resolve; planned pairs are kept until the scene closes.
+register() also sets the kind and parameters of the row.
+
+The arrays follow the markups through the observers of the shared FiducialIndex:
+a dragged point only refreshes the positions (one gather per node), added,
+removed or renamed points rebuild the rows at the next access. Row numbers are
+only valid until then; keep labels, not row numbers, across edits.
+"""
+
+import numpy as np
+
+from PLATiNLib import FiducialIndex, Geometry
+
+KIND_MARKUPS, KIND_SEEG, KIND_LITT = 0, 1, 2
+KIND_NAMES = ("Markups", "SEEG", "LiTT")
+
+# Colonne dei parametri (mm salvo i conteggi); NaN = non impostato
+PARAMS = ("contacts", "contactLenMm", "gapLenMm", "contactRadiusMm", "shaftRadiusMm",
+          "fiberDiameterMm", "necroses", "necStartOffsetMm", "necDiameterMm", "necLengthMm")
+_PARAM_COLUMN = {name: j for j, name in enumerate(PARAMS)}
+
+
+def _readonly(a):
+    v = a.view()
+    v.flags.writeable = False
+    return v
+
+
+class TrajectoryRegistry:
+
+    def __init__(self, index=None):
+        self.index = index or FiducialIndex.shared_index()
+        self.scene = self.index.scene
+        self._plans = {}          # (entryLabel, targetLabel) -> {"name", "kind", "params": {col: value}}
+        self._labelsVersion = self._version = None
+        self._clearRows()
+        self._sceneTags = [self.scene.AddObserver(self.scene.EndCloseEvent, self._onSceneClosed)]
+
+    # ---------------- rows (read-only, synced on access) ----------------
+    def __len__(self):
+        self._sync()
+        return len(self._names)
+
+    @property
+    def names(self):
+        self._sync()
+        return list(self._names)
+
+    @property
+    def entryLabels(self):
+        self._sync()
+        return list(self._entryLabels)
+
+    @property
+    def targetLabels(self):
+        self._sync()
+        return list(self._targetLabels)
+
+    @property
+    def nodeIDs(self):
+        """ID of the Markups node of each entry point."""
+        self._sync()
+        return list(self._nodeIDs)
+
+    @property
+    def entries(self):
+        self._sync()
+        return _readonly(self._entries)
+
+    @property
+    def targets(self):
+        self._sync()
+        return _readonly(self._targets)
+
+    @property
+    def kinds(self):
+        self._sync()
+        return _readonly(self._kinds)
+
+    @property
+    def params(self):
+        self._sync()
+        return _readonly(self._params)
+
+    # ---------------- queries ----------------
+    def column(self, name):
+        """Values of one PARAMS column for every row."""
+        return self.params[:, _PARAM_COLUMN[name]]
+
+    def rows(self, node=None, kind=None, pairsOnly=False):
+        """Indices of the rows of one Markups node and/or of one kind, in row order.
+
+        pairsOnly=True keeps the A / A_<n> pairs (no pair looked up with other labels).
+        """
+        self._sync()
+        keep = self._isPair.copy() if pairsOnly else np.ones(len(self._names), dtype=bool)
+        if node is not None:
+            keep &= np.array([i == node.GetID() for i in self._nodeIDs], dtype=bool)
+        if kind is not None:
+            keep &= self._kinds == kind
+        return np.flatnonzero(keep)
+
+    def row(self, entryLabel, targetLabel):
+        """Row of the planned or looked-up pair entryLabel -> targetLabel, or None."""
+        self._sync()
+        return self._byLabels.get((entryLabel, targetLabel))
+
+    def lengths(self):
+        return Geometry.lengths(self.entries, self.targets)
+
+    def axes(self):
+        return Geometry.axes(self.entries, self.targets)
+
+    def trajectories(self, node):
+        """{base: {"entry", "entryLabel", "target", "targetLabel"}} of the complete A / A_<n>
+        pairs of `node` (collect_trajectories order), or None if the index does not track it."""
+        self._sync()
+        if node is None or node.GetID() not in self._trackedIDs:
+            return None
+        traj = {}
+        for r in self._pairRows.get(node.GetID(), ()):
+            traj[self._names[r]] = {"entry": self._entries[r].tolist(), "entryLabel": self._entryLabels[r],
+                                    "target": self._targets[r].tolist(), "targetLabel": self._targetLabels[r]}
+        return traj
+
+    def endpoints(self, entryLabel, targetLabel, onlyVisible=False):
+        """(entry, target) world positions as lists, or None if a label is missing.
+
+        A pair whose labels both resolve is kept as a row, so the next calls read the
+        arrays; it is dropped again once a label stops resolving. With onlyVisible,
+        points of hidden nodes give None (search the visible ones with the index).
+        """
+        if (entryLabel, targetLabel) not in self._plans:
+            if self.index.find(entryLabel) is None or self.index.find(targetLabel) is None:
+                return None
+            self._track(entryLabel, targetLabel)
+        self._sync()
+        r = self._byLabels.get((entryLabel, targetLabel))
+        if r is None:
+            return None
+        if onlyVisible and not all(self._visible(nodeID) for nodeID in (self._nodeIDs[r], self._targetNodeIDs[r])):
+            return None
+        return self._entries[r].tolist(), self._targets[r].tolist()
+
+    # ---------------- planning ----------------
+    def register(self, name, entryLabel, targetLabel, kind, **params):
+        """Record a planned trajectory: its name, kind and PARAMS values (others are kept)."""
+        unknown = set(params) - set(PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown trajectory parameters: {', '.join(sorted(unknown))}")
+        key = (entryLabel, targetLabel)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = self._plans[key] = {"name": name, "kind": kind, "params": {}}
+            self._labelsVersion = None  # nuova coppia: righe da ricostruire
+        if name and name != plan["name"]:
+            plan["name"] = name
+            self._labelsVersion = None
+        plan["kind"] = int(kind)
+        plan["params"].update({k: float(v) for k, v in params.items() if v is not None})
+        r = self._byLabels.get(key)
+        if r is not None and self._labelsVersion is not None:
+            # Coppia già in tabella: aggiorna solo le sue colonne
+            self._applyPlan(r, plan)
+        return plan
+
+    def is_planned(self, entryLabel, targetLabel):
+        """True once register() recorded a SEEG/LiTT plan for the pair (in this scene)."""
+        plan = self._plans.get((entryLabel, targetLabel))
+        return plan is not None and plan["kind"] != KIND_MARKUPS
+
+    def release(self):
+        for tag in self._sceneTags:
+            self.scene.RemoveObserver(tag)
+        self._sceneTags = []
+
+    # ---------------- sync ----------------
+    def _track(self, entryLabel, targetLabel):
+        if (entryLabel, targetLabel) not in self._plans:
+            self._plans[(entryLabel, targetLabel)] = {"name": f"{entryLabel}→{targetLabel}", "kind": KIND_MARKUPS,
+                                                      "params": {}}
+            self._labelsVersion = None
+
+    def _sync(self):
+        if self._labelsVersion != self.index.labelsVersion:
+            self._rebuild()
+        elif self._version != self.index.version:
+            self._gather()
+        self._labelsVersion, self._version = self.index.labelsVersion, self.index.version
+
+    def _clearRows(self):
+        self._names, self._entryLabels, self._targetLabels = [], [], []
+        self._nodeIDs, self._targetNodeIDs = [], []
+        self._entries = np.zeros((0, 3)); self._targets = np.zeros((0, 3))
+        self._kinds = np.zeros(0, dtype=np.int8)
+        self._params = np.full((0, len(PARAMS)), np.nan)
+        self._refs = np.zeros((0, 4), dtype=np.int64)   # (slot entry, punto entry, slot target, punto target)
+        self._isPair = np.zeros(0, dtype=bool)
+        self._positions = []                            # array posizioni dell'indice, per slot
+        self._byLabels, self._pairRows, self._trackedIDs = {}, {}, set()
+
+    def _rebuild(self):
+        nodes = self.index.nodes()
+        slots = {node.GetID(): s for s, (node, _, _) in enumerate(nodes)}
+        rows = []   # (name, entryLabel, targetLabel, refs): prima le coppie A / A_<n>, poi le altre
+        pairRows = {}
+        byRefs = {}
+        for s, (node, labels, _) in enumerate(nodes):
+            entry, target, order = {}, {}, {}
+            for i, label in enumerate(labels):
+                if "_" in label:
+                    base = label.split("_")[0]
+                    target[base] = i
+                else:
+                    base = label
+                    entry[base] = i
+                order.setdefault(base, None)
+            for base in order:
+                if base in entry and base in target:
+                    refs = (s, entry[base], s, target[base])
+                    byRefs[refs] = len(rows)
+                    pairRows.setdefault(node.GetID(), []).append(len(rows))
+                    rows.append((base, labels[entry[base]], labels[target[base]], refs))
+
+        byLabels = {}
+        for (entryLabel, targetLabel), plan in list(self._plans.items()):
+            e = self.index.find(entryLabel)
+            t = self.index.find(targetLabel)
+            if e is None or t is None:
+                if plan["kind"] == KIND_MARKUPS:
+                    # Coppia solo consultata e non più risolvibile: non tenerla per sempre
+                    del self._plans[(entryLabel, targetLabel)]
+                continue
+            refs = (slots[e[1].GetID()], e[2], slots[t[1].GetID()], t[2])
+            r = byRefs.get(refs)
+            if r is None:
+                r = byRefs[refs] = len(rows)
+                rows.append((plan["name"], entryLabel, targetLabel, refs))
+            byLabels[(entryLabel, targetLabel)] = r
+
+        self._clearRows()
+        n = len(rows)
+        self._names = [r[0] for r in rows]
+        self._entryLabels = [r[1] for r in rows]
+        self._targetLabels = [r[2] for r in rows]
+        self._refs = np.array([r[3] for r in rows], dtype=np.int64).reshape(n, 4)
+        self._isPair = np.arange(n) < sum(len(r) for r in pairRows.values())
+        self._nodeIDs = [nodes[s][0].GetID() for s in self._refs[:, 0]]
+        self._targetNodeIDs = [nodes[s][0].GetID() for s in self._refs[:, 2]]
+        self._positions = [positions for _, _, positions in nodes]
+        self._entries = np.zeros((n, 3)); self._targets = np.zeros((n, 3))
+        self._kinds = np.full(n, KIND_MARKUPS, dtype=np.int8)
+        self._params = np.full((n, len(PARAMS)), np.nan)
+        self._byLabels, self._pairRows, self._trackedIDs = byLabels, pairRows, set(slots)
+        for key, r in self._byLabels.items():
+            self._applyPlan(r, self._plans[key])
+        self._gather()
+
+    def _gather(self):
+        # Posizioni correnti dagli array dell'indice (aggiornati in place durante il trascinamento)
+        for s, positions in enumerate(self._positions):
+            for col, out in ((0, self._entries), (2, self._targets)):
+                m = self._refs[:, col] == s
+                if m.any():
+                    out[m] = positions[self._refs[m, col + 1]]
+
+    def _applyPlan(self, r, plan):
+        if plan["kind"] != KIND_MARKUPS:
+            self._kinds[r] = plan["kind"]
+        for name, value in plan["params"].items():
+            self._params[r, _PARAM_COLUMN[name]] = value
+
+    def _visible(self, nodeID):
+        node = self.scene.GetNodeByID(nodeID)
+        d = node.GetDisplayNode() if node is not None else None
+        return not d or bool(d.GetVisibility())
+
+    def _onSceneClosed(self, caller, event):
+        self._plans = {}
+        self._labelsVersion = None
+
+
+_shared = None
+
+
+def shared_registry():
+    """Registry over FiducialIndex.shared_index(), shared by every PLATiN module."""
+    global _shared
+    index = FiducialIndex.shared_index()
+    if _shared is None or _shared.index is not index:
+        if _shared is not None:
+            _shared.release()
+        _shared = TrajectoryRegistry(index)
+    return _shared
@@ -1,7 +1,44 @@
 # -*- coding: utf-8 -*-
+import time
+_IMPORT_T0 = time.perf_counter()  # durata dell'import, vedi Tracing.note_startup in fondo
 import math, vtk, qt, ctk, slicer
 import json
 from slicer.ScriptedLoadableModule import *
+from PLATiNLib import FiducialIndex, Geometry, MeshTemplates, ResliceStack, SceneUtils, Tracing, Trajectories, TrajectoryRegistry
+
+
+# Parametri salvati dal pannello (savedTrajectoriesJSON) -> colonne del registro
+_SAVED_PARAM_COLUMNS = {
+    "LiTT": {"fiberDiameter": "fiberDiameterMm", "necStartOffset": "necStartOffsetMm",
+             "necDiameter": "necDiameterMm", "necLength": "necLengthMm"},
+    "SEEG": {"seegContacts": "contacts", "seegContactLen": "contactLenMm", "seegGapLen": "gapLenMm",
+             "seegContactRadius": "contactRadiusMm", "seegShaftRadius": "shaftRadiusMm"},
+}
+
+
+def _littBackend():
+    """TrajectoryFromPoints module of this folder, loaded once per session.
+
+    Reuses the module Slicer already imported from the same file; otherwise the file is
+    loaded by path (it does not need to be installed as a Slicer module) and kept in
+    sys.modules, so reopening the panel or reloading the planner does not run it again.
+    """
+    import importlib.util, os, sys
+    moduleFile = os.path.realpath(os.path.join(os.path.dirname(__file__), "TrajectoryFromPoints.py"))
+    for name in ("TrajectoryFromPoints", "PLATiN_TrajectoryFromPoints"):
+        module = sys.modules.get(name)
+        if module is not None and os.path.realpath(getattr(module, "__file__", None) or "") == moduleFile:
+            return module
+    if not os.path.exists(moduleFile):
+        raise FileNotFoundError(moduleFile)
+    t0 = time.perf_counter()
+    spec = importlib.util.spec_from_file_location("PLATiN_TrajectoryFromPoints", moduleFile)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[spec.name] = module
+    Tracing.note_startup("SEEG_LiTT_Planner", "LiTT backend", time.perf_counter() - t0)
+    return module
+
 
 class SEEG_LiTT_Planner(ScriptedLoadableModule):
     def __init__(self, parent):
@@ -23,6 +60,7 @@ class SEEG_LiTT_Planner(ScriptedLoadableModule):
 
 class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
     def setup(self):
+        t0 = time.perf_counter()
         ScriptedLoadableModuleWidget.setup(self)
 
         # --- Selettore modalità ---
@@ -89,6 +127,21 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
         self.layout.addWidget(self.generateBtn)
         self.updateBtn = qt.QPushButton("Update trajectory/necrosis")
         self.layout.addWidget(self.updateBtn)
+        self.liveFollowCheck = qt.QCheckBox("Live follow while dragging entry/target")
+        self.liveFollowCheck.toolTip = ("Re-plan the models (and the MPR, if created) in place while the entry/target "
+                                        "points are dragged; updates are coalesced to the display refresh rate")
+        self.layout.addWidget(self.liveFollowCheck)
+        self.meshQualityCombo = qt.QComboBox(); self.meshQualityCombo.addItems(["Final", "Preview"])
+        self.meshQualityCombo.toolTip = ("Tessellation of fibers, electrodes and necroses: the number of sides follows the radius "
+                                         "(chord error %.2f mm final, %.2f mm preview). Live follow always drags in preview "
+                                         "and rebuilds at this quality on release" % (MeshTemplates.CHORD_ERROR_MM["final"],
+                                                                                      MeshTemplates.CHORD_ERROR_MM["preview"]))
+        meshQualityW = qt.QWidget()
+        meshQualityL = qt.QHBoxLayout(meshQualityW)
+        meshQualityL.setContentsMargins(0,0,0,0)
+        meshQualityL.addWidget(qt.QLabel("Mesh quality:"))
+        meshQualityL.addWidget(self.meshQualityCombo, 1)
+        self.layout.addWidget(meshQualityW)
         self.littMprBtn = qt.QPushButton("Create MPR (LiTT)")
         self.layout.addWidget(self.littMprBtn)
         # --- MPR rotation sliders (LiTT): one per slice view ---
@@ -122,9 +175,34 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
         self.littMprRotateYellow.toolTip = "Rotate YELLOW MPR in-plane (degrees)"
         self.layout.addWidget(self.littMprRotateYellow)
 
+        # --- Fly-through: sezioni perpendicolari alla traiettoria (vista Red) da stack in cache ---
+        self.flyBtn = qt.QPushButton("Fly-through (Red view)")
+        self.flyBtn.toolTip = ("Resample once a thin volume aligned to the current trajectory (from the volume shown in "
+                               "the Red view) and browse its cross-sections; rebuilt only when entry/target move")
+        self.layout.addWidget(self.flyBtn)
+        self.flyStopCombo = qt.QComboBox(); self.flyStopCombo.enabled = False
+        self.flyStopCombo.toolTip = "Jump to the entry, a contact or the target"
+        self.flySlider = ctk.ctkSliderWidget()
+        self.flySlider.singleStep = 0.5
+        self.flySlider.decimals = 1
+        self.flySlider.minimum = 0.0
+        self.flySlider.maximum = 0.0
+        self.flySlider.suffix = " mm"
+        self.flySlider.enabled = False
+        self.flySlider.toolTip = "Distance from the entry along the trajectory"
+        flyW = qt.QWidget()
+        flyL = qt.QHBoxLayout(flyW)
+        flyL.setContentsMargins(0,0,0,0)
+        flyL.addWidget(self.flyStopCombo)
+        flyL.addWidget(self.flySlider, 1)
+        self.layout.addWidget(flyW)
+
         self.status = qt.QLabel("Ready")
         self.layout.addWidget(self.status)
 
+        # Tempi/memoria per stadio di Generate/Update (opt-in, condiviso con Trajectory Fusion)
+        self.tracePanel = Tracing.TracePanel(self.layout)
+
         # ========= SEEG =========
         self.seegBox = ctk.ctkCollapsibleButton(); self.seegBox.text = "SEEG parameters"
         self.layout.addWidget(self.seegBox)
@@ -162,6 +240,21 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
         self.seegElectrodeName = qt.QLineEdit(); self.seegElectrodeName.setPlaceholderText("es: SEEG A-A1 (12C)")
         seegForm.addRow("Electrode name:", self.seegElectrodeName)
 
+        # --- Impianto completo: tutte le coppie A / A_1 di un Markups in un solo passaggio ---
+        self.seegPlanSelector = slicer.qMRMLNodeComboBox()
+        self.seegPlanSelector.nodeTypes = ["vtkMRMLMarkupsFiducialNode"]
+        self.seegPlanSelector.selectNodeUponCreation = False
+        self.seegPlanSelector.noneEnabled = True
+        self.seegPlanSelector.addEnabled = False
+        self.seegPlanSelector.removeEnabled = False
+        self.seegPlanSelector.setMRMLScene(slicer.mrmlScene)
+        self.seegPlanSelector.setToolTip("Markups with all entry (A) / target (A_1) points of the implantation plan")
+        seegForm.addRow("Implantation plan:", self.seegPlanSelector)
+        self.seegImplantAllBtn = qt.QPushButton("Generate all electrodes")
+        self.seegImplantAllBtn.toolTip = ("Build every electrode of the selected Markups in one pass "
+                                          "(one shafts model + one contacts model; contacts suggested per electrode)")
+        seegForm.addRow(self.seegImplantAllBtn)
+
         self.seegMprBtn = qt.QPushButton("Create MPR (SEEG)")
         seegForm.addRow(self.seegMprBtn)
         # --- MPR rotation sliders (SEEG): one per slice view ---
@@ -182,6 +275,17 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
 
         # Signals
         self.generateBtn.clicked.connect(self.onGeneratete); self.updateBtn.clicked.connect(self.onUpdate)
+        self.seegImplantAllBtn.clicked.connect(self.onGenerateAllSEEG)
+        self._flyState = None
+        self.flyBtn.clicked.connect(self.onFlyThrough)
+        self.flySlider.valueChanged.connect(self.onFlyThroughMoved)
+        self.flyStopCombo.activated.connect(self.onFlyThroughStop)
+        self._liveTimer = None; self._liveObservers = []; self._liveState = None; self._mprFollow = False
+        self._livePreview = False  # modelli lasciati in qualità "preview" dall'ultimo drag
+        self._mprRotateTimer = None; self._mprFitTimer = None
+        self._mprPendingRotations = {}; self._mprRotatedViews = set()
+        self.liveFollowCheck.toggled.connect(self.onLiveFollowToggled)
+        self.planningType.currentIndexChanged.connect(lambda *_: self.liveFollowCheck.setChecked(False))
         try:
             self.littMprBtn.clicked.connect(self.onCreateMPR_LiTT)
             self.seegMprBtn.clicked.connect(self.onCreateMPR_SEEG)
@@ -212,15 +316,7 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
         # Logiche
         self.seegLogic = SEEG_LiTT_PlannerLogic()
         try:
-            # Robust local import (does not require TrajectoryFromPoints to be installed as a Slicer module)
-            import importlib.util, os, sys
-            moduleFile = os.path.join(os.path.dirname(__file__), "TrajectoryFromPoints.py")
-            if not os.path.exists(moduleFile):
-                raise FileNotFoundError(moduleFile)
-            spec = importlib.util.spec_from_file_location("PLATiN_TrajectoryFromPoints", moduleFile)
-            TFPMOD = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(TFPMOD)
-            self.littLogic = TFPMOD.TrajectoryFromPointsLogic()
+            self.littLogic = _littBackend().TrajectoryFromPointsLogic()
         except Exception as e:
             self.littLogic = None
             qt.QMessageBox.warning(
@@ -230,6 +326,8 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
                 "Make sure 'TrajectoryFromPoints.py' is in the same folder as this module.\n\n"
                 f"Details: {e}"
             )
+        Tracing.note_startup("SEEG_LiTT_Planner", "setup", time.perf_counter() - t0)
+
     def _readEntryTarget(self):
         # Lettura campi globali (pannello LiTT)
         entry=self.entryEdit.text.strip(); target=self.targetEdit.text.strip()
@@ -251,92 +349,140 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
         entry, target = (self._readSEEGEntryTarget() if ((self.planningType.currentText if hasattr(self.planningType, 'currentText') else self.planningType.currentText())=='SEEG') else self._readEntryTarget())
         if entry is None: return
         try:
-            if mode == "SEEG":
-                dist = self.seegLogic.distanceBetween(entry, target, self.onlyVisibleCheck.checked)
-                n_sug = self.seegLogic.suggestContacts(dist, [5,8,10,12,15,18], float(self.seegContactLen.value), float(self.seegGapLen.value))
-                try: self.seegSuggestion.setText(f"Suggestion: {n_sug} contatti per coprire {dist:.1f} mm")
-                except: pass
-                try: chosen = int(self.seegContactsCombo.currentText) if hasattr(self.seegContactsCombo, "currentText") else int(self.seegContactsCombo.currentText())
-                except: chosen = n_sug
-                self.seegLogic.runSEEG(
-                    entry, target, chosen,
-                    float(self.seegContactLen.value), float(self.seegGapLen.value),
-                    float(self.seegContactRadius.value), float(self.seegShaftRadius.value),
-                    self.fiberColor.color, self.necColor.color,
-                    self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
-                    self.onlyVisibleCheck.checked, self.overwriteCheck.checked, self.showLineCheck.checked,
-                    self.seegElectrodeName.text.strip()
-                )
-            else:
-                if not self.littLogic: raise RuntimeError("Modulo 'TrajectoryFromPoints' non trovato. Impossibile eseguire LiTT originale.")
-                offsets_txt=self.multiOffsetsEdit.text.strip()
-                if offsets_txt:
-                    self.littLogic.runMultipleNecrosis(
-                        entry, target, float(self.fiberDiameter.value), offsets_txt,
-                        float(self.necDiameter.value), float(self.necLength.value),
-                        self.fiberColor.color, self.necColor.color,
-                        self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
-                        self.onlyVisibleCheck.checked, self.overwriteCheck.checked, self.showLineCheck.checked
-                    )
-                else:
-                    self.littLogic.run(
-                        entry, target, float(self.fiberDiameter.value),
-                        float(self.necStartOffset.value), float(self.necDiameter.value), float(self.necLength.value),
-                        self.fiberColor.color, self.necColor.color,
-                        self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
-                        self.onlyVisibleCheck.checked, self.overwriteCheck.checked, self.showLineCheck.checked
-                    )
+            self._applyMeshQuality()
+            with Tracing.stage("Generate", "run", mode=mode):
+                self._generatePlan(mode, entry, target)
             try: slicer.util.resetThreeDViews()
             except: pass
             self.status.setText("OK")
         except Exception as e:
             slicer.util.errorDisplay(str(e))
+        self.tracePanel.refresh()
+
+    def _generatePlan(self, mode, entry, target):
+        """Build the SEEG electrode or the LiTT fiber/necrosis of entry->target (Generate button)."""
+        if mode == "SEEG":
+            dist = self.seegLogic.distanceBetween(entry, target, self.onlyVisibleCheck.checked)
+            n_sug = self.seegLogic.suggestContacts(dist, [5,8,10,12,15,18], float(self.seegContactLen.value), float(self.seegGapLen.value))
+            try: self.seegSuggestion.setText(f"Suggestion: {n_sug} contatti per coprire {dist:.1f} mm")
+            except: pass
+            try: chosen = int(self.seegContactsCombo.currentText) if hasattr(self.seegContactsCombo, "currentText") else int(self.seegContactsCombo.currentText())
+            except: chosen = n_sug
+            self.seegLogic.runSEEG(
+                entry, target, chosen,
+                float(self.seegContactLen.value), float(self.seegGapLen.value),
+                float(self.seegContactRadius.value), float(self.seegShaftRadius.value),
+                self.fiberColor.color, self.necColor.color,
+                self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
+                self.onlyVisibleCheck.checked, self.overwriteCheck.checked, self.showLineCheck.checked,
+                self.seegElectrodeName.text.strip()
+            )
+        else:
+            if not self.littLogic: raise RuntimeError("Modulo 'TrajectoryFromPoints' non trovato. Impossibile eseguire LiTT originale.")
+            offsets_txt=self.multiOffsetsEdit.text.strip()
+            if offsets_txt:
+                self.littLogic.runMultipleNecrosis(
+                    entry, target, float(self.fiberDiameter.value), offsets_txt,
+                    float(self.necDiameter.value), float(self.necLength.value),
+                    self.fiberColor.color, self.necColor.color,
+                    self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
+                    self.onlyVisibleCheck.checked, self.overwriteCheck.checked, self.showLineCheck.checked
+                )
+            else:
+                self.littLogic.run(
+                    entry, target, float(self.fiberDiameter.value),
+                    float(self.necStartOffset.value), float(self.necDiameter.value), float(self.necLength.value),
+                    self.fiberColor.color, self.necColor.color,
+                    self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
+                    self.onlyVisibleCheck.checked, self.overwriteCheck.checked, self.showLineCheck.checked
+                )
 
     def onUpdate(self):
         mode = self.planningType.currentText if hasattr(self.planningType, "currentText") else self.planningType.currentText()
         entry, target = (self._readSEEGEntryTarget() if ((self.planningType.currentText if hasattr(self.planningType, 'currentText') else self.planningType.currentText())=='SEEG') else self._readEntryTarget())
         if entry is None: return
         try:
-            if mode == "SEEG":
-                dist = self.seegLogic.distanceBetween(entry, target, self.onlyVisibleCheck.checked)
-                n_sug = self.seegLogic.suggestContacts(dist, [5,8,10,12,15,18], float(self.seegContactLen.value), float(self.seegGapLen.value))
-                try: self.seegSuggestion.setText(f"Suggestion: {n_sug} contatti per coprire {dist:.1f} mm")
-                except: pass
-                try: chosen = int(self.seegContactsCombo.currentText) if hasattr(self.seegContactsCombo, "currentText") else int(self.seegContactsCombo.currentText())
-                except: chosen = n_sug
-                self.seegLogic.runSEEG(
-                    entry, target, chosen,
-                    float(self.seegContactLen.value), float(self.seegGapLen.value),
-                    float(self.seegContactRadius.value), float(self.seegShaftRadius.value),
+            with Tracing.stage("Update", "run", mode=mode):
+                self._updatePlan(mode, entry, target)
+            try: slicer.util.resetThreeDViews()
+            except: pass
+            self.status.setText("OK")
+        except Exception as e:
+            slicer.util.errorDisplay(str(e))
+        self.tracePanel.refresh()
+
+    def _meshQuality(self):
+        return "preview" if self.meshQualityCombo.currentIndex == 1 else "final"
+
+    def _applyMeshQuality(self, quality=None):
+        """Set the tessellation quality of both logics (default: the Mesh quality combo)."""
+        quality = quality or self._meshQuality()
+        for logic in (self.seegLogic, self.littLogic):
+            if logic is not None:
+                logic.meshQuality = quality
+
+    def _updatePlan(self, mode, entry, target, quality=None):
+        """Re-plan the current SEEG/LiTT trajectory in place (Update button and live follow)."""
+        self._applyMeshQuality(quality)
+        if mode == "SEEG":
+            dist = self.seegLogic.distanceBetween(entry, target, self.onlyVisibleCheck.checked)
+            n_sug = self.seegLogic.suggestContacts(dist, [5,8,10,12,15,18], float(self.seegContactLen.value), float(self.seegGapLen.value))
+            try: self.seegSuggestion.setText(f"Suggestion: {n_sug} contatti per coprire {dist:.1f} mm")
+            except: pass
+            try: chosen = int(self.seegContactsCombo.currentText) if hasattr(self.seegContactsCombo, "currentText") else int(self.seegContactsCombo.currentText())
+            except: chosen = n_sug
+            self.seegLogic.updateSEEG(
+                entry, target, chosen,
+                float(self.seegContactLen.value), float(self.seegGapLen.value),
+                float(self.seegContactRadius.value), float(self.seegShaftRadius.value),
+                self.fiberColor.color, self.necColor.color,
+                self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
+                self.onlyVisibleCheck.checked, self.showLineCheck.checked,
+                self.seegElectrodeName.text.strip()
+            )
+        else:
+            if not self.littLogic: raise RuntimeError("Modulo 'TrajectoryFromPoints' non trovato. Impossibile eseguire LiTT originale.")
+            offsets_txt=self.multiOffsetsEdit.text.strip()
+            if offsets_txt:
+                self.littLogic.updateMultipleNecrosis(
+                    entry, target, float(self.fiberDiameter.value), offsets_txt,
+                    float(self.necDiameter.value), float(self.necLength.value),
                     self.fiberColor.color, self.necColor.color,
                     self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
-                    self.onlyVisibleCheck.checked, True, self.showLineCheck.checked,
-                    self.seegElectrodeName.text.strip()
+                    self.onlyVisibleCheck.checked, self.showLineCheck.checked
                 )
             else:
-                if not self.littLogic: raise RuntimeError("Modulo 'TrajectoryFromPoints' non trovato. Impossibile eseguire LiTT originale.")
-                offsets_txt=self.multiOffsetsEdit.text.strip()
-                if offsets_txt:
-                    self.littLogic.runMultipleNecrosis(
-                        entry, target, float(self.fiberDiameter.value), offsets_txt,
-                        float(self.necDiameter.value), float(self.necLength.value),
-                        self.fiberColor.color, self.necColor.color,
-                        self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
-                        self.onlyVisibleCheck.checked, True, self.showLineCheck.checked
-                    )
-                else:
-                    self.littLogic.run(
-                        entry, target, float(self.fiberDiameter.value),
-                        float(self.necStartOffset.value), float(self.necDiameter.value), float(self.necLength.value),
-                        self.fiberColor.color, self.necColor.color,
-                        self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
-                        self.onlyVisibleCheck.checked, True, self.showLineCheck.checked
-                    )
+                self.littLogic.update(
+                    entry, target, float(self.fiberDiameter.value),
+                    float(self.necStartOffset.value), float(self.necDiameter.value), float(self.necLength.value),
+                    self.fiberColor.color, self.necColor.color,
+                    self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
+                    self.onlyVisibleCheck.checked, self.showLineCheck.checked
+                )
+
+    def onGenerateAllSEEG(self):
+        planNode = self.seegPlanSelector.currentNode()
+        if planNode is None:
+            slicer.util.errorDisplay("Seleziona il Markups con il piano di impianto.")
+            return
+        try:
+            self._applyMeshQuality()
+            with Tracing.stage("Generate all electrodes", "run") as traced:
+                shaftsNode, contactsNode, electrodes = self.seegLogic.runSEEGBatch(
+                    planNode,
+                    float(self.seegContactLen.value), float(self.seegGapLen.value),
+                    float(self.seegContactRadius.value), float(self.seegShaftRadius.value),
+                    self.fiberColor.color, self.necColor.color,
+                    self.baseName.text.strip() or f"SEEG {planNode.GetName()}",
+                    self.overwriteCheck.checked
+                )
+                traced["electrodes"] = len(electrodes)
             try: slicer.util.resetThreeDViews()
             except: pass
-            self.status.setText("OK")
+            self.status.setText(f"{len(electrodes)} electrodes: {shaftsNode.GetName()}, {contactsNode.GetName()}")
         except Exception as e:
             slicer.util.errorDisplay(str(e))
+        self.tracePanel.refresh()
 
     def onCreateMPR_LiTT(self):
         entry, target = self._readEntryTarget()
@@ -344,6 +490,7 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
             return
         try:
             self.seegLogic.createTrajectoryMPR(entry, target, self.onlyVisibleCheck.checked)
+            self._mprFollow = True
             self._setMPRRotationEnabled(True)
             self._resetMPRRotationSliders()
         except Exception as e:
@@ -355,11 +502,149 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
             return
         try:
             self.seegLogic.createTrajectoryMPR(entry, target, self.onlyVisibleCheck.checked)
+            self._mprFollow = True
             self._setMPRRotationEnabled(True)
             self._resetMPRRotationSliders()
         except Exception as e:
             slicer.util.errorDisplay(str(e))
 
+    # ------------------------------------------------------------------
+    # Fly-through along the trajectory (cached oblique stack)
+    # ------------------------------------------------------------------
+    def onFlyThrough(self):
+        mode = self._currentMode()
+        entry, target = self._readSEEGEntryTarget() if mode == "SEEG" else self._readEntryTarget()
+        if entry is None:
+            return
+        try:
+            if mode == "SEEG":
+                try: nContacts = int(self.seegContactsCombo.currentText)
+                except Exception: nContacts = 0
+                stops = self.seegLogic.flyThroughStops(entry, target, self.onlyVisibleCheck.checked, nContacts,
+                                                       float(self.seegContactLen.value), float(self.seegGapLen.value))
+            else:
+                stops = self.seegLogic.flyThroughStops(entry, target, self.onlyVisibleCheck.checked)
+            self._flyState = None
+            stack = self.seegLogic.flyThroughTo(entry, target, 0.0, searchOnlyVisible=self.onlyVisibleCheck.checked)
+            self._flyState = (entry, target, stops)
+            self.flyStopCombo.clear()
+            for name, d in stops:
+                self.flyStopCombo.addItem(f"{name} ({d:.1f} mm)")
+            self.flySlider.blockSignals(True)
+            self.flySlider.maximum = stack["length"]
+            self.flySlider.value = 0.0
+            self.flySlider.blockSignals(False)
+            self.flySlider.enabled = True; self.flyStopCombo.enabled = True
+            self.status.setText(f"Fly-through: {stack['node'].GetName()}")
+        except Exception as e:
+            slicer.util.errorDisplay(str(e))
+
+    def onFlyThroughMoved(self, value):
+        if self._flyState is None:
+            return
+        entry, target, _ = self._flyState
+        try:
+            stack = self.seegLogic.flyThroughTo(entry, target, float(value), searchOnlyVisible=self.onlyVisibleCheck.checked)
+            if abs(stack["length"] - float(self.flySlider.maximum)) > 1e-6:
+                self.flySlider.maximum = stack["length"]  # punti spostati: stack ricostruito
+        except Exception as e:
+            self.status.setText(f"Fly-through: {e}")
+
+    def onFlyThroughStop(self, index):
+        if self._flyState is None or not (0 <= index < len(self._flyState[2])):
+            return
+        self.flySlider.value = self._flyState[2][index][1]
+
+    # ------------------------------------------------------------------
+    # Live follow: re-plan while the entry/target points are dragged
+    # ------------------------------------------------------------------
+    def cleanup(self):
+        self._stopLiveFollow()
+        for timer in (self._mprRotateTimer, self._mprFitTimer):
+            if timer is not None:
+                timer.stop()
+
+    @staticmethod
+    def _liveIntervalMs():
+        """One refresh period of the primary screen (60 Hz if unknown)."""
+        try:
+            hz = float(qt.QGuiApplication.primaryScreen().refreshRate())
+        except Exception:
+            hz = 60.0
+        return max(8, int(1000.0 / (hz if hz > 1.0 else 60.0)))
+
+    def onLiveFollowToggled(self, enabled):
+        self._stopLiveFollow()
+        if not enabled:
+            return
+        mode = self._currentMode()
+        if mode == "SEEG":
+            entry, target = self.seegEntryEdit.text.strip(), self.seegTargetEdit.text.strip()
+        else:
+            entry, target = self.entryEdit.text.strip(), self.targetEdit.text.strip()
+        try:
+            if not entry or not target:
+                raise RuntimeError("set the entry/target labels first")
+            hits = [self.seegLogic._findPointByLabel(label, self.onlyVisibleCheck.checked) for label in (entry, target)]
+        except Exception as e:
+            self.status.setText(f"Live follow: {e}")
+            self.liveFollowCheck.blockSignals(True)
+            self.liveFollowCheck.checked = False
+            self.liveFollowCheck.blockSignals(False)
+            return
+
+        self._liveState = (mode, entry, target)
+        for node in {hit[1].GetID(): hit[1] for hit in hits}.values():
+            self._liveObservers.append((node, node.AddObserver(node.PointModifiedEvent, self._onLivePointModified)))
+            self._liveObservers.append((node, node.AddObserver(node.PointEndInteractionEvent, self._onLiveInteractionEnded)))
+        if self._liveTimer is None:
+            # Single-shot: events arriving while a rebuild is pending are merged into it
+            self._liveTimer = qt.QTimer()
+            self._liveTimer.setSingleShot(True)
+            self._liveTimer.timeout.connect(self._onLiveTick)
+        self._liveTimer.setInterval(self._liveIntervalMs())
+        self.status.setText(f"Live follow: {entry} \u2192 {target}")
+
+    def _stopLiveFollow(self):
+        for node, tag in self._liveObservers:
+            node.RemoveObserver(tag)
+        self._liveObservers = []
+        self._liveState = None
+        if self._liveTimer is not None:
+            self._liveTimer.stop()
+
+    @vtk.calldata_type(vtk.VTK_INT)
+    def _onLivePointModified(self, caller, event, index):
+        if self._liveState is None or self._liveTimer.isActive():
+            return
+        if index is not None and 0 <= index < caller.GetNumberOfControlPoints() \
+                and caller.GetNthControlPointLabel(index) not in self._liveState[1:]:
+            return
+        self._liveTimer.start()
+
+    def _onLiveInteractionEnded(self, caller, event):
+        # Rilascio del punto: ricostruzione alla qualità scelta (durante il drag si usa "preview")
+        if self._liveState is None or not (self._liveTimer.isActive() or self._livePreview):
+            return
+        self._liveTimer.stop()
+        self._onLiveTick(self._meshQuality())
+
+    def _onLiveTick(self, quality="preview"):
+        if self._liveState is None:
+            return
+        mode, entry, target = self._liveState
+        try:
+            self._updatePlan(mode, entry, target, quality)
+            self._livePreview = quality != self._meshQuality()
+            if self._mprFollow:
+                self.seegLogic.createTrajectoryMPR(entry, target, self.onlyVisibleCheck.checked, interactive=True)
+                for sliceName, slider in (("Red", self.littMprRotateRed), ("Green", self.littMprRotateGreen),
+                                          ("Yellow", self.littMprRotateYellow)):
+                    if float(slider.value) != 0.0:
+                        self.seegLogic.rotateTrajectoryMPRInPlane(sliceName, float(slider.value), interactive=True)
+        except Exception as e:
+            self.status.setText(f"Live follow: {e}")
+
     # ------------------------------------------------------------------
     # MPR rotation UI helpers (Widget)
     # ------------------------------------------------------------------
@@ -384,6 +669,7 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
 
     def _resetMPRRotationSliders(self):
         """Reset all sliders to 0° without triggering callbacks."""
+        self._mprPendingRotations = {}
         for w in self._allMprRotationSliders():
             if w is None:
                 continue
@@ -398,14 +684,46 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
                 except Exception:
                     pass
 
+    # Pausa (ms) dopo l'ultimo valore dello slider prima di rifare FitSliceToAll
+    MPR_FIT_DELAY_MS = 250
+
     def onMPRPlaneRotationChanged(self, sliceName: str, value):
-        """Rotate a single MPR view in-plane (0..360°) after MPR creation."""
+        """Rotate a single MPR view in-plane (0..360°) after MPR creation.
+
+        Slider values are coalesced: the latest angle of each view is applied at most once
+        per display refresh, without re-fitting; the rotated views are fitted once the
+        slider has been still for MPR_FIT_DELAY_MS.
+        """
+        self._mprPendingRotations[sliceName] = float(value)
+        if self._mprRotateTimer is None:
+            self._mprRotateTimer = qt.QTimer()
+            self._mprRotateTimer.setSingleShot(True)
+            self._mprRotateTimer.timeout.connect(self._applyPendingMPRRotations)
+            self._mprFitTimer = qt.QTimer()
+            self._mprFitTimer.setSingleShot(True)
+            self._mprFitTimer.setInterval(self.MPR_FIT_DELAY_MS)
+            self._mprFitTimer.timeout.connect(self._fitRotatedMPRViews)
+        if not self._mprRotateTimer.isActive():
+            self._mprRotateTimer.setInterval(self._liveIntervalMs())
+            self._mprRotateTimer.start()
+        self._mprFitTimer.start()  # riavviato a ogni valore: scatta a slider fermo
+
+    def _applyPendingMPRRotations(self):
+        pending, self._mprPendingRotations = self._mprPendingRotations, {}
         try:
-            if hasattr(self, "seegLogic") and self.seegLogic:
-                self.seegLogic.rotateTrajectoryMPRInPlane(sliceName, float(value))
+            for sliceName, angle in pending.items():
+                self.seegLogic.rotateTrajectoryMPRInPlane(sliceName, angle, interactive=True)
+                self._mprRotatedViews.add(sliceName)
         except Exception as e:
             slicer.util.errorDisplay(str(e))
 
+    def _fitRotatedMPRViews(self):
+        if self._mprPendingRotations:
+            self._applyPendingMPRRotations()
+        views, self._mprRotatedViews = sorted(self._mprRotatedViews), set()
+        if views:
+            self.seegLogic.fitTrajectoryMPR(views)
+
 
 
 
@@ -448,8 +766,25 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
             # fallback: do nothing if serialization fails
             pass
 
+    def _registerSavedPlans(self, d):
+        """Give the registry the saved trajectories not planned in this session (e.g. after loading a scene)."""
+        registry = TrajectoryRegistry.shared_registry()
+        for mode, kind in (("LiTT", TrajectoryRegistry.KIND_LITT), ("SEEG", TrajectoryRegistry.KIND_SEEG)):
+            for name, params in d.get(mode, {}).items():
+                entry, target = params.get("entry", ""), params.get("target", "")
+                if not entry or not target or registry.is_planned(entry, target):
+                    continue
+                columns = {}
+                for key, column in _SAVED_PARAM_COLUMNS[mode].items():
+                    try:
+                        columns[column] = float(params[key])
+                    except (KeyError, TypeError, ValueError):
+                        pass
+                registry.register(name, entry, target, kind, **columns)
+
     def _refreshSavedCombos(self):
         d = self._readSavedDict()
+        self._registerSavedPlans(d)
         try:
             self.littSavedCombo.blockSignals(True)
             self.seegSavedCombo.blockSignals(True)
@@ -640,32 +975,44 @@ class SEEG_LiTT_PlannerWidget(ScriptedLoadableModuleWidget):
         try: self.status.setText(f"Loaded SEEG: {name}")
         except: pass
 class SEEG_LiTT_PlannerLogic(ScriptedLoadableModuleLogic):
+    # Riferimenti dalla linea ai modelli generati (usati dall'aggiornamento in place)
+    ELECTRODE_REFERENCE = "PLATiNElectrode"
+    CONTACTS_REFERENCE = "PLATiNContacts"
+    # Qualità della tessellazione (MeshTemplates.CHORD_ERROR_MM): "preview" o "final"
+    meshQuality = MeshTemplates.DEFAULT_QUALITY
+
     # -------- Utilities comuni --------
 
 
     def _findPointByLabel(self, label, onlyVisible):
-        nodes = slicer.util.getNodesByClass("vtkMRMLMarkupsFiducialNode")
-        if not nodes:
-            raise RuntimeError("Nessun Markups Fiducial in scena.")
-        for n in nodes:
-            if onlyVisible:
-                d=n.GetDisplayNode()
-                if d and not d.GetVisibility(): 
-                    continue
-            for i in range(n.GetNumberOfControlPoints()):
-                if n.GetNthControlPointLabel(i) == label:
-                    p = [0.0,0.0,0.0]; n.GetNthControlPointPositionWorld(i, p)
-                    return p, n, i
-        raise RuntimeError(f"Punto '{label}' non trovato.")
+        # Indice label -> punto mantenuto dagli observer dei Markups (nessuna scansione lineare)
+        with Tracing.stage("point lookup", points=1):
+            index = FiducialIndex.shared_index()
+            if not index.numberOfNodes:
+                raise RuntimeError("Nessun Markups Fiducial in scena.")
+            hit = index.find(label, onlyVisible)
+        if hit is None:
+            raise RuntimeError(f"Punto '{label}' non trovato.")
+        return hit
+
+    def _endpoints(self, entryLabel, targetLabel, onlyVisible):
+        """(pEntry, pTarget) from the trajectory registry; missing or hidden points go through _findPointByLabel."""
+        with Tracing.stage("point lookup", points=2):
+            hit = TrajectoryRegistry.shared_registry().endpoints(entryLabel, targetLabel, onlyVisible)
+        if hit is None:
+            return self._findPointByLabel(entryLabel, onlyVisible)[0], self._findPointByLabel(targetLabel, onlyVisible)[0]
+        return hit
 
     def _unit(self, v):
-        l = math.sqrt(v[0]*v[0] + v[1]*v[1] + v[2]*v[2])
-        if l < 1e-9:
-            return [0.0,0.0,1.0]
-        return [v[0]/l, v[1]/l, v[2]/l]
+        return Geometry.unit(v).tolist()
 
     def _setSliceNodeToReformat(self, sliceNode):
         """Set slice node orientation to 'Reformat' in a Slicer-version-safe way."""
+        try:
+            if sliceNode.GetOrientation() == "Reformat":
+                return  # già in Reformat: nessun Modified a ogni tick degli slider
+        except Exception:
+            pass
         if hasattr(sliceNode, 'SetOrientationToReformat'):
             sliceNode.SetOrientationToReformat()
             return
@@ -776,19 +1123,42 @@ class SEEG_LiTT_PlannerLogic(ScriptedLoadableModuleLogic):
         displayNode.SetOpacity(opacity)
         displayNode.SetSelectedColor(*rgb)
 
-    def _rot_z_to_vec(self, u):
-        # Calcola rotazione che porta l'asse Z sull'asse u
-        import numpy as np
-        uz = np.array([0.0,0.0,1.0]); v = np.array(u, dtype=float)
-        v = v / (np.linalg.norm(v) + 1e-12)
-        axis = np.cross(uz, v); s = np.linalg.norm(axis); c = float(np.dot(uz, v))
-        if s < 1e-12:
-            return (0.0, [0,0,1])
-        axis = list(axis / s)
-        angle_deg = math.degrees(math.atan2(s, c))
-        return (angle_deg, axis)
-
-    def createTrajectoryMPR(self, entryLabel, targetLabel, searchOnlyVisible=False):
+    MPR_SLICES = ("Red", "Green", "Yellow")
+
+    def _mprBasis(self, pEntry, pTarget):
+        """(axis, v, w): trajectory axis and the two across-axis directions of the MPR."""
+        axis, v, w = Geometry.mpr_basis(pEntry, pTarget)
+        return axis.tolist(), v.tolist(), w.tolist()
+
+    def _mprSliceToRAS(self, axis, v, w, center, mirror=True):
+        """SliceToRAS (3x4x4 NumPy) of the Red/Green/Yellow MPR views (Geometry.mpr_slice_to_ras)."""
+        return Geometry.mpr_slice_to_ras(axis, v, w, center, mirror=mirror)
+
+    def _pushSliceToRAS(self, sliceNode, M):
+        """Write a 4x4 NumPy SliceToRAS into sliceNode: one matrix copy, one UpdateMatrices."""
+        flat = [float(x) for x in M.ravel()]
+        try:
+            sliceNode.GetSliceToRAS().DeepCopy(flat)
+        except Exception:
+            m = vtk.vtkMatrix4x4(); m.DeepCopy(flat)
+            self._setSliceToRASMatrix(sliceNode, m)
+        sliceNode.UpdateMatrices()
+
+    def _mprSliceWidget(self, sliceName):
+        lm = slicer.app.layoutManager()
+        return lm.sliceWidget(sliceName) if lm else None
+
+    def fitTrajectoryMPR(self, sliceNames=None):
+        """FitSliceToAll on the given MPR views (default: all three), e.g. once a rotation slider settles."""
+        for sliceName in (sliceNames or self.MPR_SLICES):
+            sw = self._mprSliceWidget(sliceName)
+            if sw:
+                try:
+                    sw.sliceLogic().FitSliceToAll()
+                except Exception:
+                    pass
+
+    def createTrajectoryMPR(self, entryLabel, targetLabel, searchOnlyVisible=False, interactive=False):
         """Create 3 orthogonal MPR slice orientations based on the trajectory entry->target.
 
         Red:    plane perpendicular to trajectory (normal = axis)
@@ -796,22 +1166,10 @@ class SEEG_LiTT_PlannerLogic(ScriptedLoadableModuleLogic):
         Yellow: plane parallel to axis and orthogonal to Green (normal = w)
 
         Slice origin is set at the trajectory midpoint.
+        interactive=True (live follow while dragging) skips FitSliceToAll and the 3D view reset.
         """
-        pEntry,_,_ = self._findPointByLabel(entryLabel, searchOnlyVisible)
-        pTarget,_,_ = self._findPointByLabel(targetLabel, searchOnlyVisible)
-
-        axis = self._unit([pTarget[0]-pEntry[0], pTarget[1]-pEntry[1], pTarget[2]-pEntry[2]])
-
-        # Choose a reference not collinear with axis
-        ref = [0.0, 0.0, 1.0]
-        if abs(axis[0]*ref[0] + axis[1]*ref[1] + axis[2]*ref[2]) > 0.95:
-            ref = [0.0, 1.0, 0.0]
-
-        def cross(a,b):
-            return [a[1]*b[2]-a[2]*b[1], a[2]*b[0]-a[0]*b[2], a[0]*b[1]-a[1]*b[0]]
-
-        v = self._unit(cross(axis, ref))
-        w = self._unit(cross(axis, v))
+        pEntry, pTarget = self._endpoints(entryLabel, targetLabel, searchOnlyVisible)
+        axis, v, w = self._mprBasis(pEntry, pTarget)
 
         center = [(pEntry[0]+pTarget[0])*0.5, (pEntry[1]+pTarget[1])*0.5, (pEntry[2]+pTarget[2])*0.5]
 
@@ -823,215 +1181,236 @@ class SEEG_LiTT_PlannerLogic(ScriptedLoadableModuleLogic):
         self._mprAngleDeg = 0.0
         self._mprBaseSliceToRAS = {}
 
-        def setSlice(sliceName, normal, transverse):
-            lm = slicer.app.layoutManager()
-            sw = lm.sliceWidget(sliceName) if lm else None
+        # Green/Yellow: transverse and normal flipped together to remove the left-right
+        # mirroring while keeping the same plane and a right-handed SliceToRAS (Red unchanged)
+        frames = self._mprSliceToRAS(axis, v, w, center, mirror=True)
+
+        for sliceName, M in zip(self.MPR_SLICES, frames):
+            sw = self._mprSliceWidget(sliceName)
             if not sw:
                 raise RuntimeError("Slice views not available (no layout manager).")
             sliceNode = sw.mrmlSliceNode()
             self._setSliceNodeToReformat(sliceNode)
+            self._pushSliceToRAS(sliceNode, M)
+            # Baseline for in-plane rotations
+            self._mprBaseSliceToRAS[sliceName] = M
+            if not interactive:
+                try:
+                    sw.sliceLogic().FitSliceToAll()
+                except Exception:
+                    pass
 
-            n = self._unit(normal)
-            t = self._unit(transverse)
-
-            # IMPORTANT: Fix only the GREEN and YELLOW slice left-right mirroring.
-            # We keep the same reformat plane (changing normal sign does not change the plane),
-            # and we do NOT touch RED behavior.
-            # Flipping X (transverse) alone would create a left-handed basis; therefore we also
-            # flip Z (normal) to preserve a right-handed SliceToRAS while removing the mirror.
-            if sliceName in ("Green", "Yellow"):
-                t = [-t[0], -t[1], -t[2]]
-                n = [-n[0], -n[1], -n[2]]
-
-            y = self._unit(cross(n, t))
-
-            m = vtk.vtkMatrix4x4()
-            # Columns: X(transverse), Y, Z(normal), Origin
-            m.SetElement(0,0, t[0]); m.SetElement(1,0, t[1]); m.SetElement(2,0, t[2]); m.SetElement(3,0, 0.0)
-            m.SetElement(0,1, y[0]); m.SetElement(1,1, y[1]); m.SetElement(2,1, y[2]); m.SetElement(3,1, 0.0)
-            m.SetElement(0,2, n[0]); m.SetElement(1,2, n[1]); m.SetElement(2,2, n[2]); m.SetElement(3,2, 0.0)
-            m.SetElement(0,3, center[0]); m.SetElement(1,3, center[1]); m.SetElement(2,3, center[2]); m.SetElement(3,3, 1.0)
-
-            # Set SliceToRAS in a Slicer-version-tolerant way
-            self._setSliceToRASMatrix(sliceNode, m)
-            sliceNode.UpdateMatrices()
-            # Keep a copy as baseline for in-plane rotations
+            # Center the view on the trajectory immediately.
+            # This does NOT change the plane/orientation; it only moves the slice offset.
             try:
-                baseM = vtk.vtkMatrix4x4(); baseM.DeepCopy(sliceNode.GetSliceToRAS())
-                self._mprBaseSliceToRAS[sliceName] = baseM
+                # Prefer slice node API if available
+                if hasattr(sliceNode, "JumpSliceByCentering"):
+                    sliceNode.JumpSliceByCentering(center[0], center[1], center[2])
+                elif hasattr(sliceNode, "JumpSlice"):
+                    sliceNode.JumpSlice(center[0], center[1], center[2])
+                else:
+                    sw.sliceLogic().JumpSliceByCentering(center[0], center[1], center[2])
             except Exception:
                 pass
+
+        if not interactive:
             try:
-                sw.sliceLogic().FitSliceToAll()
+                slicer.util.resetThreeDViews()
             except Exception:
                 pass
 
-            # Center the view on the trajectory immediately (Green/Yellow/Red).
-            # This does NOT change the plane/orientation; it only moves the slice offset.
-            if sliceName in ("Green", "Yellow", "Red"):
-                try:
-                    # Prefer slice node API if available
-                    if hasattr(sliceNode, "JumpSliceByCentering"):
-                        sliceNode.JumpSliceByCentering(center[0], center[1], center[2])
-                    elif hasattr(sliceNode, "JumpSlice"):
-                        sliceNode.JumpSlice(center[0], center[1], center[2])
-                    else:
-                        sw.sliceLogic().JumpSliceByCentering(center[0], center[1], center[2])
-                except Exception:
-                    pass
-
-        setSlice("Red", axis, v)
-        setSlice("Green", v, axis)
-        setSlice("Yellow", w, axis)
-
-        try:
-            slicer.util.resetThreeDViews()
-        except Exception:
-            pass
-
 
     # -------- SEEG --------
     
 
-    def _rotateAroundAxis(self, vec, axis, angleRad):
-        # Rodrigues' rotation formula
-        ax = self._unit(axis)
-        v = vec
-        c = math.cos(angleRad)
-        s = math.sin(angleRad)
-        dot = v[0]*ax[0] + v[1]*ax[1] + v[2]*ax[2]
-        cross = [ax[1]*v[2]-ax[2]*v[1], ax[2]*v[0]-ax[0]*v[2], ax[0]*v[1]-ax[1]*v[0]]
-        return [
-            v[0]*c + cross[0]*s + ax[0]*dot*(1.0-c),
-            v[1]*c + cross[1]*s + ax[1]*dot*(1.0-c),
-            v[2]*c + cross[2]*s + ax[2]*dot*(1.0-c),
-        ]
-
-
-    def rotateTrajectoryMPRInPlane(self, sliceName: str, angleDeg: float):
+    def rotateTrajectoryMPRInPlane(self, sliceName: str, angleDeg: float, interactive=False):
         """Rotate a single slice view *within its own plane* (0..360°).
 
         This rotates the in-plane X/Y axes around the slice normal (Z axis of SliceToRAS),
-        keeping the normal and the slice position unchanged.
+        keeping the normal and the slice position unchanged: SliceToRAS = base @ Rz(angle),
+        pushed with one matrix update. interactive=True (slider being dragged) skips
+        FitSliceToAll; call fitTrajectoryMPR once the rotation settles.
 
         Works only after createTrajectoryMPR has been called at least once.
         """
-        if not hasattr(self, "_mprBaseSliceToRAS") or sliceName not in self._mprBaseSliceToRAS:
+        import numpy as np
+        base = getattr(self, "_mprBaseSliceToRAS", {}).get(sliceName)
+        if base is None:
             return
-
-        lm = slicer.app.layoutManager()
-        sw = lm.sliceWidget(sliceName) if lm else None
+        sw = self._mprSliceWidget(sliceName)
         if not sw:
             return
         sliceNode = sw.mrmlSliceNode()
         self._setSliceNodeToReformat(sliceNode)
 
-        base = self._mprBaseSliceToRAS[sliceName]
-
-        # Extract base X and Y axes (columns 0 and 1), Z axis stays the same
-        x0 = [base.GetElement(0,0), base.GetElement(1,0), base.GetElement(2,0)]
-        y0 = [base.GetElement(0,1), base.GetElement(1,1), base.GetElement(2,1)]
-        z0 = [base.GetElement(0,2), base.GetElement(1,2), base.GetElement(2,2)]
-        o0 = [base.GetElement(0,3), base.GetElement(1,3), base.GetElement(2,3)]
-
         a = math.radians(float(angleDeg))
-        c = math.cos(a)
-        s = math.sin(a)
-
-        # Post-multiply by Rz(angle) in slice coordinates:
-        # newX = X*c + Y*s
-        # newY = X*(-s) + Y*c
-        x = [x0[0]*c + y0[0]*s, x0[1]*c + y0[1]*s, x0[2]*c + y0[2]*s]
-        y = [x0[0]*(-s) + y0[0]*c, x0[1]*(-s) + y0[1]*c, x0[2]*(-s) + y0[2]*c]
-
-        m = vtk.vtkMatrix4x4()
-        m.Identity()
-        m.SetElement(0,0, x[0]); m.SetElement(1,0, x[1]); m.SetElement(2,0, x[2])
-        m.SetElement(0,1, y[0]); m.SetElement(1,1, y[1]); m.SetElement(2,1, y[2])
-        m.SetElement(0,2, z0[0]); m.SetElement(1,2, z0[1]); m.SetElement(2,2, z0[2])
-        m.SetElement(0,3, o0[0]); m.SetElement(1,3, o0[1]); m.SetElement(2,3, o0[2])
-        m.SetElement(3,3, 1.0)
-
-        self._setSliceToRASMatrix(sliceNode, m)
-        sliceNode.UpdateMatrices()
-        try:
-            sw.sliceLogic().FitSliceToAll()
-        except Exception:
-            pass
-
-
-    def rotateTrajectoryMPR(self, angleDeg):
+        c, s = math.cos(a), math.sin(a)
+        # newX = X*c + Y*s, newY = -X*s + Y*c
+        Rz = np.array([[c, -s, 0.0, 0.0],
+                       [s, c, 0.0, 0.0],
+                       [0.0, 0.0, 1.0, 0.0],
+                       [0.0, 0.0, 0.0, 1.0]])
+        self._pushSliceToRAS(sliceNode, base @ Rz)
+        if not interactive:
+            self.fitTrajectoryMPR([sliceName])
+
+
+    def rotateTrajectoryMPR(self, angleDeg, interactive=False):
         """Rotate the current MPR around the stored trajectory axis.
 
         This only affects slice orientations; it does not modify any markup/trajectory objects.
         Has effect only after createTrajectoryMPR has been called at least once.
+        interactive=True skips FitSliceToAll.
         """
+        import numpy as np
         if not hasattr(self, "_mprAxis") or self._mprAxis is None:
             return
 
         self._mprAngleDeg = float(angleDeg)
         angleRad = math.radians(self._mprAngleDeg)
 
-        axis = self._mprAxis
-        center = getattr(self, "_mprCenter", [0.0, 0.0, 0.0])
-        v0 = self._mprV0
-        w0 = self._mprW0
-
-        v = self._unit(self._rotateAroundAxis(v0, axis, angleRad))
-        w = self._unit(self._rotateAroundAxis(w0, axis, angleRad))
-
-        def cross(a,b):
-            return [a[1]*b[2]-a[2]*b[1], a[2]*b[0]-a[0]*b[2], a[0]*b[1]-a[1]*b[0]]
+        # Rodrigues: v0 e w0 ruotati attorno all'asse in un'unica moltiplicazione
+        k = Geometry.unit(self._mprAxis)
+        v, w = np.array([self._mprV0, self._mprW0], dtype=float) @ Geometry.rotation_matrix(k, angleRad).T
 
-        def setSlice(sliceName, normal, transverse):
-            lm = slicer.app.layoutManager()
-            sw = lm.sliceWidget(sliceName) if lm else None
+        frames = self._mprSliceToRAS(k, v, w, getattr(self, "_mprCenter", [0.0, 0.0, 0.0]), mirror=False)
+        for sliceName, M in zip(self.MPR_SLICES, frames):
+            sw = self._mprSliceWidget(sliceName)
             if not sw:
-                return
+                continue
             sliceNode = sw.mrmlSliceNode()
             self._setSliceNodeToReformat(sliceNode)
-
-            n = self._unit(normal)
-            t = self._unit(transverse)
-            y = self._unit(cross(n, t))
-
-            m = vtk.vtkMatrix4x4()
-            m.SetElement(0,0, t[0]); m.SetElement(1,0, t[1]); m.SetElement(2,0, t[2]); m.SetElement(3,0, 0.0)
-            m.SetElement(0,1, y[0]); m.SetElement(1,1, y[1]); m.SetElement(2,1, y[2]); m.SetElement(3,1, 0.0)
-            m.SetElement(0,2, n[0]); m.SetElement(1,2, n[1]); m.SetElement(2,2, n[2]); m.SetElement(3,2, 0.0)
-            m.SetElement(0,3, center[0]); m.SetElement(1,3, center[1]); m.SetElement(2,3, center[2]); m.SetElement(3,3, 1.0)
-
-            # Set SliceToRAS in a Slicer-version-tolerant way
-            self._setSliceToRASMatrix(sliceNode, m)
-            sliceNode.UpdateMatrices()
-            try:
-                sw.sliceLogic().FitSliceToAll()
-            except Exception:
-                pass
-
-        setSlice("Red", axis, v)
-        setSlice("Green", v, axis)
-        setSlice("Yellow", w, axis)
+            self._pushSliceToRAS(sliceNode, M)
+        if not interactive:
+            self.fitTrajectoryMPR()
+
+    # -------- Fly-through: stack obliquo in cache per traiettoria --------
+    FLY_HALF_WIDTH_MM = 25.0
+    FLY_MARGIN_MM = 10.0
+    FLY_SOURCE_ATTRIBUTE = "PLATiN.flyThroughSource"
+
+    def _flySourceVolume(self, sliceName="Red"):
+        """Background volume of sliceName, or the volume a fly-through stack shown there came from."""
+        sw = self._mprSliceWidget(sliceName)
+        if not sw:
+            raise RuntimeError("Slice views not available (no layout manager).")
+        node = slicer.mrmlScene.GetNodeByID(sw.sliceLogic().GetSliceCompositeNode().GetBackgroundVolumeID() or "")
+        sourceID = node.GetAttribute(self.FLY_SOURCE_ATTRIBUTE) if node is not None else None
+        if sourceID:
+            node = slicer.mrmlScene.GetNodeByID(sourceID)
+        if node is None or node.GetImageData() is None:
+            raise RuntimeError(f"No background volume in the {sliceName} view.")
+        return node
+
+    def trajectoryStack(self, entryLabel, targetLabel, volumeNode, searchOnlyVisible=False,
+                        halfWidthMm=None, marginMm=None, spacingMm=None):
+        """Oblique stack of volumeNode aligned to the trajectory, resampled once and cached.
+
+        The stack is a scalar volume node whose k-slices are perpendicular to the axis,
+        in the frame of the Red MPR view (X=v, Y=w, Z=axis, origin at the entry). It is
+        rebuilt only when the entry/target points move, the volume changes or the
+        parameters differ; otherwise the cached node is returned as is.
+        Returns {"node", "frame" (4x4), "entry", "target", "length"}.
+        """
+        pEntry, pTarget = self._endpoints(entryLabel, targetLabel, searchOnlyVisible)
+        if spacingMm is None:
+            spacingMm = min(volumeNode.GetSpacing())
+        params = (float(self.FLY_HALF_WIDTH_MM if halfWidthMm is None else halfWidthMm),
+                  float(self.FLY_MARGIN_MM if marginMm is None else marginMm), float(spacingMm))
+        # Cambia se i punti si spostano, se il volume (voxel o geometria) cambia o con altri parametri
+        signature = (tuple(pEntry), tuple(pTarget), volumeNode.GetID(), volumeNode.GetMTime(),
+                     volumeNode.GetImageData().GetMTime(), params)
+
+        if not hasattr(self, "_flyStacks"):
+            self._flyStacks = {}
+        key = (entryLabel, targetLabel)
+        cached = self._flyStacks.get(key)
+        node = cached["node"] if cached else None
+        if node is not None and node.GetScene() is None:
+            node = None  # rimosso dalla scena
+        if node is not None and cached["signature"] == signature:
+            return cached
+
+        axis, v, w = self._mprBasis(pEntry, pTarget)
+        frame = self._mprSliceToRAS(axis, v, w, pEntry, mirror=False)[0]
+        length = math.dist(pEntry, pTarget)
+        rasToIJK = vtk.vtkMatrix4x4(); volumeNode.GetRASToIJKMatrix(rasToIJK)
+        imageData, ijkToRAS = ResliceStack.reslice_stack(
+            volumeNode.GetImageData(), slicer.util.arrayFromVTKMatrix(rasToIJK), frame, length,
+            params[0], params[2], marginMm=params[1])
+
+        if node is None:
+            node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", f"{entryLabel}\u2192{targetLabel} (fly-through)")
+            node.SetAttribute(self.FLY_SOURCE_ATTRIBUTE, volumeNode.GetID())
+            node.CreateDefaultDisplayNodes()
+            srcDisplay, display = volumeNode.GetDisplayNode(), node.GetDisplayNode()
+            if srcDisplay is not None and display is not None:
+                display.SetAutoWindowLevel(False)
+                display.SetWindowLevel(srcDisplay.GetWindow(), srcDisplay.GetLevel())
+                if srcDisplay.GetColorNodeID():
+                    display.SetAndObserveColorNodeID(srcDisplay.GetColorNodeID())
+        node.SetAttribute(self.FLY_SOURCE_ATTRIBUTE, volumeNode.GetID())
+        m = vtk.vtkMatrix4x4(); m.DeepCopy([float(x) for x in ijkToRAS.ravel()])
+        node.SetIJKToRASMatrix(m)
+        node.SetAndObserveImageData(imageData)
+
+        cached = {"node": node, "frame": frame, "entry": list(pEntry), "target": list(pTarget),
+                  "length": length, "signature": signature, "halfWidth": params[0]}
+        self._flyStacks[key] = cached
+        return cached
+
+    def flyThroughTo(self, entryLabel, targetLabel, distanceMm, volumeNode=None, searchOnlyVisible=False, sliceName="Red"):
+        """Show in sliceName the cross-section at distanceMm from the entry (0 = entry, length = target).
+
+        The view shows the cached trajectory stack (trajectoryStack) as background, so
+        each step is one SliceToRAS update and a reslice of the thin stack only.
+        volumeNode=None uses the volume currently shown in the view. Returns the stack entry.
+        """
+        import numpy as np
+        if volumeNode is None:
+            volumeNode = self._flySourceVolume(sliceName)
+        stack = self.trajectoryStack(entryLabel, targetLabel, volumeNode, searchOnlyVisible)
+        sw = self._mprSliceWidget(sliceName)
+        if not sw:
+            raise RuntimeError("Slice views not available (no layout manager).")
+        sliceNode = sw.mrmlSliceNode()
+        composite = sw.sliceLogic().GetSliceCompositeNode()
+        if composite.GetBackgroundVolumeID() != stack["node"].GetID():
+            composite.SetBackgroundVolumeID(stack["node"].GetID())
+            fov = 2.0 * stack["halfWidth"]
+            sliceNode.SetFieldOfView(fov, fov, sliceNode.GetFieldOfView()[2])
+        self._setSliceNodeToReformat(sliceNode)
+        M = np.array(stack["frame"], dtype=float)
+        M[:3, 3] = M[:3, 3] + M[:3, 2] * float(distanceMm)
+        self._pushSliceToRAS(sliceNode, M)
+        return stack
+
+    def flyThroughStops(self, entryLabel, targetLabel, searchOnlyVisible=False, nContacts=0, contactLenMm=0.0, gapLenMm=0.0):
+        """[(name, distance from entry in mm)] for the entry, the contact centres (SEEG) and the target."""
+        length = self.distanceBetween(entryLabel, targetLabel, searchOnlyVisible)
+        stops = [("Entry", 0.0)]
+        # Contatti contati dal target indietro, come in _electrodeParts
+        for i, fromTarget in enumerate(Geometry.contact_distances(nContacts, contactLenMm, gapLenMm)):
+            d = length - float(fromTarget)
+            if 0.0 <= d <= length:
+                stops.append((f"Contact {i+1}", d))
+        stops.append(("Target", length))
+        return sorted(stops, key=lambda item: item[1])
 
     def distanceBetween(self, entryLabel, targetLabel, searchOnlyVisible=False):
-        pEntry,_,_ = self._findPointByLabel(entryLabel, searchOnlyVisible)
-        pTarget,_,_ = self._findPointByLabel(targetLabel, searchOnlyVisible)
+        pEntry, pTarget = self._endpoints(entryLabel, targetLabel, searchOnlyVisible)
         return math.dist(pEntry, pTarget)
 
     def suggestContacts(self, distanceMm, allowed, contactLenMm, gapLenMm):
-        def total(n): return n*contactLenMm + max(0, n-1)*gapLenMm
-        for n in sorted(allowed):
-            if total(n) >= distanceMm - 1e-6:
-                return n
-        return max(allowed)
+        return int(Geometry.suggest_contacts(distanceMm, allowed, contactLenMm, gapLenMm))
 
+    @SceneUtils.batch_processing()
     def runSEEG(self, entryLabel, targetLabel, nContacts, contactLenMm, gapLenMm,
                 contactRadiusMm, shaftRadiusMm, shaftColor, contactColor,
                 outputBaseName, searchOnlyVisible, overwrite, showLine, electrodeName=""):
 
         # Punti e direzione (u da entry->target; contiamo dal TARGET indietro)
-        pEntry,_,_ = self._findPointByLabel(entryLabel, searchOnlyVisible)
-        pTarget,_,_ = self._findPointByLabel(targetLabel, searchOnlyVisible)
+        pEntry, pTarget = self._endpoints(entryLabel, targetLabel, searchOnlyVisible)
         d=[pTarget[0]-pEntry[0], pTarget[1]-pEntry[1], pTarget[2]-pEntry[2]]; u=self._unit(d)
 
         # Linea A→A1
@@ -1043,31 +1422,12 @@ class SEEG_LiTT_PlannerLogic(ScriptedLoadableModuleLogic):
             fr,fg,fb=self._rgbf(shaftColor); ld.SetColor(fr,fg,fb); ld.SetLineThickness(4.0); ld.SetSelectedColor(fr,fg,fb)
             ld.SetTextScale(0); ld.SetPointLabelsVisibility(False); ld.SetVisibility(1 if showLine else 0)
 
-        # Fusto lungo la traiettoria
-        ls=vtk.vtkLineSource(); ls.SetPoint1(pEntry); ls.SetPoint2(pTarget); ls.Update()
-        shaftTube=vtk.vtkTubeFilter(); shaftTube.SetInputConnection(ls.GetOutputPort()); shaftTube.SetRadius(max(shaftRadiusMm, 0.01))
-        shaftTube.SetNumberOfSides(64); shaftTube.CappingOn(); shaftTube.Update()
-
-        # Append unico shaft+contatti (modello originale stabile)
-        append=vtk.vtkAppendPolyData()
-        append.AddInputConnection(shaftTube.GetOutputPort())
-
-        baseCyl = vtk.vtkCylinderSource(); baseCyl.SetRadius(max(contactRadiusMm, 0.01)); baseCyl.SetHeight(max(contactLenMm, 0.01))
-        baseCyl.SetResolution(64); baseCyl.CappingOn(); baseCyl.Update()
-
-        ang, axis = self._rot_z_to_vec(u)
-
-        step = contactLenMm + gapLenMm
-        for i in range(int(nContacts)):
-            center = [pTarget[0] - u[0]*(contactLenMm*0.5 + step*i),
-                      pTarget[1] - u[1]*(contactLenMm*0.5 + step*i),
-                      pTarget[2] - u[2]*(contactLenMm*0.5 + step*i)]
-            T=vtk.vtkTransform(); T.PostMultiply(); T.RotateWXYZ(ang, axis); T.Translate(center)
-            tpf=vtk.vtkTransformPolyDataFilter(); tpf.SetInputConnection(baseCyl.GetOutputPort()); tpf.SetTransform(T); tpf.Update()
-            append.AddInputConnection(tpf.GetOutputPort())
-
-        append.Update()
-        electrodePoly = vtk.vtkPolyData(); electrodePoly.DeepCopy(append.GetOutput())
+        # Fusto + contatti da template in cache: un'unica trasformazione NumPy, nessuna pipeline per contatto
+        with Tracing.stage("mesh build") as traced:
+            shaftParts, contactParts = self._electrodeParts(pEntry, pTarget, nContacts, contactLenMm, gapLenMm,
+                                                            contactRadiusMm, shaftRadiusMm)
+            electrodePoly = MeshTemplates.instance_polydata(shaftParts + contactParts)
+            traced["polygons"] = electrodePoly.GetNumberOfCells()
 
         # Nome elettrodo
         elecBase = electrodeName.strip() if electrodeName and electrodeName.strip() else f"{lineName} (SEEG {nContacts}C)"
@@ -1077,24 +1437,13 @@ class SEEG_LiTT_PlannerLogic(ScriptedLoadableModuleLogic):
         sr,sg,sb=self._rgbf(shaftColor)  # colore unico del modello originale
         md.SetColor(sr,sg,sb); md.SetOpacity(1.0); md.SetBackfaceCulling(0); md.SetScalarVisibility(0); md.SetVisibility(1)
         self._applySliceIntersectionDisplay(md, [sr,sg,sb], thicknessPx=4, opacity=1.0)
+        lineNode.SetNodeReferenceID(self.ELECTRODE_REFERENCE, elecNode.GetID())
 
         # ---- Overlay contatti con colore indipendente (stessa geometria dei contatti) ----
         try:
-            contactsAppend2 = vtk.vtkAppendPolyData()
-            baseCyl2 = vtk.vtkCylinderSource(); baseCyl2.SetRadius(max(contactRadiusMm, 0.01)); baseCyl2.SetHeight(max(contactLenMm, 0.01))
-            baseCyl2.SetResolution(64); baseCyl2.CappingOn(); baseCyl2.Update()
-
-            step2 = contactLenMm + gapLenMm
-            for i in range(int(nContacts)):
-                center2 = [pTarget[0] - u[0]*(contactLenMm*0.5 + step2*i),
-                           pTarget[1] - u[1]*(contactLenMm*0.5 + step2*i),
-                           pTarget[2] - u[2]*(contactLenMm*0.5 + step2*i)]
-                T2=vtk.vtkTransform(); T2.PostMultiply(); T2.RotateWXYZ(ang, axis); T2.Translate(center2)
-                tpf2=vtk.vtkTransformPolyDataFilter(); tpf2.SetInputConnection(baseCyl2.GetOutputPort()); tpf2.SetTransform(T2); tpf2.Update()
-                contactsAppend2.AddInputConnection(tpf2.GetOutputPort())
-
-            contactsAppend2.Update()
-            contactsPoly2 = vtk.vtkPolyData(); contactsPoly2.DeepCopy(contactsAppend2.GetOutput())
+            with Tracing.stage("mesh build") as traced:
+                contactsPoly2 = MeshTemplates.instance_polydata(contactParts)
+                traced["polygons"] = contactsPoly2.GetNumberOfCells()
 
             contactsBase = (electrodeName.strip() + " (contacts)") if electrodeName and electrodeName.strip() else f"{lineName} (contacts)"
             contactsName = self._ensureUniqueNode("vtkMRMLModelNode", contactsBase, overwrite)
@@ -1103,7 +1452,148 @@ class SEEG_LiTT_PlannerLogic(ScriptedLoadableModuleLogic):
             cr,cg,cb = self._rgbf(contactColor)
             contactsDisp.SetColor(cr,cg,cb); contactsDisp.SetOpacity(1.0); contactsDisp.SetBackfaceCulling(0); contactsDisp.SetScalarVisibility(0); contactsDisp.SetVisibility(1)
             self._applySliceIntersectionDisplay(contactsDisp, [cr,cg,cb], thicknessPx=1, opacity=1.0)
+            lineNode.SetNodeReferenceID(self.CONTACTS_REFERENCE, contactsNode.GetID())
         except Exception:
             pass
 
+        self._registerSEEG(outputBaseName, entryLabel, targetLabel, nContacts, contactLenMm, gapLenMm,
+                           contactRadiusMm, shaftRadiusMm)
         return lineNode, elecNode
+
+    def _registerSEEG(self, name, entryLabel, targetLabel, nContacts, contactLenMm, gapLenMm, contactRadiusMm, shaftRadiusMm):
+        TrajectoryRegistry.shared_registry().register(
+            name, entryLabel, targetLabel, TrajectoryRegistry.KIND_SEEG, contacts=nContacts, contactLenMm=contactLenMm,
+            gapLenMm=gapLenMm, contactRadiusMm=contactRadiusMm, shaftRadiusMm=shaftRadiusMm)
+
+    def _electrodeParts(self, pEntry, pTarget, nContacts, contactLenMm, gapLenMm, contactRadiusMm, shaftRadiusMm):
+        """MeshTemplates parts (shaft, contacts) of one electrode; contacts counted back from the target."""
+        import numpy as np
+        pE = np.asarray(pEntry, dtype=float); pT = np.asarray(pTarget, dtype=float)
+        R = Geometry.frame_from_axis(Geometry.axes(pE, pT))
+        shaftTpl = MeshTemplates.lod_cylinder_template(max(shaftRadiusMm, 0.01), 1.0, self.meshQuality)
+        contactTpl = MeshTemplates.lod_cylinder_template(max(contactRadiusMm, 0.01), max(contactLenMm, 0.01), self.meshQuality)
+        contactCenters = Geometry.contact_centers(pE, pT, nContacts, contactLenMm, gapLenMm)
+        return ([(shaftTpl, R, [(pE + pT) * 0.5], float(np.linalg.norm(pT - pE)))],
+                [(contactTpl, R, contactCenters)])
+
+    def _setLinePoints(self, lineNode, pEntry, pTarget):
+        wasModifying = lineNode.StartModify()
+        try:
+            lineNode.SetNthControlPointPositionWorld(0, pEntry)
+            lineNode.SetNthControlPointPositionWorld(1, pTarget)
+        finally:
+            lineNode.EndModify(wasModifying)
+
+    def updateSEEG(self, entryLabel, targetLabel, nContacts, contactLenMm, gapLenMm,
+                   contactRadiusMm, shaftRadiusMm, shaftColor, contactColor,
+                   outputBaseName, searchOnlyVisible, showLine, electrodeName=""):
+        """Re-plan an electrode built by runSEEG keeping its nodes.
+
+        The line control points and the electrode/contacts polydata are rewritten in
+        place (MeshTemplates.update_polydata), so display settings survive and nothing is
+        added to or removed from the scene. Falls back to runSEEG(overwrite=True) when the
+        electrode of outputBaseName does not exist yet. Returns (lineNode, elecNode).
+        """
+        lineNode = slicer.util.getFirstNodeByClassByName("vtkMRMLMarkupsLineNode", outputBaseName)
+        elecNode = lineNode.GetNodeReference(self.ELECTRODE_REFERENCE) if lineNode else None
+        if elecNode is None or elecNode.GetPolyData() is None or lineNode.GetNumberOfControlPoints() != 2:
+            return self.runSEEG(entryLabel, targetLabel, nContacts, contactLenMm, gapLenMm,
+                                contactRadiusMm, shaftRadiusMm, shaftColor, contactColor,
+                                outputBaseName, searchOnlyVisible, True, showLine, electrodeName)
+
+        pEntry, pTarget = self._endpoints(entryLabel, targetLabel, searchOnlyVisible)
+        self._setLinePoints(lineNode, pEntry, pTarget)
+        contactsNode = lineNode.GetNodeReference(self.CONTACTS_REFERENCE)
+        with Tracing.stage("mesh build") as traced:
+            shaftParts, contactParts = self._electrodeParts(pEntry, pTarget, nContacts, contactLenMm, gapLenMm,
+                                                            contactRadiusMm, shaftRadiusMm)
+            MeshTemplates.update_polydata(elecNode.GetPolyData(), shaftParts + contactParts)
+            traced["polygons"] = elecNode.GetPolyData().GetNumberOfCells()
+            if contactsNode is not None and contactsNode.GetPolyData() is not None:
+                MeshTemplates.update_polydata(contactsNode.GetPolyData(), contactParts)
+                traced["polygons"] += contactsNode.GetPolyData().GetNumberOfCells()
+
+        # Nome/colori come in runSEEG (il numero di contatti fa parte del nome)
+        name = electrodeName.strip() if electrodeName and electrodeName.strip() else f"{outputBaseName} (SEEG {nContacts}C)"
+        if elecNode.GetName() != name:
+            elecNode.SetName(name)
+        sr,sg,sb = self._rgbf(shaftColor)
+        ld = lineNode.GetDisplayNode()
+        if ld:
+            ld.SetColor(sr,sg,sb); ld.SetSelectedColor(sr,sg,sb); ld.SetVisibility(1 if showLine else 0)
+        md = elecNode.GetDisplayNode()
+        if md:
+            md.SetColor(sr,sg,sb); md.SetSelectedColor(sr,sg,sb)
+        cd = contactsNode.GetDisplayNode() if contactsNode is not None else None
+        if cd:
+            cr,cg,cb = self._rgbf(contactColor)
+            cd.SetColor(cr,cg,cb); cd.SetSelectedColor(cr,cg,cb)
+        self._registerSEEG(outputBaseName, entryLabel, targetLabel, nContacts, contactLenMm, gapLenMm,
+                           contactRadiusMm, shaftRadiusMm)
+        return lineNode, elecNode
+
+    def _addModelNode(self, name, polyData, qcolor, overwrite, thicknessPx=4, opacity=1.0):
+        modelName = self._ensureUniqueNode("vtkMRMLModelNode", name, overwrite)
+        modelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", modelName); modelNode.SetAndObservePolyData(polyData)
+        disp = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelDisplayNode"); modelNode.SetAndObserveDisplayNodeID(disp.GetID())
+        r,g,b = self._rgbf(qcolor)
+        disp.SetColor(r,g,b); disp.SetOpacity(opacity); disp.SetBackfaceCulling(0); disp.SetScalarVisibility(0); disp.SetVisibility(1)
+        self._applySliceIntersectionDisplay(disp, [r,g,b], thicknessPx=thicknessPx, opacity=opacity)
+        return modelNode
+
+    def runSEEGBatch(self, markupNode, contactLenMm, gapLenMm, contactRadiusMm, shaftRadiusMm,
+                     shaftColor, contactColor, outputBaseName, overwrite, nContacts=None,
+                     allowedContacts=(5, 8, 10, 12, 15, 18)):
+        """Implant every electrode of a plan (entry A / target A_1 pairs of markupNode) in one pass.
+
+        The Markups node is read once; all shafts and all contacts are instanced from the
+        cached templates into two combined models ("<base> (shafts)", "<base> (contacts)"),
+        created with the scene in batch-processing state. nContacts=None picks the suggested
+        count for each electrode length.
+        Returns (shaftsNode, contactsNode, electrodes), electrodes being a list of
+        {"name", "entry", "target", "contacts"} in label order (also stored as JSON in the
+        "PLATiN.electrodes" attribute of the shafts model).
+        """
+        import numpy as np
+        # Coppie A / A_<n> del nodo dal registro (lettura diretta se il nodo non è indicizzato),
+        # ordinate per nome
+        with Tracing.stage("point lookup") as traced:
+            traj = TrajectoryRegistry.shared_registry().trajectories(markupNode)
+            if traj is None:
+                traj = Trajectories.collect_trajectories(markupNode)
+            pairs = [(base, traj[base]) for base, _, _ in Trajectories.complete_pairs(traj)]
+            entries = np.array([pts["entry"] for _, pts in pairs], dtype=float).reshape(-1, 3)
+            targets = np.array([pts["target"] for _, pts in pairs], dtype=float).reshape(-1, 3)
+            traced["points"] = 2 * len(pairs)
+
+        electrodes, shaftParts, contactParts = [], [], []
+        # Lunghezze e contatti suggeriti di tutto il piano in un solo passaggio
+        lengths = Geometry.lengths(entries, targets)
+        suggested = Geometry.suggest_contacts(lengths, list(allowedContacts), contactLenMm, gapLenMm)
+        for (name, pts), entry, target, length, nSuggested in zip(pairs, entries, targets, lengths, suggested):
+            if length < 1e-9:
+                print(f"[SEEG_LiTT_Planner] Skipping {name}: entry and target coincide")
+                continue
+            n = int(nContacts) if nContacts else int(nSuggested)
+            shaft, contacts = self._electrodeParts(entry, target, n, contactLenMm, gapLenMm, contactRadiusMm, shaftRadiusMm)
+            shaftParts += shaft
+            contactParts += contacts
+            electrodes.append({"name": name, "entry": entry.tolist(), "target": target.tolist(), "contacts": n})
+            self._registerSEEG(name, pts["entryLabel"], pts["targetLabel"], n, contactLenMm, gapLenMm,
+                               contactRadiusMm, shaftRadiusMm)
+        if not electrodes:
+            raise RuntimeError(f"Nessuna coppia entry/target (A / A_1) in '{markupNode.GetName()}'.")
+
+        with Tracing.stage("mesh build") as traced:
+            shaftsPoly = MeshTemplates.instance_polydata(shaftParts)
+            contactsPoly = MeshTemplates.instance_polydata(contactParts)
+            traced["polygons"] = shaftsPoly.GetNumberOfCells() + contactsPoly.GetNumberOfCells()
+
+        with SceneUtils.batch_processing():
+            shaftsNode = self._addModelNode(f"{outputBaseName} (shafts)", shaftsPoly, shaftColor, overwrite, thicknessPx=4)
+            contactsNode = self._addModelNode(f"{outputBaseName} (contacts)", contactsPoly, contactColor, overwrite, thicknessPx=1)
+            shaftsNode.SetAttribute("PLATiN.electrodes", json.dumps(electrodes))
+        return shaftsNode, contactsNode, electrodes
+
+
+Tracing.note_startup("SEEG_LiTT_Planner", "import", time.perf_counter() - _IMPORT_T0)
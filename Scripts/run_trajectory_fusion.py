@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Run TrajectoryFusion without the GUI (batch / overnight processing).
+
+Linux/macOS:
+  Slicer --no-main-window --python-script /path/to/PLATiN/Scripts/run_trajectory_fusion.py \
+      --markups plan.mrk.json --volume T1.nii.gz --output /path/to/out \
+      --mode per-trajectory --mode combined --labels both --intensity 500
+
+  Slicer --no-main-window --python-script /path/to/PLATiN/Scripts/run_trajectory_fusion.py \
+      --cases cases.json
+
+cases.json is a list of objects with "markups", "volume", "output" and optionally
+"modes" (list), "labels", "intensity", "patientName", "modality", "seriesDescription".
+Relative paths are resolved against the folder of cases.json; options missing from
+a case fall back to the command-line values.
+"""
+
+import sys
+import json
+import pathlib
+import argparse
+
+try:
+    import slicer  # noqa: F401
+except Exception as e:
+    print("ERROR: This script must be executed inside 3D Slicer.")
+    print(e)
+    sys.exit(1)
+
+LABEL_MODES = {
+    "entry": "Entry only",
+    "target": "Target only",
+    "both": "Entry + Target",
+}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="PLATiN TrajectoryFusion batch runner")
+    parser.add_argument("--markups", help="Markups file with entry (A) / target (A_1) points")
+    parser.add_argument("--volume", help="Reference volume (e.g. T1 NIfTI)")
+    parser.add_argument("--output", help="Output directory")
+    parser.add_argument("--cases", help="JSON file with a list of cases (overrides --markups/--volume/--output)")
+    parser.add_argument("--mode", action="append", choices=["segmentation", "per-trajectory", "combined"],
+                        help="Fusion mode; repeat to run several (default: per-trajectory)")
+    parser.add_argument("--labels", choices=sorted(LABEL_MODES), default="both",
+                        help="Labels burned into the label modes (default: both)")
+    parser.add_argument("--intensity", type=float, default=500, help="Fusion intensity (default: 500)")
+    parser.add_argument("--nrrd", action="store_true", help="Also write a .nrrd copy of every output")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Threads for the per-trajectory export (default: 0 = automatic)")
+    parser.add_argument("--keep-intermediate", action="store_true",
+                        help="Keep Model_/Seg_/Label_ nodes during segmentation mode (debug)")
+    parser.add_argument("--dicom", action="store_true",
+                        help="Segmentation mode: also write RAS NIfTI and a DICOM series per trajectory")
+    parser.add_argument("--patient-name", default="", help="DICOM Patient Name")
+    parser.add_argument("--modality", default="MR", help="DICOM modality (default: MR)")
+    parser.add_argument("--series-description", default="TrajectoryFusion", help="DICOM Series Description")
+    parser.add_argument("--trace", help="Write per-stage timings as a Chrome trace JSON (PLATiNLib.Tracing)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="With --trace, also track Python allocations (tracemalloc, slower)")
+    args = parser.parse_args(argv)
+    if not args.cases and not (args.markups and args.volume and args.output):
+        parser.error("either --cases or --markups/--volume/--output are required")
+    return args
+
+
+def _dicom_options(patientName, modality, seriesDescription):
+    return {"patientName": patientName, "modality": modality, "seriesDescription": seriesDescription}
+
+
+def load_cases(args):
+    defaults = {
+        "modes": args.mode or ["per-trajectory"],
+        "labels": args.labels,
+        "intensity": args.intensity,
+        "patientName": args.patient_name,
+        "modality": args.modality,
+        "seriesDescription": args.series_description,
+    }
+    if args.cases:
+        casesFile = pathlib.Path(args.cases).resolve()
+        raw = json.loads(casesFile.read_text())
+        base = casesFile.parent
+    else:
+        raw = [{"markups": args.markups, "volume": args.volume, "output": args.output}]
+        base = pathlib.Path.cwd()
+
+    cases = []
+    for entry in raw:
+        c = dict(defaults)
+        c.update(entry)
+        case = {
+            "markups": str((base / c["markups"]).resolve()),
+            "volume": str((base / c["volume"]).resolve()),
+            "output": str((base / c["output"]).resolve()),
+            "modes": list(c["modes"]),
+            "labelMode": LABEL_MODES[c["labels"]],
+            "intensityValue": float(c["intensity"]),
+            "keepIntermediate": args.keep_intermediate,
+            "workers": args.workers,
+            "exportNrrd": args.nrrd,
+        }
+        if args.dicom or c.get("dicom"):
+            case["dicomExport"] = _dicom_options(c["patientName"], c["modality"], c["seriesDescription"])
+        cases.append(case)
+    return cases
+
+
+def main(argv):
+    # Make sure PLATiN root is importable (same layout as Tests/run_tests.py)
+    root_dir = pathlib.Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(root_dir))
+    import TrajectoryFusion
+    from PLATiNLib import Tracing
+
+    args = parse_args(argv)
+    cases = load_cases(args)
+    print(f"[PLATiN fusion] {len(cases)} case(s)")
+
+    if args.trace:
+        Tracing.tracer().enable(memory=args.trace_memory)
+    results = TrajectoryFusion.TrajectoryFusionLogic().runBatch(cases)
+    if args.trace:
+        for row in Tracing.tracer().summary():
+            print(f"[PLATiN fusion] {row['stage']:<26} {row['calls']:>5} call(s) {row['totalS']:9.3f}s")
+        Tracing.tracer().write_chrome_trace(args.trace)
+        print(f"[PLATiN fusion] Trace written to {args.trace}")
+
+    failed = 0
+    for r in results:
+        status = "OK" if not r["errors"] else "ERRORS"
+        failed += 1 if r["errors"] else 0
+        print(f"[PLATiN fusion] {status}: {r['case']['markups']} -> {len(r['outputs'])} file(s)")
+        for err in r["errors"]:
+            print(f"    {err}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
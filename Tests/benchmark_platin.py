@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""Benchmark PLATiN planning and fusion on synthetic phantoms inside 3D Slicer.
+
+Linux/macOS:
+  Slicer --no-main-window --python-script /path/to/PLATiN/Tests/benchmark_platin.py \
+      --output bench.json [--sizes 128 256 512x512x400] [--trajectories 1 10 50] [--repeat 3]
+
+  # store the current stencil masks, then check a faster rasterizer against them
+  ... benchmark_platin.py --output before.json --write-golden golden.npz
+  ... benchmark_platin.py --output after.json --golden golden.npz
+
+Phantoms and plans are generated from fixed seeds, so two runs with the same sizes
+and trajectory counts time (and rasterize) exactly the same geometry. For every
+volume size the largest plan is also rasterized through the stencil path
+(createTubeBetweenPoints + vtkPolyDataToImageStencil) and the analytic tube
+rasterizer, and the masks are compared voxel by voxel (with each other and, with
+--golden, with the stored stencil masks).
+"""
+
+import sys
+import json
+import time
+import shutil
+import pathlib
+import platform
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+
+try:
+    import slicer  # noqa: F401
+except Exception as e:
+    print("ERROR: This benchmark must be executed inside 3D Slicer.")
+    print(e)
+    sys.exit(1)
+
+DEFAULT_SIZES = ["128", "256", "512x512x400"]
+DEFAULT_TRAJECTORIES = [1, 10, 50]
+FOV_MM = (220.0, 220.0, 180.0)
+HEAD_SEMI_AXES_MM = (75.0, 90.0, 70.0)
+TUBE_RADIUS_MM = 2.0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="PLATiN planning/fusion benchmark")
+    parser.add_argument("--output", required=True, help="JSON file with the timings")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES,
+                        help="Phantom sizes, N (N^3) or IxJxK (default: 128 256 512x512x400)")
+    parser.add_argument("--trajectories", nargs="+", type=int, default=DEFAULT_TRAJECTORIES,
+                        help="Trajectory counts of the plans (default: 1 10 50)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark (default: 3)")
+    parser.add_argument("--skip", action="append", default=[],
+                        choices=["startup", "kernel", "planning", "stencil", "stamp", "per-trajectory", "combined", "golden"],
+                        help="Benchmark group to leave out; repeat for several")
+    parser.add_argument("--golden", help="Compare the masks with a golden .npz written by --write-golden")
+    parser.add_argument("--write-golden", help="Write the stencil masks of this run as a golden .npz")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed of phantoms and plans (default: 1234)")
+    return parser.parse_args(argv)
+
+
+def parse_size(text):
+    """"256" -> (256, 256, 256); "512x512x400" -> (512, 512, 400), as (I, J, K)."""
+    parts = [int(p) for p in str(text).lower().split("x")]
+    if len(parts) == 1:
+        parts *= 3
+    if len(parts) != 3 or min(parts) < 8:
+        raise ValueError(f"Invalid size: {text}")
+    return tuple(parts)
+
+
+def size_name(size):
+    return "x".join(str(n) for n in size)
+
+
+# ---------- Synthetic data ----------
+def phantom_ijk_to_ras(size):
+    """Anisotropic, slightly oblique grid covering FOV_MM, centred on the RAS origin."""
+    spacing = np.array([f / n for f, n in zip(FOV_MM, size)])
+    a = np.radians(5.0)
+    rot = np.array([[np.cos(a), -np.sin(a), 0.0], [np.sin(a), np.cos(a), 0.0], [0.0, 0.0, 1.0]])
+    m = np.eye(4)
+    m[:3, :3] = rot * spacing[None, :]
+    m[:3, 3] = -m[:3, :3] @ ((np.array(size) - 1) * 0.5)
+    return m
+
+
+def phantom_array(size, seed):
+    """int16 (k, j, i) head phantom: two nested ellipsoids plus noise, built slab by slab."""
+    I, J, K = size
+    m = phantom_ijk_to_ras(size)
+    rng = np.random.default_rng(seed)
+    out = np.empty((K, J, I), dtype=np.int16)
+    ii = np.arange(I, dtype=np.float32)[None, :]
+    jj = np.arange(J, dtype=np.float32)[:, None]
+    semi = np.array(HEAD_SEMI_AXES_MM, dtype=np.float32)
+    for k in range(K):
+        x = m[0, 0] * ii + m[0, 1] * jj + (m[0, 2] * k + m[0, 3])
+        y = m[1, 0] * ii + m[1, 1] * jj + (m[1, 2] * k + m[1, 3])
+        z = np.float32(m[2, 2] * k + m[2, 3])
+        r2 = (x / semi[0]) ** 2 + (y / semi[1]) ** 2 + (z / semi[2]) ** 2
+        slab = np.where(r2 <= 1.0, 600.0, 0.0) + np.where(r2 <= 0.55, 300.0, 0.0)
+        out[k] = (slab + rng.normal(0.0, 20.0, size=(J, I))).astype(np.int16)
+    return out
+
+
+def plan_points(count, seed):
+    """[(name, entry, target)]: entries on the head surface, targets in the inner ellipsoid."""
+    rng = np.random.default_rng(seed + 7919 * count)
+    semi = np.array(HEAD_SEMI_AXES_MM)
+    plan = []
+    while len(plan) < count:
+        d = rng.normal(size=3)
+        d /= np.linalg.norm(d)
+        entry = d / np.sqrt(np.sum((d / semi) ** 2))  # raggio dell'ellissoide lungo d
+        target = rng.uniform(-0.5, 0.5, size=3) * semi
+        if np.linalg.norm(target - entry) < 20.0:
+            continue
+        plan.append((f"E{len(plan) + 1:02d}", entry.tolist(), target.tolist()))
+    return plan
+
+
+def add_phantom(size, seed):
+    node = slicer.util.addVolumeFromArray(phantom_array(size, seed), phantom_ijk_to_ras(size),
+                                          f"Phantom {size_name(size)}")
+    return node
+
+
+def add_plan(plan, name="BenchPlan"):
+    node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", name)
+    for key, entry, target in plan:
+        node.AddControlPointWorld(entry, key)
+        node.AddControlPointWorld(target, f"{key}_1")
+    return node
+
+
+class SceneScope:
+    """Remove every node added to the scene inside the block."""
+
+    def __enter__(self):
+        self._before = {n.GetID() for n in self._nodes()}
+        return self
+
+    @staticmethod
+    def _nodes():
+        nodes = slicer.mrmlScene.GetNodes()
+        return [nodes.GetItemAsObject(i) for i in range(nodes.GetNumberOfItems())]
+
+    def __exit__(self, *exc):
+        for node in reversed(self._nodes()):
+            if node.GetID() not in self._before and node.GetScene() is not None:
+                slicer.mrmlScene.RemoveNode(node)
+        return False
+
+
+# ---------- Timing ----------
+def time_runs(fn, repeat, setup=None):
+    """Seconds of `repeat` calls of fn(state), state = setup() (not timed); nodes added are removed."""
+    seconds = []
+    for _ in range(max(1, int(repeat))):
+        with SceneScope():
+            state = setup() if setup is not None else None
+            t0 = time.perf_counter()
+            fn(state)
+            seconds.append(time.perf_counter() - t0)
+    return seconds
+
+
+def record(results, benchmark, seconds, **info):
+    entry = dict(benchmark=benchmark, **info, seconds=seconds,
+                 best=min(seconds), median=statistics.median(seconds))
+    results.append(entry)
+    extra = " ".join(f"{k}={v}" for k, v in info.items())
+    print(f"[PLATiN bench] {benchmark:<28} {extra:<36} best {entry['best']:.4f}s  median {entry['median']:.4f}s")
+    return entry
+
+
+# ---------- Mask comparison ----------
+def compare_masks(a, b):
+    """Voxel comparison of two cropped masks ((offset k,j,i), bool array) or None."""
+    def box(m):
+        return (np.array(m[0]), np.array(m[0]) + np.array(m[1].shape)) if m is not None else None
+    boxes = [bx for bx in (box(a), box(b)) if bx is not None]
+    if not boxes:
+        return {"mismatch": 0, "reference": 0, "candidate": 0, "dice": 1.0}
+    lo = np.min([bx[0] for bx in boxes], axis=0)
+    hi = np.max([bx[1] for bx in boxes], axis=0)
+
+    def dense(m):
+        out = np.zeros(tuple(hi - lo), dtype=bool)
+        if m is not None:
+            o = np.array(m[0]) - lo
+            out[tuple(slice(s, s + n) for s, n in zip(o, m[1].shape))] = m[1]
+        return out
+    da, db = dense(a), dense(b)
+    na, nb = int(da.sum()), int(db.sum())
+    inter = int(np.count_nonzero(da & db))
+    return {"mismatch": int(np.count_nonzero(da != db)), "reference": na, "candidate": nb,
+            "dice": (2.0 * inter / (na + nb)) if na + nb else 1.0}
+
+
+def _as_pair(cropped):
+    return None if cropped is None else (cropped.offset, cropped.mask)
+
+
+def golden_masks(tf, refVolume, plan):
+    """{key: (stencil, analytic)} cropped masks of every tube of the plan."""
+    sides = tf._tf_tube_sides(tf._tf_ijk_to_ras_array(refVolume), TUBE_RADIUS_MM)
+    masks = {}
+    for key, entry, target in plan:
+        poly = tf.createTubeBetweenPoints(entry, target, radius=TUBE_RADIUS_MM, resolution=sides)
+        stencil = _as_pair(tf._tf_polydata_ras_to_cropped_mask(refVolume, poly))
+        analytic = _as_pair(tf._tf_tube_to_cropped_mask(refVolume, entry, target, radius=TUBE_RADIUS_MM, sides=sides))
+        masks[key] = (stencil, analytic)
+    return masks
+
+
+def save_golden(path, golden):
+    arrays = {}
+    for sizeKey, masks in golden.items():
+        for key, (stencil, _) in masks.items():
+            if stencil is None:
+                continue
+            prefix = f"{sizeKey}:{key}:"
+            arrays[prefix + "offset"] = np.array(stencil[0], dtype=np.int64)
+            arrays[prefix + "shape"] = np.array(stencil[1].shape, dtype=np.int64)
+            arrays[prefix + "bits"] = np.packbits(stencil[1].ravel())
+    np.savez_compressed(path, **arrays)
+    print(f"[PLATiN bench] golden masks written to {path}")
+
+
+def load_golden(path):
+    data = np.load(path)
+    golden = {}
+    for name in data.files:
+        sizeKey, key, field = name.rsplit(":", 2)
+        if field != "bits":
+            continue
+        shape = tuple(int(x) for x in data[f"{sizeKey}:{key}:shape"])
+        mask = np.unpackbits(data[name], count=int(np.prod(shape))).astype(bool).reshape(shape)
+        golden.setdefault(sizeKey, {})[key] = (tuple(int(x) for x in data[f"{sizeKey}:{key}:offset"]), mask)
+    return golden
+
+
+# ---------- Benchmarks ----------
+STARTUP_MODULES = (("SEEG_LiTT_Planner", "SEEG_LiTT_PlannerWidget"),
+                   ("TrajectoryFromPoints", "TrajectoryFromPointsWidget"),
+                   ("TrajectoryFusion", "TrajectoryFusionWidget"))
+
+
+def bench_startup(results, repeat, rootDir):
+    """Import (fresh copy of each module file, PLATiNLib already loaded) and panel setup."""
+    import importlib.util
+    for name, widgetClass in STARTUP_MODULES:
+        path = rootDir / f"{name}.py"
+        modules = []
+
+        def load(_):
+            spec = importlib.util.spec_from_file_location(f"_bench_{name}_{len(modules)}", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            modules.append(module)
+        record(results, "moduleImport", time_runs(load, repeat), module=name)
+
+        widgets = []
+
+        def setup(_):
+            widget = getattr(modules[-1], widgetClass)()
+            widget.setup()
+            widgets.append(widget)
+        record(results, "widgetSetup", time_runs(setup, repeat), module=name)
+        for widget in widgets:
+            widget.parent.deleteLater()
+        slicer.app.processEvents()
+
+
+def bench_kernel(results, counts, repeat, seed):
+    """Geometry of whole plans at once (PLATiNLib.Geometry, no scene nodes)."""
+    from PLATiNLib import Geometry
+    for n in counts:
+        plan = plan_points(n, seed)
+        entries = np.array([p[1] for p in plan]); targets = np.array([p[2] for p in plan])
+
+        def kernel(_):
+            lengths = Geometry.lengths(entries, targets)
+            Geometry.suggest_contacts(lengths, [5, 8, 10, 12, 15, 18], 2.0, 1.5)
+            Geometry.frame_from_axis(Geometry.axes(entries, targets))
+            Geometry.contact_centers(entries, targets, 18, 2.0, 1.5)
+            axis, v, w = Geometry.mpr_basis(entries, targets)
+            Geometry.mpr_slice_to_ras(axis, v, w, (entries + targets) * 0.5)
+        record(results, "geometryKernel", time_runs(kernel, repeat), trajectories=n)
+
+
+def bench_planning(results, counts, repeat, seed):
+    import qt
+    import SEEG_LiTT_Planner
+    import TrajectoryFromPoints
+    seeg = SEEG_LiTT_Planner.SEEG_LiTT_PlannerLogic()
+    litt = TrajectoryFromPoints.TrajectoryFromPointsLogic()
+    white, yellow, blue = qt.QColor(255, 255, 255), qt.QColor(255, 255, 0), qt.QColor(50, 180, 255)
+
+    for n in counts:
+        plan = plan_points(n, seed)
+        setup = lambda: add_plan(plan)
+
+        def seegEach(_):
+            for key, entry, target in plan:
+                nContacts = seeg.suggestContacts(np.linalg.norm(np.subtract(target, entry)), [5, 8, 10, 12, 15, 18], 2.0, 1.5)
+                seeg.runSEEG(key, f"{key}_1", nContacts, 2.0, 1.5, 0.4, 0.7, white, yellow,
+                             f"Bench {key}", False, True, False, "")
+        record(results, "runSEEG", time_runs(seegEach, repeat, setup), trajectories=n)
+
+        record(results, "runSEEGBatch",
+               time_runs(lambda planNode: seeg.runSEEGBatch(planNode, 2.0, 1.5, 0.4, 0.7, white, yellow, "Bench", True),
+                         repeat, setup), trajectories=n)
+
+        def littEach(_):
+            for key, entry, target in plan:
+                litt.runMultipleNecrosis(key, f"{key}_1", 1.6, "0, 5, 10", 10.0, 15.0, blue, blue,
+                                         f"Bench {key}", False, True, False)
+        record(results, "runMultipleNecrosis", time_runs(littEach, repeat, setup), trajectories=n)
+
+
+def bench_volume(results, tf, size, counts, repeat, seed, skip, outDir):
+    refVolume = add_phantom(size, seed)
+    sizeKey = size_name(size)
+    sides = tf._tf_tube_sides(tf._tf_ijk_to_ras_array(refVolume), TUBE_RADIUS_MM)
+    refArray = slicer.util.arrayFromVolume(refVolume)
+    for n in counts:
+        plan = plan_points(n, seed)
+        info = dict(size=sizeKey, trajectories=n)
+
+        if "stencil" not in skip:
+            def stencil(_):
+                for key, entry, target in plan:
+                    poly = tf.createTubeBetweenPoints(entry, target, radius=TUBE_RADIUS_MM, resolution=sides)
+                    tf._tf_polydata_ras_to_labelmap(refVolume, poly, labelValue=1, nodeName=f"Label_{key}")
+            record(results, "_tf_polydata_ras_to_labelmap", time_runs(stencil, repeat), **info)
+
+        if "stamp" not in skip:
+            def stamp(fused):
+                for key, entry, target in plan:
+                    tf._tf_stamp_text(fused, refVolume, key, entry, 1000, **tf._TF_LABEL_STAMP)
+                    tf._tf_stamp_text(fused, refVolume, f"{key}_1", target, 1000, **tf._TF_LABEL_STAMP)
+            record(results, "_tf_stamp_text", time_runs(stamp, repeat, refArray.copy), **info)
+
+        for mode in ("per-trajectory", "combined"):
+            if mode in skip:
+                continue
+            def fuse(planNode, mode=mode):
+                logic = tf.TrajectoryFusionLogic()
+                runDir = tempfile.mkdtemp(dir=outDir)
+                try:
+                    logic.run(planNode, refVolume, runDir, mode=mode, labelMode="Entry + Target")
+                    if logic.errors:
+                        raise RuntimeError("; ".join(logic.errors))
+                finally:
+                    shutil.rmtree(runDir, ignore_errors=True)
+            record(results, f"fusion {mode}", time_runs(fuse, repeat, lambda: add_plan(plan)), **info)
+    return refVolume
+
+
+def compare_golden(goldenResults, sizeKey, masks, stored):
+    for key, (stencil, analytic) in masks.items():
+        rows = [("analytic vs stencil", stencil, analytic)]
+        if stored is not None:
+            ref = stored.get(sizeKey, {}).get(key)
+            rows += [("stencil vs golden", ref, stencil), ("analytic vs golden", ref, analytic)]
+        for name, reference, candidate in rows:
+            goldenResults.append(dict(size=sizeKey, trajectory=key, comparison=name, **compare_masks(reference, candidate)))
+    for name in sorted({r["comparison"] for r in goldenResults if r["size"] == sizeKey}):
+        rows = [r for r in goldenResults if r["size"] == sizeKey and r["comparison"] == name]
+        print(f"[PLATiN bench] {sizeKey} {name}: {sum(r['mismatch'] for r in rows)} mismatching voxels "
+              f"of {sum(r['reference'] for r in rows)}, min Dice {min(r['dice'] for r in rows):.4f}")
+
+
+def main(argv):
+    # Make sure PLATiN root is importable (same layout as Tests/run_tests.py)
+    root_dir = pathlib.Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(root_dir))
+    import TrajectoryFusion as tf
+
+    args = parse_args(argv)
+    sizes = [parse_size(s) for s in args.sizes]
+    counts = sorted(set(args.trajectories))
+    stored = load_golden(args.golden) if args.golden else None
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "slicer": getattr(slicer.app, "applicationVersion", ""),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"sizes": [size_name(s) for s in sizes], "trajectories": counts, "repeat": args.repeat,
+                   "seed": args.seed, "skip": args.skip, "golden": args.golden},
+        "results": [],
+        "golden": [],
+    }
+    slicer.mrmlScene.Clear(0)
+    outDir = tempfile.mkdtemp(prefix="platin_bench_")
+    golden = {}
+    try:
+        if "startup" not in args.skip:
+            bench_startup(report["results"], args.repeat, root_dir)
+        if "kernel" not in args.skip:
+            bench_kernel(report["results"], counts, args.repeat, args.seed)
+        if "planning" not in args.skip:
+            bench_planning(report["results"], counts, args.repeat, args.seed)
+        for size in sizes:
+            with SceneScope():
+                refVolume = bench_volume(report["results"], tf, size, counts, args.repeat, args.seed, args.skip, outDir)
+                if "golden" not in args.skip:
+                    masks = golden_masks(tf, refVolume, plan_points(max(counts), args.seed))
+                    compare_golden(report["golden"], size_name(size), masks, stored)
+                    golden[size_name(size)] = masks
+    finally:
+        shutil.rmtree(outDir, ignore_errors=True)
+
+    if args.write_golden:
+        save_golden(args.write_golden, golden)
+    pathlib.Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"[PLATiN bench] {len(report['results'])} timings written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
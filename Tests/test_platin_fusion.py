@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Automated checks for the TrajectoryFusion rasterization.
+
+Notes
+-----
+These tests are designed to run inside 3D Slicer (Python environment with VTK/Qt/Slicer API).
+They compare the analytic tube rasterizer with the original
+PolyData -> ImageStencil path on a small synthetic reference volume.
+"""
+
+import os
+import unittest
+
+import numpy as np
+import vtk
+import slicer
+
+import TrajectoryFusion
+
+
+class TestPLATiNFusion(unittest.TestCase):
+
+    def setUp(self):
+        slicer.mrmlScene.Clear(0)
+
+        # Small oblique, anisotropic reference volume
+        self.refVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", "Ref")
+        slicer.util.updateVolumeFromArray(self.refVolume, np.zeros((40, 48, 56), dtype=np.int16))
+        t = vtk.vtkTransform()
+        t.RotateWXYZ(25.0, 0.3, 1.0, 0.2)
+        t.Scale(0.9, 1.1, 1.4)
+        m = vtk.vtkMatrix4x4()
+        m.DeepCopy(t.GetMatrix())
+        m.SetElement(0, 3, -20.0); m.SetElement(1, 3, -25.0); m.SetElement(2, 3, -15.0)
+        self.refVolume.SetIJKToRASMatrix(m)
+
+        self.p1 = [-5.0, -8.0, 2.0]
+        self.p2 = [18.0, 12.0, 30.0]
+
+    def test_analytic_tube_matches_stencil(self):
+        tubePoly = TrajectoryFusion.createTubeBetweenPoints(self.p1, self.p2, radius=2.0)
+        labelNode = TrajectoryFusion._tf_polydata_ras_to_labelmap(self.refVolume, tubePoly, labelValue=1)
+        golden = slicer.util.arrayFromVolume(labelNode) > 0
+
+        mask = TrajectoryFusion._tf_tube_to_mask(self.refVolume, self.p1, self.p2, radius=2.0) > 0
+
+        self.assertEqual(mask.shape, golden.shape)
+        self.assertGreater(golden.sum(), 0)
+
+        # Differences are limited to the rim between the 20-gon and the circle
+        mismatch = np.count_nonzero(mask != golden)
+        self.assertLess(mismatch, 0.1 * golden.sum())
+        self.assertLess(abs(int(mask.sum()) - int(golden.sum())), 0.05 * golden.sum())
+
+    def test_cropped_mask_applies_in_place(self):
+        cropped = TrajectoryFusion._tf_tube_to_cropped_mask(self.refVolume, self.p1, self.p2, radius=2.0)
+        dense = TrajectoryFusion._tf_tube_to_mask(self.refVolume, self.p1, self.p2, radius=2.0)
+        self.assertLess(cropped.nbytes, dense.nbytes // 10)
+
+        fused = np.zeros(dense.shape, dtype=np.int16)
+        out = TrajectoryFusion._tf_add_mask(fused, cropped, 500, inPlace=True)
+        self.assertIs(out, fused)
+        np.testing.assert_array_equal(fused > 0, dense > 0)
+
+    def test_layer_apply_and_restore_round_trip(self):
+        traj = {"A": {"entry": self.p1, "target": self.p2, "entryLabel": "A", "targetLabel": "A_1"}}
+        layers = TrajectoryFusion._tf_build_trajectory_layers(self.refVolume, traj, "Entry + Target")
+        self.assertEqual(len(layers), 1)
+        self.assertEqual(len(layers[0]["labels"]), 2)
+
+        refArray = np.random.default_rng(0).integers(0, 100, size=(40, 48, 56)).astype(np.int16)
+        fused = refArray.copy()
+        TrajectoryFusion._tf_apply_layer(fused, layers[0], 500)
+        self.assertGreater(np.count_nonzero(fused == 500), 0)
+        TrajectoryFusion._tf_restore_layer(fused, refArray, layers[0])
+        np.testing.assert_array_equal(fused, refArray)
+
+    def test_text_mask_planes(self):
+        ij = TrajectoryFusion._tf_text_to_cropped_mask((30, 30, 30), (2, 3, 4), "A_1", plane="IJ")
+        ik = TrajectoryFusion._tf_text_to_cropped_mask((30, 30, 30), (2, 4, 3), "A_1", plane="IK")
+        self.assertEqual(ij.offset, (4, 3, 2))
+        self.assertEqual(ik.offset, (3, 4, 2))
+        # Same glyphs, with the J and K axes swapped
+        np.testing.assert_array_equal(ij.mask.transpose(1, 0, 2), ik.mask)
+        self.assertEqual(ij.mask.shape, (2, 14, 36))
+
+    def test_tube_outside_grid_is_empty(self):
+        mask = TrajectoryFusion._tf_tube_to_mask(self.refVolume, [500.0, 500.0, 500.0], [520.0, 500.0, 500.0])
+        self.assertEqual(int(mask.sum()), 0)
+
+    def test_nifti_writer_round_trip(self):
+        arr = np.random.default_rng(1).integers(-100, 1000, size=(40, 48, 56)).astype(np.int16)
+        path = os.path.join(slicer.app.temporaryPath, "tf_writer_test.nii.gz")
+        TrajectoryFusion._tf_write_nifti(path, arr, TrajectoryFusion._tf_ijk_to_ras_array(self.refVolume),
+                                         slabVoxels=10000)
+        loaded = slicer.util.loadVolume(path)
+        try:
+            np.testing.assert_array_equal(slicer.util.arrayFromVolume(loaded), arr)
+            np.testing.assert_allclose(TrajectoryFusion._tf_ijk_to_ras_array(loaded),
+                                       TrajectoryFusion._tf_ijk_to_ras_array(self.refVolume), atol=1e-4)
+        finally:
+            os.remove(path)
+
+    def test_nrrd_copy_matches_nifti(self):
+        import tempfile
+        arr = np.random.default_rng(2).integers(0, 1000, size=(40, 48, 56)).astype(np.int16)
+        ijkToRas = TrajectoryFusion._tf_ijk_to_ras_array(self.refVolume)
+        with tempfile.TemporaryDirectory() as outDir:
+            paths = TrajectoryFusion._tf_write_volume_files(os.path.join(outDir, "r-A.nii.gz"), arr, ijkToRas,
+                                                            exportNrrd=True)
+            self.assertEqual([os.path.basename(p) for p in paths], ["r-A.nii.gz", "r-A.nrrd"])
+            for path in paths:
+                loaded = slicer.util.loadVolume(path)
+                np.testing.assert_array_equal(slicer.util.arrayFromVolume(loaded), arr)
+                np.testing.assert_allclose(TrajectoryFusion._tf_ijk_to_ras_array(loaded), ijkToRas, atol=1e-4)
+
+    def test_in_process_reorientation_matches_cli(self):
+        # Axis-aligned but permuted/flipped grid, as produced by many scanners
+        m = vtk.vtkMatrix4x4()
+        m.Zero()
+        m.SetElement(0, 1, -0.9); m.SetElement(1, 2, 1.1); m.SetElement(2, 0, -1.4); m.SetElement(3, 3, 1.0)
+        m.SetElement(0, 3, 12.0); m.SetElement(1, 3, -7.0); m.SetElement(2, 3, 30.0)
+        self.refVolume.SetIJKToRASMatrix(m)
+        arr = np.random.default_rng(3).integers(0, 1000, size=(40, 48, 56)).astype(np.int16)
+        slicer.util.updateVolumeFromArray(self.refVolume, arr)
+
+        fast, fastMatrix = TrajectoryFusion._tf_reorient_array_to_ras(arr, TrajectoryFusion._tf_ijk_to_ras_array(self.refVolume))
+        cliNode = TrajectoryFusion._tf_reorient_volume_to_ras(self.refVolume)
+        np.testing.assert_array_equal(fast, slicer.util.arrayFromVolume(cliNode))
+        np.testing.assert_allclose(fastMatrix, TrajectoryFusion._tf_ijk_to_ras_array(cliNode), atol=1e-4)
+
+    def test_dicom_series_geometry(self):
+        import tempfile
+        import pydicom
+        arr = np.random.default_rng(4).integers(-50, 900, size=(40, 48, 56)).astype(np.int16)
+        ijkToRas = TrajectoryFusion._tf_ijk_to_ras_array(self.refVolume)
+        with tempfile.TemporaryDirectory() as outDir:
+            paths = TrajectoryFusion._tf_write_dicom_series(arr, ijkToRas, outDir, patientName="SUBJ001",
+                                                            studyInstanceUID="1.2.826.0.1.3680043.2.1125.1")
+            self.assertEqual(len(paths), 40)
+            slices = [pydicom.dcmread(p) for p in paths]
+        self.assertEqual({ds.StudyInstanceUID for ds in slices}, {"1.2.826.0.1.3680043.2.1125.1"})
+        self.assertEqual(len({ds.SeriesInstanceUID for ds in slices}), 1)
+        np.testing.assert_array_equal(np.stack([ds.pixel_array for ds in slices]), arr)
+        # Slice k sits at IJK (0,0,k), in LPS
+        rasK5 = ijkToRas @ [0.0, 0.0, 5.0, 1.0]
+        np.testing.assert_allclose([float(v) for v in slices[5].ImagePositionPatient],
+                                   [-rasK5[0], -rasK5[1], rasK5[2]], atol=1e-4)
+
+    def test_parallel_export_reports_each_trajectory(self):
+        import tempfile
+        markup = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", "Plan")
+        for n, label in enumerate(["A", "A_1", "B", "B_1", "C"]):
+            x, y, z = self.p1 if n % 2 == 0 else self.p2
+            markup.AddControlPoint(x, y, z, label)
+        progress = []
+        with tempfile.TemporaryDirectory() as outDir:
+            logic = TrajectoryFusion.TrajectoryFusionLogic()
+            outputs = logic.fusePerTrajectory(markup, self.refVolume, outDir, 500, workers=2,
+                                              progressCallback=lambda d, t, k: progress.append((d, t)))
+            self.assertEqual(sorted(os.path.basename(p) for p in outputs), ["r-A-labels.nii.gz", "r-B-labels.nii.gz"])
+        self.assertEqual(logic.errors, [])
+        self.assertEqual(progress[-1], (2, 2))
+
+    def test_tracing_records_every_fusion_stage(self):
+        import json
+        import tempfile
+        from PLATiNLib import Tracing
+        markup = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", "Plan")
+        markup.AddControlPoint(*self.p1, "A")
+        markup.AddControlPoint(*self.p2, "A_1")
+        tracer = Tracing.tracer()
+        tracer.clear()
+        tracer.enable(memory=True)
+        try:
+            with tempfile.TemporaryDirectory() as outDir:
+                TrajectoryFusion.TrajectoryFusionLogic().fuseCombined(markup, self.refVolume, outDir, 500)
+                tracePath = tracer.write_chrome_trace(os.path.join(outDir, "trace.json"))
+                with open(tracePath) as f:
+                    trace = json.load(f)
+        finally:
+            tracer.disable()
+        rows = {r["stage"]: r for r in tracer.summary()}
+        for name in ("fusion: combined", "point lookup", "rasterization", "label stamping", "fusion", "save"):
+            self.assertIn(name, rows)
+        self.assertGreater(rows["rasterization"]["counts"]["voxels"], 0)
+        self.assertIsNotNone(rows["fusion"]["allocPeakMB"])
+        spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+        self.assertEqual(len(spans), len(tracer.events))
+        # La fusione contiene i suoi stadi
+        run = next(e for e in spans if e["name"] == "fusion: combined")
+        for e in spans:
+            self.assertGreaterEqual(e["ts"], run["ts"])
+            self.assertLessEqual(e["ts"] + e["dur"], run["ts"] + run["dur"] + 1.0)
+        tracer.clear()
+
+    def test_trajectories_come_from_registry(self):
+        from PLATiNLib import Trajectories
+        markup = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", "Plan")
+        for label, pos in (("B_1", self.p2), ("A", self.p1), ("B", self.p1), ("A_1", self.p2), ("C", self.p1)):
+            markup.AddControlPoint(*pos, label)
+        expected = {k: v for k, v in Trajectories.collect_trajectories(markup).items() if "entry" in v and "target" in v}
+        self.assertEqual(TrajectoryFusion._tf_collect_trajectories_from_markup(markup), expected)
+        markup.SetNthControlPointPosition(3, 1.0, 2.0, 3.0)
+        self.assertEqual(TrajectoryFusion._tf_collect_trajectories_from_markup(markup)["A"]["target"], [1.0, 2.0, 3.0])
+
+    def test_import_starts_no_timers(self):
+        import importlib.util
+        import qt
+        from PLATiNLib import Tracing
+        # Copia fresca del modulo: l'import non deve lasciare timer né toccare la UI
+        spec = importlib.util.spec_from_file_location("TrajectoryFusion_fresh", TrajectoryFusion.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        self.assertEqual([n for n, v in vars(module).items() if isinstance(v, qt.QTimer)], [])
+        self.assertIn("import", Tracing.startup_times()["TrajectoryFusion"])
+
+
+if __name__ == "__main__":
+    unittest.main()
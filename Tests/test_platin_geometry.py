@@ -17,6 +17,7 @@ import unittest
 
 import slicer
 import qt  # Qt bindings provided by 3D Slicer
+import vtk
 
 # Import PLATiN modules (they must be available in Slicer additional module paths)
 import SEEG_LiTT_Planner
@@ -77,6 +78,199 @@ class TestPLATiNGeometry(unittest.TestCase):
         self.assertIsNotNone(poly)
         self.assertGreater(poly.GetNumberOfPoints(), 0)
 
+    def test_seeg_contacts_follow_trajectory_axis(self):
+        logic = SEEG_LiTT_Planner.SEEG_LiTT_PlannerLogic()
+        logic.runSEEG("E", "T", 5, 2.0, 1.5, 0.4, 0.7, qt.QColor(255, 255, 255), qt.QColor(255, 255, 0),
+                      "SEEG_E_T", False, True, False, "")
+        contacts = slicer.util.getFirstNodeByClassByName("vtkMRMLModelNode", "SEEG_E_T (contacts)")
+        self.assertIsNotNone(contacts)
+        pts = slicer.util.arrayFromModelPoints(contacts)
+        # Cylinders lie along the E->T (Z) axis: radial extent = contact radius,
+        # contacts counted back from the target
+        self.assertLessEqual(float(abs(pts[:, :2]).max()), 0.4 + 1e-4)
+        self.assertAlmostEqual(float(pts[:, 2].max()), 100.0, places=4)
+        self.assertAlmostEqual(float(pts[:, 2].min()), 100.0 - (5 * 2.0 + 4 * 1.5), places=4)
+
+    def test_tessellation_follows_radius_and_quality(self):
+        from PLATiNLib import MeshTemplates
+        for quality, tol in MeshTemplates.CHORD_ERROR_MM.items():
+            for radius in (0.4, 0.7, 2.0, 5.0):
+                n = MeshTemplates.cylinder_resolution(radius, quality)
+                self.assertLessEqual(n, MeshTemplates.MAX_SIDES)
+                if n > MeshTemplates.MIN_SIDES:
+                    self.assertLessEqual(radius * (1.0 - math.cos(math.pi / n)), tol + 1e-9)
+        self.assertLess(MeshTemplates.cylinder_resolution(0.4), MeshTemplates.cylinder_resolution(5.0))
+
+        logic = SEEG_LiTT_Planner.SEEG_LiTT_PlannerLogic()
+        cells = {}
+        for quality in ("final", "preview"):
+            logic.meshQuality = quality
+            _, elecNode = logic.runSEEG("E", "T", 5, 2.0, 1.5, 0.4, 0.7, qt.QColor(255, 255, 255),
+                                        qt.QColor(255, 255, 0), f"SEEG_{quality}", False, True, False, "")
+            cells[quality] = elecNode.GetPolyData().GetNumberOfCells()
+        self.assertLess(cells["preview"], cells["final"])
+
+    def test_mpr_in_plane_rotation_keeps_normal(self):
+        if slicer.app.layoutManager() is None:
+            self.skipTest("MPR needs the slice views")
+        logic = SEEG_LiTT_Planner.SEEG_LiTT_PlannerLogic()
+        logic.createTrajectoryMPR("E", "T")
+        sliceNode = slicer.app.layoutManager().sliceWidget("Green").mrmlSliceNode()
+        before = slicer.util.arrayFromVTKMatrix(sliceNode.GetSliceToRAS()).copy()
+
+        logic.rotateTrajectoryMPRInPlane("Green", 90.0, interactive=True)
+        after = slicer.util.arrayFromVTKMatrix(sliceNode.GetSliceToRAS())
+        # Normal and origin unchanged, X goes to Y
+        for col in (2, 3):
+            for row in range(3):
+                self.assertAlmostEqual(float(after[row, col]), float(before[row, col]), places=6)
+        for row in range(3):
+            self.assertAlmostEqual(float(after[row, 0]), float(before[row, 1]), places=6)
+
+    def test_trajectory_stack_is_cached_until_points_move(self):
+        import numpy as np
+        ijkToRAS = np.eye(4); ijkToRAS[:3, 3] = [-20.0, -20.0, -10.0]
+        K, J, I = np.mgrid[0:121, 0:41, 0:41]
+        volume = slicer.util.addVolumeFromArray(((I - 20) + 2 * (J - 20) + 3 * (K - 10)).astype(np.float32), ijkToRAS, "Ramp")
+
+        logic = SEEG_LiTT_Planner.SEEG_LiTT_PlannerLogic()
+        stack = logic.trajectoryStack("E", "T", volume, halfWidthMm=5.0, marginMm=0.0, spacingMm=1.0)
+        self.assertAlmostEqual(stack["length"], 100.0, places=6)
+        values = slicer.util.arrayFromVolume(stack["node"])
+        m = vtk.vtkMatrix4x4(); stack["node"].GetIJKToRASMatrix(m)
+        for ijk in ((5, 5, 0), (0, 10, 50), (10, 0, 100)):
+            ras = m.MultiplyPoint(list(ijk) + [1.0])
+            self.assertAlmostEqual(float(values[ijk[2], ijk[1], ijk[0]]), ras[0] + 2 * ras[1] + 3 * ras[2], places=3)
+
+        # Same points: cached stack, no resampling
+        self.assertIs(logic.trajectoryStack("E", "T", volume, halfWidthMm=5.0, marginMm=0.0, spacingMm=1.0), stack)
+        # Target moved: rebuilt into the same node
+        self.fids.SetNthControlPointPositionWorld(1, [0.0, 0.0, 80.0])
+        moved = logic.trajectoryStack("E", "T", volume, halfWidthMm=5.0, marginMm=0.0, spacingMm=1.0)
+        self.assertAlmostEqual(moved["length"], 80.0, places=6)
+        self.assertIs(moved["node"], stack["node"])
+        self.assertEqual(slicer.util.arrayFromVolume(moved["node"]).shape[0], 81)
+
+    def test_litt_backend_is_loaded_once(self):
+        backend = SEEG_LiTT_Planner._littBackend()
+        self.assertIs(SEEG_LiTT_Planner._littBackend(), backend)
+        # Stesso file già importato da Slicer: nessuna seconda copia
+        self.assertIs(backend, TrajectoryFromPoints)
+
+    def test_seeg_batch_builds_one_model_per_category(self):
+        plan = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", "Plan")
+        for label, pos in (("A", [0.0, 0.0, 0.0]), ("A_1", [0.0, 0.0, 40.0]),
+                           ("B", [20.0, 0.0, 0.0]), ("B_1", [20.0, 30.0, 0.0]), ("C", [5.0, 5.0, 5.0])):
+            plan.AddControlPointWorld(pos, label)
+        nModelsBefore = len(slicer.util.getNodesByClass("vtkMRMLModelNode"))
+
+        logic = SEEG_LiTT_Planner.SEEG_LiTT_PlannerLogic()
+        shafts, contacts, electrodes = logic.runSEEGBatch(
+            plan, 2.0, 1.5, 0.4, 0.7, qt.QColor(255, 255, 255), qt.QColor(255, 255, 0), "Plan", True)
+
+        self.assertEqual([e["name"] for e in electrodes], ["A", "B"])
+        self.assertEqual([e["contacts"] for e in electrodes], [12, 10])
+        self.assertEqual(len(slicer.util.getNodesByClass("vtkMRMLModelNode")), nModelsBefore + 2)
+        self.assertEqual(shafts.GetName(), "Plan (shafts)")
+        self.assertEqual(contacts.GetName(), "Plan (contacts)")
+        self.assertGreater(contacts.GetPolyData().GetNumberOfPoints(), shafts.GetPolyData().GetNumberOfPoints())
+
+    def test_label_lookup_follows_markups_edits(self):
+        logic = SEEG_LiTT_Planner.SEEG_LiTT_PlannerLogic()
+        pos, node, idx = logic._findPointByLabel("T", False)
+        self.assertIs(node, self.fids)
+        self.assertEqual((idx, pos), (1, [0.0, 0.0, 100.0]))
+
+        self.fids.SetNthControlPointPositionWorld(1, [1.0, 2.0, 3.0])
+        self.assertEqual(logic._findPointByLabel("T", False)[0], [1.0, 2.0, 3.0])
+
+        self.fids.SetNthControlPointLabel(1, "T2")
+        with self.assertRaises(RuntimeError):
+            logic._findPointByLabel("T", False)
+        self.assertEqual(logic._findPointByLabel("T2", False)[2], 1)
+
+        other = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", "G")
+        other.AddControlPointWorld([7.0, 7.0, 7.0], "T")
+        self.assertIs(logic._findPointByLabel("T", False)[1], other)
+
+    def test_registry_rows_follow_markups_and_plans(self):
+        from PLATiNLib import TrajectoryRegistry
+        plan = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", "Plan")
+        for label, pos in (("A", [0.0, 0.0, 0.0]), ("A_1", [0.0, 0.0, 30.0]), ("B", [10.0, 0.0, 0.0]), ("B_1", [10.0, 0.0, 40.0])):
+            plan.AddControlPointWorld(pos, label)
+        registry = TrajectoryRegistry.shared_registry()
+        rows = registry.rows(node=plan, pairsOnly=True)
+        self.assertEqual([registry.names[r] for r in rows], ["A", "B"])
+        self.assertEqual(registry.lengths()[rows].tolist(), [30.0, 40.0])
+
+        # E/T del setUp: cercati dal planner, restano una riga del registro
+        logic = SEEG_LiTT_Planner.SEEG_LiTT_PlannerLogic()
+        white = qt.QColor(255, 255, 255)
+        logic.runSEEG("E", "T", 8, 2.0, 1.5, 0.4, 0.7, white, white, "SEEG E", False, True, False)
+        r = registry.row("E", "T")
+        self.assertEqual(int(registry.kinds[r]), TrajectoryRegistry.KIND_SEEG)
+        self.assertEqual(registry.column("contacts")[r], 8.0)
+        self.assertEqual(registry.rows(kind=TrajectoryRegistry.KIND_SEEG).tolist(), [r])
+
+        # Trascinamento: solo le posizioni cambiano
+        labelsVersion = registry.index.labelsVersion
+        self.fids.SetNthControlPointPositionWorld(1, [0.0, 0.0, 50.0])
+        self.assertEqual(registry.targets[registry.row("E", "T")].tolist(), [0.0, 0.0, 50.0])
+        self.assertEqual(registry.index.labelsVersion, labelsVersion)
+        # Nuova coppia A / A_<n>: righe ricostruite
+        plan.AddControlPointWorld([20.0, 0.0, 0.0], "C")
+        plan.AddControlPointWorld([20.0, 0.0, 10.0], "C_1")
+        self.assertEqual(sorted(registry.names[r] for r in registry.rows(node=plan, pairsOnly=True)), ["A", "B", "C"])
+        self.assertEqual(registry.column("contacts")[registry.row("E", "T")], 8.0)
+
+    def test_registry_keeps_only_resolvable_lookups(self):
+        from PLATiNLib import TrajectoryRegistry
+        registry = TrajectoryRegistry.shared_registry()
+        # Etichetta sbagliata: nessuna riga e nessun piano tenuto
+        self.assertIsNone(registry.endpoints("E", "Tx"))
+        self.assertIsNone(registry.row("E", "Tx"))
+        self.assertNotIn(("E", "Tx"), registry._plans)
+
+        self.assertEqual(registry.endpoints("E", "T"), ([0.0, 0.0, 0.0], [0.0, 0.0, 100.0]))
+        self.fids.SetNthControlPointLabel(1, "T2")
+        self.assertIsNone(registry.endpoints("E", "T"))
+        self.assertNotIn(("E", "T"), registry._plans)
+
+    def test_seeg_update_rewrites_existing_nodes(self):
+        logic = SEEG_LiTT_Planner.SEEG_LiTT_PlannerLogic()
+        args = ("E", "T", 4, 2.0, 1.5, 0.4, 0.7, qt.QColor(255, 255, 255), qt.QColor(255, 255, 0), "SEEG_E_T", False)
+        lineNode, elecNode = logic.runSEEG(*args, True, True, "")
+        poly = elecNode.GetPolyData()
+        nModels = len(slicer.util.getNodesByClass("vtkMRMLModelNode"))
+
+        self.fids.SetNthControlPointPositionWorld(1, [0.0, 0.0, 80.0])
+        line2, elec2 = logic.updateSEEG(*args, True, "")
+
+        self.assertIs(line2, lineNode)
+        self.assertIs(elec2, elecNode)
+        self.assertIs(elec2.GetPolyData(), poly)
+        self.assertEqual(len(slicer.util.getNodesByClass("vtkMRMLModelNode")), nModels)
+        p1 = [0.0, 0.0, 0.0]
+        lineNode.GetNthControlPointPositionWorld(1, p1)
+        self.assertAlmostEqual(p1[2], 80.0, places=4)
+        self.assertAlmostEqual(float(slicer.util.arrayFromModelPoints(elecNode)[:, 2].max()), 80.0, places=4)
+
+    def test_litt_update_keeps_necrosis_nodes(self):
+        logic = TrajectoryFromPoints.TrajectoryFromPointsLogic()
+        args = ("E", "T", 1.65, "0, 10", 12.0, 30.0, qt.QColor(0, 255, 255), qt.QColor(255, 0, 0), "LiTT_E_T", False)
+        lineNode, fiberNode, lastNec = logic.runMultipleNecrosis(*args, True, True)
+
+        self.fids.SetNthControlPointPositionWorld(1, [0.0, 0.0, 60.0])
+        line2, fiber2, lastNec2 = logic.updateMultipleNecrosis(*args, True)
+
+        self.assertIs(line2, lineNode)
+        self.assertIs(fiber2, fiberNode)
+        self.assertIs(lastNec2, lastNec)
+        # Second necrosis: starts 10 mm before the target, 30 mm long
+        zs = slicer.util.arrayFromModelPoints(lastNec2)[:, 2]
+        self.assertAlmostEqual(float(zs.max()), 50.0, places=3)
+        self.assertAlmostEqual(float(zs.min()), 20.0, places=3)
+
     def test_litt_multiple_necrosis_creates_expected_nodes(self):
         logic = TrajectoryFromPoints.TrajectoryFromPointsLogic()
 
@@ -103,6 +297,8 @@ class TestPLATiNGeometry(unittest.TestCase):
         self.assertIsNotNone(lineNode)
         self.assertIsNotNone(fiberNode)
         self.assertIsNotNone(lastNecNode)
+        # Nodes are created inside one scene batch, which must be closed again
+        self.assertFalse(slicer.mrmlScene.IsBatchProcessing())
 
         # Count generated necrosis model nodes
         model_nodes = slicer.util.getNodesByClass("vtkMRMLModelNode")
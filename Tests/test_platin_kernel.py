@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Checks of the trajectory geometry kernel (PLATiNLib.Geometry).
+
+The kernel only needs NumPy, so these tests also run outside 3D Slicer:
+  python -m unittest discover -s Tests -p "test_platin_kernel.py"
+"""
+
+import math
+import pathlib
+import sys
+import unittest
+
+import numpy as np
+
+# PLATiN root importabile anche fuori da run_tests.py
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from PLATiNLib import Geometry  # noqa: E402
+
+
+class TestPLATiNKernel(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.entries = rng.uniform(-80.0, 80.0, (50, 3))
+        self.targets = rng.uniform(-80.0, 80.0, (50, 3))
+
+    def test_unit_and_degenerate_axis(self):
+        u = Geometry.unit([[3.0, 0.0, 4.0], [0.0, 0.0, 0.0]])
+        np.testing.assert_allclose(u, [[0.6, 0.0, 0.8], [0.0, 0.0, 1.0]])
+
+    def test_frame_brings_z_onto_axis(self):
+        u = Geometry.axes(self.entries, self.targets)
+        R = Geometry.frame_from_axis(np.vstack([u, [[0.0, 0.0, -1.0]]]))
+        z = R @ np.array([0.0, 0.0, 1.0])
+        np.testing.assert_allclose(z[:-1], u, atol=1e-12)
+        np.testing.assert_allclose(z[-1], [0.0, 0.0, -1.0], atol=1e-12)
+        # Rotazioni proprie
+        np.testing.assert_allclose(R @ np.swapaxes(R, -1, -2), np.broadcast_to(np.eye(3), R.shape), atol=1e-12)
+        np.testing.assert_allclose(np.linalg.det(R), 1.0, atol=1e-12)
+
+    def test_rot_z_to_vec_matches_frame(self):
+        u = Geometry.axes(self.entries, self.targets)
+        angle, axis = Geometry.rot_z_to_vec(u)
+        z = Geometry.rotate_around_axis([0.0, 0.0, 1.0], axis, np.radians(angle))
+        np.testing.assert_allclose(z, u, atol=1e-12)
+        self.assertAlmostEqual(float(Geometry.rot_z_to_vec([0.0, 0.0, -2.0])[0]), 180.0)
+
+    def test_mpr_basis_is_orthonormal_per_trajectory(self):
+        axis, v, w = Geometry.mpr_basis(self.entries, self.targets)
+        B = np.stack([axis, v, w], axis=-1)
+        np.testing.assert_allclose(np.swapaxes(B, -1, -2) @ B, np.broadcast_to(np.eye(3), B.shape), atol=1e-12)
+        M = Geometry.mpr_slice_to_ras(axis, v, w, (self.entries + self.targets) * 0.5)
+        self.assertEqual(M.shape, (50, 3, 4, 4))
+        # Red perpendicolare alla traiettoria, Green/Yellow la contengono
+        np.testing.assert_allclose(M[:, 0, :3, 2], axis, atol=1e-12)
+        np.testing.assert_allclose(np.einsum("nki,ni->nk", M[:, 1:, :3, 2], axis), 0.0, atol=1e-12)
+        np.testing.assert_allclose(np.linalg.det(M[..., :3, :3]), 1.0, atol=1e-12)
+
+    def test_contacts_are_counted_back_from_target(self):
+        centers = Geometry.contact_centers(self.entries, self.targets, 5, 2.0, 1.5)
+        self.assertEqual(centers.shape, (50, 5, 3))
+        fromTarget = np.linalg.norm(centers - self.targets[:, None, :], axis=-1)
+        np.testing.assert_allclose(fromTarget, np.broadcast_to([1.0, 4.5, 8.0, 11.5, 15.0], (50, 5)), atol=1e-9)
+        toEntry = np.linalg.norm(centers - self.entries[:, None, :], axis=-1)
+        np.testing.assert_allclose(fromTarget + toEntry, np.repeat(Geometry.lengths(self.entries, self.targets)[:, None], 5, 1),
+                                   atol=1e-9)
+
+    def test_necrosis_offsets_are_clamped(self):
+        c = Geometry.necrosis_centers([0.0, 0.0, 0.0], [0.0, 0.0, 50.0], [-3.0, 0.0, 4.0], 10.0)
+        np.testing.assert_allclose(c[:, 2], [45.0, 45.0, 41.0])
+
+    def test_suggest_contacts_matches_scalar_rule(self):
+        allowed = [18, 5, 8, 10, 12, 15]
+        distances = np.linspace(0.0, 80.0, 161)
+
+        def scalar(d):
+            for n in sorted(allowed):
+                if n * 2.0 + max(0, n - 1) * 1.5 >= d - 1e-6:
+                    return n
+            return max(allowed)
+
+        self.assertEqual(Geometry.suggest_contacts(distances, allowed, 2.0, 1.5).tolist(), [scalar(d) for d in distances])
+        self.assertEqual(int(Geometry.suggest_contacts(math.nan, allowed, 2.0, 1.5)), 18)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Checks of the stage tracer (PLATiNLib.Tracing).
+
+The tracer only needs the standard library, so these tests also run outside 3D Slicer:
+  python -m unittest discover -s Tests -p "test_platin_tracing.py"
+"""
+
+import pathlib
+import sys
+import threading
+import unittest
+
+# PLATiN root importabile anche fuori da run_tests.py
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from PLATiNLib import Tracing  # noqa: E402
+
+
+class TestPLATiNTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = Tracing.Tracer()
+
+    def tearDown(self):
+        self.tracer.disable()
+
+    def test_disabled_tracer_records_nothing(self):
+        with self.tracer.stage("rasterization") as s:
+            s["voxels"] = 10
+        self.tracer.record("DICOM CLI", 0.0, 1.0)
+        self.assertEqual(self.tracer.events, [])
+        self.assertEqual(self.tracer.summary(), [])
+
+    def test_nested_stages_keep_their_own_allocation_peak(self):
+        self.tracer.enable(memory=True)
+        with self.tracer.stage("Generate", "run"):
+            with self.tracer.stage("mesh build") as s:
+                buf = bytearray(8 * 1024 * 1024)
+                s["polygons"] = 12
+                del buf
+            with self.tracer.stage("save"):
+                pass
+        rows = {r["stage"]: r for r in self.tracer.summary()}
+        self.assertEqual(list(rows), ["Generate", "mesh build", "save"])
+        self.assertGreaterEqual(rows["mesh build"]["allocPeakMB"], 8.0)
+        self.assertLess(rows["save"]["allocPeakMB"], 1.0)
+        # Il picco del figlio resta visibile nel genitore anche dopo reset_peak()
+        self.assertGreaterEqual(rows["Generate"]["allocPeakMB"], 8.0)
+        self.assertEqual(rows["mesh build"]["counts"], {"polygons": 12})
+
+    def test_threads_and_chrome_trace(self):
+        self.tracer.enable()
+        # Thread vivi insieme: gli id di thread terminati possono essere riusati
+        barrier = threading.Barrier(3)
+
+        def work(n):
+            with self.tracer.stage("rasterization", voxels=n):
+                barrier.wait()
+
+        threads = [threading.Thread(target=work, args=(n,), name=f"tf-export_{n}") for n in (1, 2, 3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        row = self.tracer.summary()[0]
+        self.assertEqual((row["calls"], row["counts"]["voxels"]), (3, 6))
+
+        trace = self.tracer.chrome_trace()["traceEvents"]
+        names = {e["args"]["name"] for e in trace if e["ph"] == "M"}
+        self.assertEqual(names, {"tf-export_1", "tf-export_2", "tf-export_3"})
+        spans = [e for e in trace if e["ph"] == "X"]
+        self.assertEqual(len({e["tid"] for e in spans}), 3)
+        self.assertTrue(all(e["dur"] >= 0 and "rssPeakMB" in e["args"] for e in spans))
+
+    def test_startup_report_per_module(self):
+        self.addCleanup(Tracing._startup.pop, "Demo", None)
+        self.addCleanup(Tracing._startup.pop, "Other", None)
+        Tracing.note_startup("Demo", "import", 0.012)
+        Tracing.note_startup("Other", "import", 0.001)
+        Tracing.note_startup("Demo", "setup", 0.0853)
+        self.assertEqual(Tracing.startup_times()["Demo"], {"import": 0.012, "setup": 0.0853})
+        self.assertEqual(Tracing.startup_report("Demo"), "import 12 ms, setup 85 ms")
+        self.assertIn("Demo: import 12 ms, setup 85 ms; Other: import 1 ms", Tracing.startup_report())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import math, vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
+from PLATiNLib import FiducialIndex, Geometry, MeshTemplates, SceneUtils, Tracing, TrajectoryRegistry
 
 class TrajectoryFromPoints(ScriptedLoadableModule):
     def __init__(self, parent):
@@ -62,25 +63,24 @@ class TrajectoryFromPointsWidget(ScriptedLoadableModuleWidget):
         except Exception as e:
             slicer.util.errorDisplay(str(e))
     def onUpdate(self):
-        # Rigenera forzando la sovrascrittura
+        # Aggiorna in place i nodi esistenti (rigenera solo se mancano)
         entry=self.entryEdit.text.strip(); target=self.targetEdit.text.strip()
         if not entry or not target: slicer.util.errorDisplay("Inserisci le etichette di entry e target."); return
         try:
             offsets_txt = self.multiOffsetsEdit.text.strip()
             if offsets_txt:
-                ln, fn, nn = self.logic.runMultipleNecrosis(entry, target, float(self.fiberDiameter.value),
+                ln, fn, nn = self.logic.updateMultipleNecrosis(entry, target, float(self.fiberDiameter.value),
                                                             offsets_txt,
                                                             float(self.necDiameter.value), float(self.necLength.value),
                                                             self.fiberColor.color, self.necColor.color,
                                                             self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
-                                                            self.onlyVisibleCheck.checked, True,  # overwrite
-                                                            self.showLineCheck.checked)
+                                                            self.onlyVisibleCheck.checked, self.showLineCheck.checked)
             else:
-                ln, fn, nn = self.logic.run(entry, target, float(self.fiberDiameter.value),
+                ln, fn, nn = self.logic.update(entry, target, float(self.fiberDiameter.value),
                                             float(self.necStartOffset.value), float(self.necDiameter.value), float(self.necLength.value),
                                             self.fiberColor.color, self.necColor.color,
                                             self.baseName.text.strip() or f"Trajectory {entry}\u2192{target}",
-                                            self.onlyVisibleCheck.checked, True, self.showLineCheck.checked)
+                                            self.onlyVisibleCheck.checked, self.showLineCheck.checked)
             try: slicer.util.resetThreeDViews()
             except: pass
             self.status.setText(f"Aggiornati: {ln.GetName()}, {fn.GetName()}, {nn.GetName()}")
@@ -88,15 +88,23 @@ class TrajectoryFromPointsWidget(ScriptedLoadableModuleWidget):
             slicer.util.errorDisplay(str(e))
 
 class TrajectoryFromPointsLogic(ScriptedLoadableModuleLogic):
+    # Riferimenti dalla linea ai modelli generati (usati da update/updateMultipleNecrosis)
+    FIBER_REFERENCE="PLATiNFiber"; NECROSIS_REFERENCE="PLATiNNecrosis"
+    # Qualità della tessellazione (MeshTemplates.CHORD_ERROR_MM): "preview" o "final"
+    meshQuality=MeshTemplates.DEFAULT_QUALITY
     def _findPointByLabel(self, label, onlyVisible=False):
-        for n in slicer.util.getNodesByClass("vtkMRMLMarkupsFiducialNode"):
-            if onlyVisible:
-                d=n.GetDisplayNode()
-                if d and not d.GetVisibility(): continue
-            for i in range(n.GetNumberOfControlPoints()):
-                if n.GetNthControlPointLabel(i)==label:
-                    pos=[0.0,0.0,0.0]; n.GetNthControlPointPositionWorld(i,pos); return pos,n,i
-        raise ValueError(f"Punto '{label}' non trovato.")
+        with Tracing.stage("point lookup", points=1): hit=FiducialIndex.shared_index().find(label, onlyVisible)
+        if hit is None: raise ValueError(f"Punto '{label}' non trovato.")
+        return hit
+    def _endpoints(self, entryLabel, targetLabel, onlyVisible=False):
+        # Posizioni dal registro delle traiettorie; punti mancanti/nascosti: ricerca per label (errore esplicito)
+        with Tracing.stage("point lookup", points=2): hit=TrajectoryRegistry.shared_registry().endpoints(entryLabel, targetLabel, onlyVisible)
+        if hit is None: return self._findPointByLabel(entryLabel, onlyVisible)[0], self._findPointByLabel(targetLabel, onlyVisible)[0]
+        return hit
+    def _register(self, name, entryLabel, targetLabel, fiberDiameterMm, offsets, necrosisDiameterMm, necrosisLengthMm):
+        TrajectoryRegistry.shared_registry().register(name, entryLabel, targetLabel, TrajectoryRegistry.KIND_LITT,
+                                                      fiberDiameterMm=fiberDiameterMm, necroses=len(offsets), necStartOffsetMm=min(offsets),
+                                                      necDiameterMm=necrosisDiameterMm, necLengthMm=necrosisLengthMm)
     def _ensureUniqueNode(self, className, name, overwrite):
         existing=slicer.util.getFirstNodeByClassByName(className, name)
         if existing:
@@ -107,16 +115,29 @@ class TrajectoryFromPointsLogic(ScriptedLoadableModuleLogic):
                 name=cand
         return name
     def _rgbf(self, qc): return [qc.redF(), qc.greenF(), qc.blueF()]
-    def _unit(self, v):
-        mag=(v[0]*v[0]+v[1]*v[1]+v[2]*v[2])**0.5
-        return [0.0,0.0,1.0] if mag==0 else [v[0]/mag, v[1]/mag, v[2]/mag]
-    def _rot_z_to_vec(self, vec):
-        z=[0.0,0.0,1.0]; v=self._unit(vec)
-        axis=[z[1]*v[2]-z[2]*v[1], z[2]*v[0]-z[0]*v[2], z[0]*v[1]-z[1]*v[0]]
-        am=(axis[0]**2+axis[1]**2+axis[2]**2)**0.5
-        dot=max(-1.0,min(1.0, z[0]*v[0]+z[1]*v[1]+z[2]*v[2]))
-        import math; ang=math.degrees(math.acos(dot))
-        return (ang, [1.0,0.0,0.0] if am==0 else [axis[0]/am,axis[1]/am,axis[2]/am])
+    def _unit(self, v): return Geometry.unit(v).tolist()
+    def _parseOffsets(self, offsets_txt):
+        values=[]
+        if offsets_txt:
+            txt = offsets_txt.replace(';', ',')
+            for part in txt.split(','):
+                s = part.strip().replace(',', '.')
+                if s:
+                    try: values.append(float(s))
+                    except: pass
+        if not values: values=[0.0]
+        return values
+    def _fiber_template(self, radius):
+        # Cilindro in cache (altezza 1), lati scelti dal raggio (LOD)
+        return MeshTemplates.lod_cylinder_template(radius, 1.0, self.meshQuality)
+    def _ellipsoid_template(self, r_minor, r_major):
+        return MeshTemplates.lod_ellipsoid_template(r_minor, r_major, self.meshQuality)
+    def _fiber_polydata(self, pEntry, pTarget, radius):
+        # Cilindro scalato sulla lunghezza entry-target
+        mid=[(pEntry[0]+pTarget[0])*0.5, (pEntry[1]+pTarget[1])*0.5, (pEntry[2]+pTarget[2])*0.5]
+        return MeshTemplates.instance_polydata([(self._fiber_template(radius), Geometry.frame_from_axis(Geometry.axes(pEntry, pTarget)), [mid], math.dist(pEntry, pTarget))])
+    def _ellipsoid_polydata(self, center, u, r_minor, r_major):
+        return MeshTemplates.instance_polydata([(self._ellipsoid_template(r_minor, r_major), Geometry.frame_from_axis(u), [center])])
     def _applySliceIntersectionDisplay(self, displayNode, colorRGBF, thicknessPx=5, opacity=1.0):
         displayNode.SetSliceIntersectionVisibility(1)
         try: displayNode.SetSliceDisplayModeToIntersection()
@@ -128,10 +149,10 @@ class TrajectoryFromPointsLogic(ScriptedLoadableModuleLogic):
         try: displayNode.SetSliceIntersectionThickness(int(thicknessPx))
         except AttributeError: pass
         displayNode.SetColor(*colorRGBF); displayNode.SetVisibility(1)
+    @SceneUtils.batch_processing()
     def run(self, entryLabel, targetLabel, fiberDiameterMm, necrosisStartOffsetMm, necrosisDiameterMm, necrosisLengthMm,
             fiberColor, necrosisColor, outputBaseName, searchOnlyVisible, overwrite, showLine):
-        pEntry,_,_ = self._findPointByLabel(entryLabel, searchOnlyVisible)
-        pTarget,_,_ = self._findPointByLabel(targetLabel, searchOnlyVisible)
+        pEntry, pTarget = self._endpoints(entryLabel, targetLabel, searchOnlyVisible)
         d=[pTarget[0]-pEntry[0], pTarget[1]-pEntry[1], pTarget[2]-pEntry[2]]; u=self._unit(d)
         lineName=self._ensureUniqueNode("vtkMRMLMarkupsLineNode", outputBaseName, overwrite)
         lineNode=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsLineNode", lineName)
@@ -141,9 +162,8 @@ class TrajectoryFromPointsLogic(ScriptedLoadableModuleLogic):
             fr,fg,fb=self._rgbf(fiberColor); ld.SetColor(fr,fg,fb); ld.SetSelectedColor(fr,fg,fb); ld.SetLineThickness(1.0); ld.SetPointLabelsVisibility(False); ld.SetVisibility(1 if showLine else 0)
         # Fiber cylinder
         r=max(fiberDiameterMm*0.5, 0.01)
-        ls=vtk.vtkLineSource(); ls.SetPoint1(pEntry); ls.SetPoint2(pTarget); ls.Update()
-        tf=vtk.vtkTubeFilter(); tf.SetInputConnection(ls.GetOutputPort()); tf.SetRadius(r); tf.SetNumberOfSides(64); tf.CappingOn(); tf.Update()
-        fiberPoly=vtk.vtkPolyData(); fiberPoly.DeepCopy(tf.GetOutput())
+        with Tracing.stage("mesh build") as traced:
+            fiberPoly=self._fiber_polydata(pEntry, pTarget, r); traced["polygons"]=fiberPoly.GetNumberOfCells()
         fiberName=self._ensureUniqueNode("vtkMRMLModelNode", f"{lineName} (fiber Ø{fiberDiameterMm:.2f}mm)", overwrite)
         fiberNode=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", fiberName); fiberNode.SetAndObservePolyData(fiberPoly)
         fd=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelDisplayNode"); fiberNode.SetAndObserveDisplayNodeID(fd.GetID())
@@ -151,25 +171,23 @@ class TrajectoryFromPointsLogic(ScriptedLoadableModuleLogic):
         self._applySliceIntersectionDisplay(fd, [fr,fg,fb], thicknessPx=5, opacity=1.0)
         # Necrosis ellipsoid
         r_minor=max(necrosisDiameterMm*0.5, 0.01); r_major=max(necrosisLengthMm*0.5, 0.01)
-        offset=max(0.0, necrosisStartOffsetMm) + r_major
-        center=[pTarget[0]-u[0]*offset, pTarget[1]-u[1]*offset, pTarget[2]-u[2]*offset]
-        ell=vtk.vtkParametricEllipsoid(); ell.SetXRadius(r_minor); ell.SetYRadius(r_minor); ell.SetZRadius(r_major)
-        src=vtk.vtkParametricFunctionSource(); src.SetParametricFunction(ell); src.SetUResolution(64); src.SetVResolution(64); src.Update()
-        ang, axis = self._rot_z_to_vec(u); T=vtk.vtkTransform(); T.PostMultiply(); T.RotateWXYZ(ang, axis); T.Translate(center)
-        tpf=vtk.vtkTransformPolyDataFilter(); tpf.SetInputConnection(src.GetOutputPort()); tpf.SetTransform(T); tpf.Update()
-        necPoly=vtk.vtkPolyData(); necPoly.DeepCopy(tpf.GetOutput())
+        center=Geometry.necrosis_centers(pEntry, pTarget, [necrosisStartOffsetMm], necrosisLengthMm)[0]
+        with Tracing.stage("mesh build") as traced:
+            necPoly=self._ellipsoid_polydata(center, u, r_minor, r_major); traced["polygons"]=necPoly.GetNumberOfCells()
         necName=self._ensureUniqueNode("vtkMRMLModelNode", f"{lineName} (necrosi)", overwrite)
         necNode=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", necName); necNode.SetAndObservePolyData(necPoly)
         nd=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelDisplayNode"); necNode.SetAndObserveDisplayNodeID(nd.GetID())
         nr,ng,nb=self._rgbf(necrosisColor); nd.SetColor(nr,ng,nb); nd.SetOpacity(0.6); nd.SetBackfaceCulling(0); nd.SetScalarVisibility(0); nd.SetVisibility(1)
         self._applySliceIntersectionDisplay(nd, [nr,ng,nb], thicknessPx=5, opacity=1.0)
+        lineNode.SetNodeReferenceID(self.FIBER_REFERENCE, fiberNode.GetID()); lineNode.SetNodeReferenceID(self.NECROSIS_REFERENCE, necNode.GetID())
+        self._register(outputBaseName, entryLabel, targetLabel, fiberDiameterMm, [necrosisStartOffsetMm], necrosisDiameterMm, necrosisLengthMm)
         return lineNode, fiberNode, necNode
+    @SceneUtils.batch_processing()
     def runMultipleNecrosis(self, entryLabel, targetLabel, fiberDiameterMm, offsets_txt,
                             necrosisDiameterMm, necrosisLengthMm,
                             fiberColor, necrosisColor, outputBaseName, searchOnlyVisible, overwrite, showLine):
         # Trova entry/target
-        pEntry,_,_ = self._findPointByLabel(entryLabel, searchOnlyVisible)
-        pTarget,_,_ = self._findPointByLabel(targetLabel, searchOnlyVisible)
+        pEntry, pTarget = self._endpoints(entryLabel, targetLabel, searchOnlyVisible)
         d=[pTarget[0]-pEntry[0], pTarget[1]-pEntry[1], pTarget[2]-pEntry[2]]; u=self._unit(d)
 
         # Linea come nell'originale
@@ -180,11 +198,10 @@ class TrajectoryFromPointsLogic(ScriptedLoadableModuleLogic):
         if ld:
             fr,fg,fb=self._rgbf(fiberColor); ld.SetColor(fr,fg,fb); ld.SetLineThickness(1.0); ld.SetPointLabelsVisibility(False); ld.SetVisibility(1 if showLine else 0)
 
-        # Fibra come nell'originale (tube da linea)
+        # Fibra come nell'originale (cilindro entry-target, da template in cache)
         r=max(fiberDiameterMm*0.5, 0.01)
-        ls=vtk.vtkLineSource(); ls.SetPoint1(pEntry); ls.SetPoint2(pTarget); ls.Update()
-        tf=vtk.vtkTubeFilter(); tf.SetInputConnection(ls.GetOutputPort()); tf.SetRadius(r); tf.SetNumberOfSides(64); tf.CappingOn(); tf.Update()
-        fiberPoly=vtk.vtkPolyData(); fiberPoly.DeepCopy(tf.GetOutput())
+        with Tracing.stage("mesh build") as traced:
+            fiberPoly=self._fiber_polydata(pEntry, pTarget, r); traced["polygons"]=fiberPoly.GetNumberOfCells()
         fiberName=self._ensureUniqueNode("vtkMRMLModelNode", f"{lineName} (fiber Ø{fiberDiameterMm:.2f}mm)", overwrite)
         fiberNode=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", fiberName); fiberNode.SetAndObservePolyData(fiberPoly)
         fd=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelDisplayNode"); fiberNode.SetAndObserveDisplayNodeID(fd.GetID())
@@ -192,26 +209,16 @@ class TrajectoryFromPointsLogic(ScriptedLoadableModuleLogic):
         self._applySliceIntersectionDisplay(fd, [fr,fg,fb], thicknessPx=3, opacity=0.7)
 
         # Parse offsets multipli
-        values=[]
-        if offsets_txt:
-            txt = offsets_txt.replace(';', ',')
-            for part in txt.split(','):
-                s = part.strip().replace(',', '.')
-                if s:
-                    try: values.append(float(s))
-                    except: pass
-        if not values: values=[0.0]
+        values=self._parseOffsets(offsets_txt)
+        # Centri di tutte le necrosi in un solo passaggio
+        centers=Geometry.necrosis_centers(pEntry, pTarget, values, necrosisLengthMm)
 
-        # Funzione per creare una necrosi come nell'originale, variando l'offset
-        def _necrosis_node(idx, offsetFromTargetMm):
+        # Funzione per creare una necrosi come nell'originale, variando il centro
+        def _necrosis_node(idx, center):
             r_minor=max(necrosisDiameterMm*0.5, 0.01); r_major=max(necrosisLengthMm*0.5, 0.01)
-            offset=max(0.0, offsetFromTargetMm) + r_major
-            center=[pTarget[0]-u[0]*offset, pTarget[1]-u[1]*offset, pTarget[2]-u[2]*offset]
-            ell=vtk.vtkParametricEllipsoid(); ell.SetXRadius(r_minor); ell.SetYRadius(r_minor); ell.SetZRadius(r_major)
-            src=vtk.vtkParametricFunctionSource(); src.SetParametricFunction(ell); src.SetUResolution(64); src.SetVResolution(64); src.Update()
-            ang, axis = self._rot_z_to_vec(u); T=vtk.vtkTransform(); T.PostMultiply(); T.RotateWXYZ(ang, axis); T.Translate(center)
-            tpf=vtk.vtkTransformPolyDataFilter(); tpf.SetInputConnection(src.GetOutputPort()); tpf.SetTransform(T); tpf.Update()
-            necPoly=vtk.vtkPolyData(); necPoly.DeepCopy(tpf.GetOutput())
+            # Template in cache: ricostruito una sola volta per (diametro, lunghezza, qualità)
+            with Tracing.stage("mesh build") as traced:
+                necPoly=self._ellipsoid_polydata(center, u, r_minor, r_major); traced["polygons"]=necPoly.GetNumberOfCells()
             necName=self._ensureUniqueNode("vtkMRMLModelNode", f"{lineName} (necrosi {idx})", overwrite)
             necNode=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", necName); necNode.SetAndObservePolyData(necPoly)
             nd=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelDisplayNode"); necNode.SetAndObserveDisplayNodeID(nd.GetID())
@@ -219,8 +226,59 @@ class TrajectoryFromPointsLogic(ScriptedLoadableModuleLogic):
             self._applySliceIntersectionDisplay(nd, [nr,ng,nb], thicknessPx=5, opacity=1.0)
             return necNode
 
+        lineNode.SetNodeReferenceID(self.FIBER_REFERENCE, fiberNode.GetID())
         last=None
-        for idx, off in enumerate(values, 1):
-            last = _necrosis_node(idx, off)
+        for idx, center in enumerate(centers, 1):
+            last = _necrosis_node(idx, center)
+            lineNode.AddNodeReferenceID(self.NECROSIS_REFERENCE, last.GetID())
 
+        self._register(outputBaseName, entryLabel, targetLabel, fiberDiameterMm, values, necrosisDiameterMm, necrosisLengthMm)
         return lineNode, fiberNode, last
+    def update(self, entryLabel, targetLabel, fiberDiameterMm, necrosisStartOffsetMm, necrosisDiameterMm, necrosisLengthMm,
+               fiberColor, necrosisColor, outputBaseName, searchOnlyVisible, showLine):
+        """Come run(), ma riusa i nodi esistenti di outputBaseName riscrivendo i punti in place."""
+        res=self._updateInPlace(entryLabel, targetLabel, fiberDiameterMm, [necrosisStartOffsetMm], necrosisDiameterMm, necrosisLengthMm,
+                                fiberColor, necrosisColor, outputBaseName, searchOnlyVisible, showLine)
+        if res is None:
+            res=self.run(entryLabel, targetLabel, fiberDiameterMm, necrosisStartOffsetMm, necrosisDiameterMm, necrosisLengthMm,
+                         fiberColor, necrosisColor, outputBaseName, searchOnlyVisible, True, showLine)
+        return res
+    def updateMultipleNecrosis(self, entryLabel, targetLabel, fiberDiameterMm, offsets_txt, necrosisDiameterMm, necrosisLengthMm,
+                               fiberColor, necrosisColor, outputBaseName, searchOnlyVisible, showLine):
+        """Come runMultipleNecrosis(), ma riusa i nodi esistenti se il numero di offset non cambia."""
+        res=self._updateInPlace(entryLabel, targetLabel, fiberDiameterMm, self._parseOffsets(offsets_txt), necrosisDiameterMm, necrosisLengthMm,
+                                fiberColor, necrosisColor, outputBaseName, searchOnlyVisible, showLine)
+        if res is None:
+            res=self.runMultipleNecrosis(entryLabel, targetLabel, fiberDiameterMm, offsets_txt, necrosisDiameterMm, necrosisLengthMm,
+                                         fiberColor, necrosisColor, outputBaseName, searchOnlyVisible, True, showLine)
+        return res
+    def _updateInPlace(self, entryLabel, targetLabel, fiberDiameterMm, offsets, necrosisDiameterMm, necrosisLengthMm,
+                       fiberColor, necrosisColor, outputBaseName, searchOnlyVisible, showLine):
+        # Nodi collegati alla linea da run/runMultipleNecrosis; None = struttura diversa, serve rigenerare
+        lineNode=slicer.util.getFirstNodeByClassByName("vtkMRMLMarkupsLineNode", outputBaseName)
+        if lineNode is None or lineNode.GetNumberOfControlPoints()!=2: return None
+        fiberNode=lineNode.GetNodeReference(self.FIBER_REFERENCE)
+        necNodes=[lineNode.GetNthNodeReference(self.NECROSIS_REFERENCE, i) for i in range(lineNode.GetNumberOfNodeReferences(self.NECROSIS_REFERENCE))]
+        if fiberNode is None or len(necNodes)!=len(offsets) or any(n is None or n.GetPolyData() is None for n in [fiberNode]+necNodes): return None
+        pEntry, pTarget = self._endpoints(entryLabel, targetLabel, searchOnlyVisible)
+        R=Geometry.frame_from_axis(Geometry.axes(pEntry, pTarget))
+        wasModifying=lineNode.StartModify()
+        try: lineNode.SetNthControlPointPositionWorld(0, pEntry); lineNode.SetNthControlPointPositionWorld(1, pTarget)
+        finally: lineNode.EndModify(wasModifying)
+        ld=lineNode.GetDisplayNode()
+        if ld: ld.SetVisibility(1 if showLine else 0)
+        r=max(fiberDiameterMm*0.5, 0.01); mid=[(pEntry[0]+pTarget[0])*0.5, (pEntry[1]+pTarget[1])*0.5, (pEntry[2]+pTarget[2])*0.5]
+        r_minor=max(necrosisDiameterMm*0.5, 0.01); r_major=max(necrosisLengthMm*0.5, 0.01)
+        with Tracing.stage("mesh build") as traced:
+            MeshTemplates.update_polydata(fiberNode.GetPolyData(), [(self._fiber_template(r), R, [mid], math.dist(pEntry, pTarget))])
+            ellTpl=self._ellipsoid_template(r_minor, r_major)
+            for necNode, center in zip(necNodes, Geometry.necrosis_centers(pEntry, pTarget, offsets, necrosisLengthMm)):
+                MeshTemplates.update_polydata(necNode.GetPolyData(), [(ellTpl, R, [center])])
+            traced["polygons"]=sum(n.GetPolyData().GetNumberOfCells() for n in [fiberNode]+necNodes)
+        fiberName=f"{outputBaseName} (fiber Ø{fiberDiameterMm:.2f}mm)"
+        if fiberNode.GetName()!=fiberName: fiberNode.SetName(fiberName)
+        for node, qc in [(fiberNode, fiberColor)]+[(n, necrosisColor) for n in necNodes]:
+            d=node.GetDisplayNode()
+            if d: d.SetColor(*self._rgbf(qc))
+        self._register(outputBaseName, entryLabel, targetLabel, fiberDiameterMm, offsets, necrosisDiameterMm, necrosisLengthMm)
+        return lineNode, fiberNode, necNodes[-1]
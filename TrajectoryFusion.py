@@ -1,11 +1,14 @@
 
+import time
+_IMPORT_T0 = time.perf_counter()  # durata dell'import, vedi Tracing.note_startup in fondo
 import os
+import functools
 import numpy as np
 import vtk
 import slicer
 import qt
 from slicer.ScriptedLoadableModule import *
-import random
+from PLATiNLib import MeshTemplates, SceneUtils, Tracing, Trajectories, TrajectoryRegistry
 
 class TrajectoryFusion(ScriptedLoadableModule):
     def __init__(self, parent):
@@ -17,7 +20,6 @@ class TrajectoryFusion(ScriptedLoadableModule):
         parent.acknowledgementText = "Thanks to OpenAI."
         self.parent = parent
     
-        import os
         iconPath = os.path.join(
             os.path.dirname(__file__),
             'Resources', 'Icons', 'SEEG_LiTT_Planner.png'
@@ -36,12 +38,12 @@ class TrajectoryFusionWidget(ScriptedLoadableModuleWidget):
         except Exception:
             pass
         try:
-            import slicer
             slicer.util.showStatusMessage(message, 3000)
         except Exception:
             pass
 
     def setup(self):
+        t0 = time.perf_counter()
         ScriptedLoadableModuleWidget.setup(self)
 
         self.markupSelector = slicer.qMRMLNodeComboBox()
@@ -71,6 +73,25 @@ class TrajectoryFusionWidget(ScriptedLoadableModuleWidget):
         self.layout.addWidget(self.directoryButton)
         self.outputDirectory = slicer.app.temporaryPath
 
+        self.keepIntermediateCheck = qt.QCheckBox("Keep intermediate nodes (Model_*, Seg_*, Label_*, Fused_*) in scene")
+        self.keepIntermediateCheck.toolTip = ("Se disabilitato, i nodi temporanei e i volumi fusi (Fused_*, FusedLabel_ALL) "
+                                              "vengono rimossi dopo il salvataggio dei file")
+        self.keepIntermediateCheck.checked = False
+        self.layout.addWidget(self.keepIntermediateCheck)
+
+        self.exportNrrdCheck = qt.QCheckBox("Also save a NRRD copy (.nrrd) of each output")
+        self.exportNrrdCheck.toolTip = "Scrive anche r-*.nrrd accanto a ogni r-*.nii.gz, dallo stesso volume in memoria"
+        self.exportNrrdCheck.checked = False
+        self.layout.addWidget(self.exportNrrdCheck)
+
+        exportThreadsLayout = qt.QFormLayout()
+        self.exportWorkersSpin = qt.QSpinBox()
+        self.exportWorkersSpin.setRange(0, 64)
+        self.exportWorkersSpin.setValue(0)
+        self.exportWorkersSpin.setSpecialValueText("Auto")
+        self.exportWorkersSpin.toolTip = "Thread usati per calcolare e comprimere i volumi per traiettoria (Auto = CPU disponibili)"
+        exportThreadsLayout.addRow("Export threads:", self.exportWorkersSpin)
+        self.layout.addLayout(exportThreadsLayout)
 
         # ============================================================
         # ADD-ON (OPTIONAL): Reorient generated NIfTI to RAS and export to DICOM
@@ -127,6 +148,27 @@ class TrajectoryFusionWidget(ScriptedLoadableModuleWidget):
         manualLayout.addWidget(self.convertSelectedButton)
         self.convertSelectedButton.connect('clicked(bool)', self._tf_convertSelectedNifti)
 
+        concurrencyLayout = qt.QFormLayout()
+        self.exportConcurrencySpin = qt.QSpinBox()
+        self.exportConcurrencySpin.setRange(1, 32)
+        self.exportConcurrencySpin.setValue(min(4, os.cpu_count() or 1))
+        self.exportConcurrencySpin.toolTip = "Numero massimo di conversioni (OrientScalarVolume / CreateDICOMSeries) in parallelo"
+        concurrencyLayout.addRow("Parallel conversions:", self.exportConcurrencySpin)
+        manualLayout.addLayout(concurrencyLayout)
+
+        self.exportJobsList = qt.QListWidget()
+        self.exportJobsList.setToolTip("Status of each queued conversion")
+        self.exportJobsList.setSelectionMode(qt.QAbstractItemView.NoSelection)
+        manualLayout.addWidget(self.exportJobsList)
+
+        self.cancelExportButton = qt.QPushButton("Cancel conversions")
+        self.cancelExportButton.toolTip = "Stop the running conversions and drop the queued ones"
+        self.cancelExportButton.enabled = False
+        manualLayout.addWidget(self.cancelExportButton)
+        self.cancelExportButton.connect('clicked(bool)', self._tf_cancelConversions)
+        self._tfExportQueue = None
+        self._tfExportJobItems = {}
+
         self.layout.addWidget(self.manualGroupBox)
 
 
@@ -135,7 +177,27 @@ class TrajectoryFusionWidget(ScriptedLoadableModuleWidget):
         self.layout.addWidget(self.applyButton)
         self.applyButton.connect('clicked(bool)', self.runScript)
 
+        # --- Traiettorie + label bruciate nel volume (entry/target) ---
+        self.labelModeCombo = qt.QComboBox()
+        self.labelModeCombo.addItems(["Entry only", "Target only", "Entry + Target"])
+        self.labelModeCombo.toolTip = "Scegli quali label stampare nel volume"
+        self.layout.addWidget(self.labelModeCombo)
+
+        self.perTrajectoryLabelsButton = qt.QPushButton("Create labels (per trajectory)")
+        self.perTrajectoryLabelsButton.toolTip = "Crea un NIfTI/NRRD per traiettoria con traiettoria + lettere bruciate"
+        self.layout.addWidget(self.perTrajectoryLabelsButton)
+        self.perTrajectoryLabelsButton.connect('clicked(bool)', lambda checked=False: _tf_run_per_trajectory_with_labels(self))
+
+        self.combinedLabelsButton = qt.QPushButton("Create labels (ALL in one file)")
+        self.combinedLabelsButton.toolTip = "Crea un solo NIfTI/NRRD con tutte le traiettorie + lettere bruciate"
+        self.layout.addWidget(self.combinedLabelsButton)
+        self.combinedLabelsButton.connect('clicked(bool)', lambda checked=False: _tf_run_combined_with_labels(self))
+
+        # Tempi/memoria per stadio delle fusioni (opt-in, condiviso con il planner)
+        self.tracePanel = Tracing.TracePanel(self.layout)
+
         self.layout.addStretch(1)
+        Tracing.note_startup("TrajectoryFusion", "setup", time.perf_counter() - t0)
 
     def selectOutputDirectory(self):
         dir = qt.QFileDialog.getExistingDirectory()
@@ -184,7 +246,7 @@ class TrajectoryFusionWidget(ScriptedLoadableModuleWidget):
             self.niftiListWidget.addItem(item)
 
     def _tf_convertSelectedNifti(self):
-        """For each checked NIfTI in the list: reorient to RAS (file->file) and export to DICOM."""
+        """Queue, for each checked NIfTI: reorient to RAS (file->file), then export to DICOM."""
         outDir = getattr(self, "outputDirectory", None)
         if not outDir or not os.path.isdir(outDir):
             slicer.util.errorDisplay("Please select a valid output directory first.")
@@ -220,8 +282,13 @@ class TrajectoryFusionWidget(ScriptedLoadableModuleWidget):
         if not seriesDesc:
             seriesDesc = "TrajectoryFusion"
 
+        queue = self._tf_exportQueue()
+        queue.maxConcurrent = self.exportConcurrencySpin.value if hasattr(self, "exportConcurrencySpin") else 4
+        # One study on one frame of reference (the T1 of every selected output) when the
+        # in-process DICOM writer is available
+        studyUID, frameOfReferenceUID = _tf_new_dicom_uid(), _tf_new_dicom_uid()
         failures = []
-        for niftiPath in selectedPaths:
+        for seriesNumber, niftiPath in enumerate(selectedPaths, start=1):
             try:
                 if not os.path.exists(niftiPath):
                     raise RuntimeError(f"Input image file does not exist: {niftiPath}")
@@ -233,29 +300,65 @@ class TrajectoryFusionWidget(ScriptedLoadableModuleWidget):
                 if os.path.abspath(rasPath) == os.path.abspath(niftiPath):
                     rasPath = _tf_make_ras_nifti_path(niftiPath + "_copy")
 
-                _tf_orient_nifti_file_to_ras(niftiPath, rasPath)
-                self._tf_log(f"[RAS Save] ✓ {rasPath}")
-
                 # 2) Export that RAS NIfTI to DICOM (file->DICOM)
                 dicomOut = os.path.join(outDir, "DICOM", os.path.splitext(os.path.basename(rasPath))[0])
-                _tf_export_volume_to_dicom(
-                    rasPath,
-                    dicomDir=dicomOut,
-                    patientName=patientName,
-                    modality=modality,
-                    seriesDescription=seriesDesc,
-                    studyDescription=seriesDesc,
-                )
-                self._tf_log(f"[DICOM Export] ✓ {dicomOut}")
-
+                os.makedirs(dicomOut, exist_ok=True)
+                # Axis-aligned volumes are reoriented in memory, oblique ones by OrientScalarVolume
+                if _tf_nifti_reorients_in_process(niftiPath):
+                    orientStep = ("Reorient to RAS",
+                                  lambda src=niftiPath, dst=rasPath: _tf_reorient_nifti_file_in_process(src, dst, required=True),
+                                  rasPath)
+                else:
+                    orientStep = ("OrientScalarVolume", _tf_orient_to_ras_args(niftiPath, rasPath), rasPath)
+                if studyUID is not None:
+                    dicomStep = ("Write DICOM series",
+                                 lambda src=rasPath, dst=dicomOut, n=seriesNumber: _tf_export_nifti_file_to_dicom(
+                                     src, dst, patientName, modality, seriesDesc, studyInstanceUID=studyUID,
+                                     frameOfReferenceUID=frameOfReferenceUID, seriesNumber=n),
+                                 None)
+                else:
+                    dicomStep = ("CreateDICOMSeries",
+                                 _tf_create_dicom_series_args(rasPath, dicomOut, patientName, modality, seriesDesc), None)
+                queue.add(os.path.basename(niftiPath), [orientStep, dicomStep])
             except Exception as e:
                 failures.append(f"{os.path.basename(niftiPath)}: {e}")
 
         if failures:
-            slicer.util.errorDisplay("Some exports failed:\n" + "\n".join(failures))
+            slicer.util.errorDisplay("Some exports could not be queued:\n" + "\n".join(failures))
+        if queue.busy:
+            self.cancelExportButton.enabled = True
+            queue.start()
+
+    def _tf_exportQueue(self):
+        """The widget's conversion queue (created on first use; reused while jobs are pending)."""
+        if self._tfExportQueue is None or not self._tfExportQueue.busy:
+            self._tfExportQueue = _TFCliQueue(log=self._tf_log, onJobChanged=self._tf_onConversionChanged,
+                                              onFinished=self._tf_onConversionsFinished)
+            self._tfExportJobItems = {}
+            self.exportJobsList.clear()
+        return self._tfExportQueue
+
+    def _tf_onConversionChanged(self, job):
+        item = self._tfExportJobItems.get(id(job))
+        if item is None:
+            item = qt.QListWidgetItem()
+            self.exportJobsList.addItem(item)
+            self._tfExportJobItems[id(job)] = item
+        item.setText(f"{job.name} — {job.statusText}")
+
+    def _tf_onConversionsFinished(self, jobs):
+        self.cancelExportButton.enabled = False
+        self.tracePanel.refresh()
+        failed = [f"{j.name}: {j.statusText}" for j in jobs if j.status != "done"]
+        if failed:
+            slicer.util.errorDisplay("Some exports failed:\n" + "\n".join(failed))
         else:
             slicer.util.infoDisplay("Selected NIfTI exported to DICOM successfully.")
 
+    def _tf_cancelConversions(self):
+        if self._tfExportQueue is not None:
+            self._tfExportQueue.cancel()
+
     def _tf_getPatientName(self):
         if hasattr(self, "patientNameLineEdit"):
             name = self.patientNameLineEdit.text.strip()
@@ -292,20 +395,97 @@ class TrajectoryFusionWidget(ScriptedLoadableModuleWidget):
         markupNode = self.markupSelector.currentNode()
         refVolume = self.refSelector.currentNode()
         intensityValue = self.intensitySlider.value
+        keepIntermediate = bool(getattr(self, "keepIntermediateCheck", None) and self.keepIntermediateCheck.checked)
         if not markupNode or not refVolume:
             slicer.util.errorDisplay("Please select both a markup and a reference volume.")
             return
 
-        fiducials = {}
-        for i in range(markupNode.GetNumberOfControlPoints()):
-            label = markupNode.GetNthControlPointLabel(i)
-            pos = [0, 0, 0]
-            markupNode.GetNthControlPointPositionWorld(i, pos)
-            if "_" in label:
-                base = label.split("_")[0]
-                fiducials.setdefault(base, {})["target"] = pos
-            else:
-                fiducials.setdefault(label, {})["entry"] = pos
+        # Optional add-on: create RAS-oriented NIfTI and export to DICOM
+        dicomExport = None
+        if hasattr(self, "exportDicomCheck") and self.exportDicomCheck.checked:
+            dicomExport = {
+                "patientName": self._tf_getPatientName(),
+                "modality": self._tf_getModality(),
+                "seriesDescription": self._tf_getSeriesDescription(),
+            }
+
+        logic = TrajectoryFusionLogic()
+        # Model/Seg/Label/Fused nodes per trajectory: one scene update and one render at the end.
+        # The full-size Fused_<key> volumes are already saved: removed with the other nodes
+        with SceneUtils.batch_processing(), _TFSceneScope(keepNodes=keepIntermediate) as scope:
+            logic.fuseSegmentation(markupNode, refVolume, self.outputDirectory, intensityValue,
+                                   keepIntermediate=keepIntermediate, dicomExport=dicomExport, scope=scope,
+                                   exportNrrd=_tf_get_export_nrrd(self))
+        self.tracePanel.refresh()
+        if logic.errors:
+            slicer.util.errorDisplay("\n".join(logic.errors))
+
+
+class TrajectoryFusionLogic(ScriptedLoadableModuleLogic):
+    """Fusion entry points that do not depend on the module widget.
+
+    Used by the widget buttons and by the headless batch runner
+    (Scripts/run_trajectory_fusion.py). Every method writes its outputs to
+    `outputDirectory` and returns the list of files written; failures that do
+    not stop the run (e.g. a DICOM export) are collected in `self.errors`.
+    """
+
+    MODES = ("segmentation", "per-trajectory", "combined")
+    LABEL_MODES = ("Entry only", "Target only", "Entry + Target")
+
+    def __init__(self):
+        ScriptedLoadableModuleLogic.__init__(self)
+        self.errors = []
+
+    @staticmethod
+    def _checkInputs(markupNode, refVolume, outputDirectory):
+        if not markupNode or not refVolume:
+            raise ValueError("Please select both a markup and a reference volume.")
+        if refVolume.GetImageData() is None:
+            raise ValueError("Reference volume is invalid")
+        if not outputDirectory:
+            raise ValueError("Output directory is not set.")
+        os.makedirs(outputDirectory, exist_ok=True)
+
+    def run(self, markupNode, refVolume, outputDirectory, mode="per-trajectory", intensityValue=500,
+            labelMode="Entry + Target", keepIntermediate=False, dicomExport=None, scope=None,
+            workers=None, progressCallback=None, exportNrrd=False):
+        """Run one fusion mode ("segmentation", "per-trajectory" or "combined").
+
+        exportNrrd=True also writes a .nrrd copy next to every NIfTI output.
+        """
+        if mode == "segmentation":
+            return self.fuseSegmentation(markupNode, refVolume, outputDirectory, intensityValue,
+                                         keepIntermediate=keepIntermediate, dicomExport=dicomExport, scope=scope,
+                                         exportNrrd=exportNrrd)
+        if mode == "per-trajectory":
+            return self.fusePerTrajectory(markupNode, refVolume, outputDirectory, intensityValue, labelMode,
+                                          workers=workers, progressCallback=progressCallback, exportNrrd=exportNrrd)
+        if mode == "combined":
+            return self.fuseCombined(markupNode, refVolume, outputDirectory, intensityValue, labelMode, scope=scope,
+                                     exportNrrd=exportNrrd)
+        raise ValueError(f"Unknown fusion mode: {mode}")
+
+    @Tracing.traced("fusion: segmentation", "run")
+    def fuseSegmentation(self, markupNode, refVolume, outputDirectory, intensityValue=500,
+                         keepIntermediate=False, dicomExport=None, scope=None, exportNrrd=False):
+        """Original mode: r-<key>.nii.gz per trajectory, tube rasterized through Segmentations.
+
+        dicomExport: None, or dict(patientName=..., modality=..., seriesDescription=...) to
+        also write r-<key>-RAS.nii.gz and a DICOM series. The Fused_<key> output nodes stay
+        in the scene unless a _TFSceneScope is passed as `scope`.
+        """
+        import random
+        self.errors = []
+        self._checkInputs(markupNode, refVolume, outputDirectory)
+        outputs = []
+        # Every series of this run belongs to one DICOM study on the T1's frame of reference
+        studyUID, frameOfReferenceUID = _tf_new_dicom_uid(), _tf_new_dicom_uid()
+        seriesNumber = 0
+        tubeSides = _tf_tube_sides(_tf_ijk_to_ras_array(refVolume), 2.0)
+
+        with Tracing.stage("point lookup", points=markupNode.GetNumberOfControlPoints()):
+            fiducials = _tf_collect_trajectories_from_markup(markupNode)
 
         for key, pts in fiducials.items():
             if "entry" not in pts or "target" not in pts:
@@ -313,61 +493,250 @@ class TrajectoryFusionWidget(ScriptedLoadableModuleWidget):
             p1 = pts["entry"]
             p2 = pts["target"]
             print(f"[LineSource] Traiettoria {key} → P1: {p1}, P2: {p2}")
-            polydata = createTubeBetweenPoints(p1, p2, radius=2.0)
-
-            modelNode = slicer.modules.models.logic().AddModel(polydata)
-            modelNode.SetName(f"Model_{key}")
-            modelNode.CreateDefaultDisplayNodes()
-            r, g, b = [random.uniform(0.2, 1.0) for _ in range(3)]
-            modelNode.GetDisplayNode().SetColor(r, g, b)
-
-            segNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSegmentationNode", f"Seg_{key}")
-            segNode.SetReferenceImageGeometryParameterFromVolumeNode(refVolume)
-            slicer.modules.segmentations.logic().ImportModelToSegmentationNode(modelNode, segNode)
-
-            segmentIds = vtk.vtkStringArray()
-            segNode.GetSegmentation().GetSegmentIDs(segmentIds)
-            if segmentIds.GetNumberOfValues() > 0:
-                segId = segmentIds.GetValue(segmentIds.GetNumberOfValues() - 1)
-                segNode.GetSegmentation().GetSegment(segId).SetName(key)
-
-            labelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode", f"Label_{key}")
-            slicer.modules.segmentations.logic().ExportVisibleSegmentsToLabelmapNode(segNode, labelNode, refVolume)
-
-            labelArray = slicer.util.arrayFromVolume(labelNode)
-            unique = np.unique(labelArray)
-            print(f"→ Valori unici nella labelmap {key}: {unique}")
-            if len(unique) <= 1 and unique[0] == 0:
-                print(f"[Python] Labelmap {key} vuota: verifica traiettoria o geometria")
-
-            fusedNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", f"Fused_{key}")
-            refArray = slicer.util.arrayFromVolume(refVolume).copy()
-            refArray += labelArray * intensityValue
-            slicer.util.updateVolumeFromArray(fusedNode, refArray)
-
-            fusedNode.SetSpacing(refVolume.GetSpacing())
-            fusedNode.SetOrigin(refVolume.GetOrigin())
-            mat = vtk.vtkMatrix4x4()
-            refVolume.GetIJKToRASMatrix(mat)
-            fusedNode.SetIJKToRASMatrix(mat)
-
-            outputPath = os.path.join(self.outputDirectory, f"r-{key}.nii.gz")
-            success = slicer.util.saveNode(fusedNode, outputPath)
+            # Model/Seg/Label nodes only exist to produce the labelmap: they are removed
+            # as soon as the fused volume is computed, unless the user asks to keep them.
+            with _TFSceneScope(keepNodes=keepIntermediate) as intermediates:
+                with Tracing.stage("mesh build") as traced:
+                    polydata = createTubeBetweenPoints(p1, p2, radius=2.0, resolution=tubeSides)
+                    traced["polygons"] = polydata.GetNumberOfCells()
+
+                modelNode = intermediates.add(slicer.modules.models.logic().AddModel(polydata))
+                modelNode.SetName(f"Model_{key}")
+                modelNode.CreateDefaultDisplayNodes()
+                r, g, b = [random.uniform(0.2, 1.0) for _ in range(3)]
+                modelNode.GetDisplayNode().SetColor(r, g, b)
+
+                with Tracing.stage("rasterization") as traced:
+                    segNode = intermediates.addNewNode("vtkMRMLSegmentationNode", f"Seg_{key}")
+                    segNode.SetReferenceImageGeometryParameterFromVolumeNode(refVolume)
+                    slicer.modules.segmentations.logic().ImportModelToSegmentationNode(modelNode, segNode)
+
+                    segmentIds = vtk.vtkStringArray()
+                    segNode.GetSegmentation().GetSegmentIDs(segmentIds)
+                    if segmentIds.GetNumberOfValues() > 0:
+                        segId = segmentIds.GetValue(segmentIds.GetNumberOfValues() - 1)
+                        segNode.GetSegmentation().GetSegment(segId).SetName(key)
+
+                    labelNode = intermediates.addNewNode("vtkMRMLLabelMapVolumeNode", f"Label_{key}")
+                    slicer.modules.segmentations.logic().ExportVisibleSegmentsToLabelmapNode(segNode, labelNode, refVolume)
+
+                    labelArray = slicer.util.arrayFromVolume(labelNode)
+                    if Tracing.enabled():
+                        traced["voxels"] = int(np.count_nonzero(labelArray))
+                unique = np.unique(labelArray)
+                print(f"→ Valori unici nella labelmap {key}: {unique}")
+                if len(unique) <= 1 and unique[0] == 0:
+                    print(f"[Python] Labelmap {key} vuota: verifica traiettoria o geometria")
+
+                # One copy of the T1 (the node's own buffer), patched only where the label is on
+                with Tracing.stage("fusion", voxels=labelArray.size):
+                    fusedNode, fusedArray = _tf_new_fused_node(refVolume, f"Fused_{key}")
+                    on = labelArray > 0
+                    fusedArray[on] += (labelArray[on].astype(np.float64) * intensityValue).astype(fusedArray.dtype)
+                    slicer.util.arrayFromVolumeModified(fusedNode)
+
+            if scope is not None:
+                scope.add(fusedNode)
+
+            outputPath = os.path.join(outputDirectory, f"r-{key}.nii.gz")
+            try:
+                outputs += _tf_write_volume_files(outputPath, fusedArray, _tf_ijk_to_ras_array(fusedNode),
+                                                  exportNrrd=exportNrrd)
+                success = True
+            except Exception as e:
+                success = False
+                self.errors.append(f"Save failed for {key}: {e}")
             print(f"[Save] {'✓' if success else '✗'} Salvataggio: {outputPath}")
 
             # Optional add-on: create RAS-oriented NIfTI and export to DICOM
-            if hasattr(self, "exportDicomCheck") and self.exportDicomCheck.checked and success:
+            if dicomExport and success:
+                seriesNumber += 1
                 try:
                     _tf_export_nifti_as_ras_and_dicom(
                         inputVolumeNode=fusedNode,
                         originalNiftiPath=outputPath,
-                        outputDirectory=self.outputDirectory,
-                        patientName=self._tf_getPatientName(),
-                        modality=self._tf_getModality(),
-                        seriesDescription=self._tf_getSeriesDescription(),
+                        outputDirectory=outputDirectory,
+                        patientName=dicomExport.get("patientName", ""),
+                        modality=dicomExport.get("modality", "MR"),
+                        seriesDescription=dicomExport.get("seriesDescription", ""),
+                        studyInstanceUID=studyUID,
+                        frameOfReferenceUID=frameOfReferenceUID,
+                        seriesNumber=seriesNumber,
                     )
                 except Exception as e:
-                    slicer.util.errorDisplay(f"RAS/DICOM export failed for {key}: {e}")
+                    self.errors.append(f"RAS/DICOM export failed for {key}: {e}")
+                    print(f"[TrajectoryFusion] RAS/DICOM export failed for {key}: {e}")
+
+        return outputs
+
+    @Tracing.traced("fusion: per-trajectory", "run")
+    def fusePerTrajectory(self, markupNode, refVolume, outputDirectory, intensityValue=500,
+                          labelMode="Entry + Target", workers=None, progressCallback=None, exportNrrd=False):
+        """One r-<key>-labels.nii.gz per trajectory (analytic tube + burned labels).
+
+        Trajectories are rasterized, fused and compressed on `workers` threads (None or
+        0 = automatic, see _tf_export_worker_count); only the reference voxels are read
+        from MRML, on this thread. progressCallback(done, total, key) is forwarded to
+        _tf_run_parallel.
+        """
+        self.errors = []
+        self._checkInputs(markupNode, refVolume, outputDirectory)
+
+        with Tracing.stage("point lookup", points=markupNode.GetNumberOfControlPoints()):
+            traj = _tf_collect_trajectories_from_markup(markupNode)
+        keys = [k for k, pts in traj.items() if "entry" in pts and "target" in pts]
+        if not keys:
+            return []
+
+        # Snapshot of the T1: the UI keeps processing events while the workers read it
+        grid = _tf_volume_grid(refVolume)
+        refArray = slicer.util.arrayFromVolume(refVolume).copy()
+        tasks = [(key, _tf_export_trajectory_nifti,
+                  (refArray, grid, key, traj[key], labelMode, intensityValue,
+                   os.path.join(outputDirectory, f"r-{key}-labels.nii.gz"), 2.0, exportNrrd))
+                 for key in keys]
+        nWorkers = _tf_export_worker_count(len(tasks), refArray.nbytes, workers)
+        print(f"[TrajectoryFusion] Per-trajectory export: {len(tasks)} volumes on {nWorkers} thread(s)")
+
+        outputs = []
+        for key, written, error in _tf_run_parallel(tasks, nWorkers, progressCallback):
+            print(f"[Save per-trajectory +Labels] {'✓' if error is None else '✗'} {', '.join(written or [key])}")
+            if error is None:
+                outputs += written
+            else:
+                self.errors.append(f"Export failed for {key}: {error}")
+        return outputs
+
+    @Tracing.traced("fusion: combined", "run")
+    def fuseCombined(self, markupNode, refVolume, outputDirectory, intensityValue=500,
+                     labelMode="Entry + Target", scope=None, exportNrrd=False):
+        """A single r-ALL-labels.nii.gz with every trajectory and its labels.
+
+        The FusedLabel_ALL node stays in the scene unless `scope` is given.
+        """
+        self.errors = []
+        self._checkInputs(markupNode, refVolume, outputDirectory)
+
+        with Tracing.stage("point lookup", points=markupNode.GetNumberOfControlPoints()):
+            traj = _tf_collect_trajectories_from_markup(markupNode)
+        layers = _tf_build_trajectory_layers(refVolume, traj, labelMode)
+
+        with Tracing.stage("fusion") as traced:
+            fusedNode, fused = _tf_new_fused_node(refVolume, "FusedLabel_ALL")
+            if scope is not None:
+                scope.add(fusedNode)
+            for layer in layers:
+                _tf_apply_layer(fused, layer, intensityValue)
+            slicer.util.arrayFromVolumeModified(fusedNode)
+            traced["voxels"] = fused.size
+
+        outPath = os.path.join(outputDirectory, "r-ALL-labels.nii.gz")
+        try:
+            outputs = _tf_write_volume_files(outPath, fused, _tf_ijk_to_ras_array(fusedNode), exportNrrd=exportNrrd)
+        except Exception as e:
+            outputs = []
+            self.errors.append(f"Save failed for ALL: {e}")
+        print(f"[Save ALL +Labels] {'✓' if outputs else '✗'} {outPath}")
+        return outputs
+
+    # ---------- Batch (no widget, no scene leftovers) ----------
+    def runCase(self, markupsPath, volumePath, outputDirectory, modes=("per-trajectory",), **options):
+        """Load one case from disk, run the requested modes and unload everything.
+
+        options are forwarded to run() (intensityValue, labelMode, keepIntermediate,
+        dicomExport, workers, exportNrrd). Returns the list of files written.
+        """
+        outputs = []
+        errors = []
+        with _TFSceneScope() as scope:
+            markupNode = scope.add(slicer.util.loadMarkups(markupsPath))
+            refVolume = scope.add(slicer.util.loadVolume(volumePath))
+            if not markupNode:
+                raise ValueError(f"Cannot load markups: {markupsPath}")
+            if not refVolume:
+                raise ValueError(f"Cannot load reference volume: {volumePath}")
+            for mode in modes:
+                outputs += self.run(markupNode, refVolume, outputDirectory, mode=mode, scope=scope, **options)
+                errors += self.errors
+        self.errors = errors
+        return outputs
+
+    def runBatch(self, cases, **defaults):
+        """Process many cases in one Slicer session.
+
+        cases: iterable of dicts with "markups", "volume", "output" and optionally
+        "modes" plus any run() option overriding `defaults`. A failing case is
+        reported and skipped. Returns a list of {"case", "outputs", "errors"}.
+        """
+        results = []
+        for case in cases:
+            options = dict(defaults)
+            options.update({k: v for k, v in case.items() if k not in ("markups", "volume", "output", "modes")})
+            modes = case.get("modes", defaults.get("modes", ("per-trajectory",)))
+            options.pop("modes", None)
+            try:
+                outputs = self.runCase(case["markups"], case["volume"], case["output"], modes=modes, **options)
+                results.append({"case": case, "outputs": outputs, "errors": list(self.errors)})
+            except Exception as e:
+                print(f"[TrajectoryFusion] Case failed ({case.get('markups')}): {e}")
+                results.append({"case": case, "outputs": [], "errors": [str(e)]})
+        return results
+
+
+def _tf_remove_node(node):
+    """Remove a node from the scene together with its display and storage nodes."""
+    scene = node.GetScene() if node is not None else None
+    if scene is None:
+        return
+    dependents = []
+    for getCount, getNth in (("GetNumberOfDisplayNodes", "GetNthDisplayNode"),
+                             ("GetNumberOfStorageNodes", "GetNthStorageNode")):
+        if hasattr(node, getCount):
+            for i in range(getattr(node, getCount)()):
+                dn = getattr(node, getNth)(i)
+                if dn is not None:
+                    dependents.append(dn)
+    scene.RemoveNode(node)
+    for dn in dependents:
+        if dn.GetScene() is not None:
+            scene.RemoveNode(dn)
+
+
+class _TFSceneScope:
+    """Collect MRML nodes created during a fusion step and remove them on exit.
+
+    Usage:
+        with _TFSceneScope() as scope:
+            seg = scope.addNewNode("vtkMRMLSegmentationNode", "Seg_A")
+            ...
+    Nodes are removed even if the block raises. With keepNodes=True the scope
+    does nothing, which keeps the intermediate nodes for inspection.
+    """
+
+    def __init__(self, keepNodes=False):
+        self.keepNodes = bool(keepNodes)
+        self._nodes = []
+
+    def add(self, node):
+        if node is not None:
+            self._nodes.append(node)
+        return node
+
+    def addNewNode(self, className, name):
+        return self.add(slicer.mrmlScene.AddNewNodeByClass(className, name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        nodes, self._nodes = self._nodes, []
+        if not self.keepNodes:
+            for node in reversed(nodes):
+                try:
+                    _tf_remove_node(node)
+                except Exception:
+                    pass
+        return False
 
 
 def createTubeBetweenPoints(p1, p2, radius=2.0, resolution=20):
@@ -386,72 +755,51 @@ def createTubeBetweenPoints(p1, p2, radius=2.0, resolution=20):
     return tube.GetOutput()
 
 
-# === Auto NRRD export add-on (non-invasive) ===
-# This block does NOT modify any existing functions. It simply watches for newly saved
-# fused volumes ("Fused_*") and automatically saves an additional .nrrd copy next to
-# the .nii/.nii.gz file exported by the original script.
-try:
-    _tf_export_timer  # avoid creating multiple timers on reload
-except NameError:
-    import os
-    _tf_export_timer = qt.QTimer()
-    _tf_export_timer.setInterval(1000)  # check once per second
-
-    def _tf_on_timeout():
-        # Look for Fused_* scalar volumes that have been saved as NIfTI
-        nodes = slicer.util.getNodesByClass("vtkMRMLScalarVolumeNode")
-        for node in nodes:
-            name = node.GetName() or ""
-            if not name.startswith("Fused_"):
-                continue
+# ============================================================
+# ADD-ON (ROBUST): Burn trajectories + TEXT labels into T1
+# - No changes to existing functions
+# - Trajectories are rasterized analytically on the voxel grid (no Segmentation,
+#   no PolyData); the VTK PolyData -> ImageStencil path is kept for reference
+# ============================================================
 
-            # Skip if we've already exported NRRD for this node
-            if node.GetAttribute("AutoNRRDExportDone") == "1":
-                continue
 
-            storage = node.GetStorageNode()
-            if not storage:
-                continue
+# ---------- Core: sparse mask = bounding box offset + small bool array ----------
+class _TFCroppedMask:
+    """Binary mask restricted to its bounding box on a reference (k,j,i) grid.
 
-            fname = storage.GetFileName()
-            if not fname:
-                continue
+    `offset` is the (k, j, i) index of the first voxel of the box and `mask` a bool
+    array with the box shape. A 2 mm tube costs a few KB instead of a full volume.
+    """
+    __slots__ = ("offset", "mask")
 
-            low = fname.lower()
-            # Only proceed after the original script has saved NIfTI
-            if low.endswith(".nii.gz"):
-                outpath = fname[:-7] + ".nrrd"
-            elif low.endswith(".nii"):
-                outpath = fname[:-4] + ".nrrd"
-            else:
-                # Not yet saved as NIfTI by the original script
-                continue
+    def __init__(self, offset, mask):
+        self.offset = tuple(int(x) for x in offset)
+        self.mask = np.asarray(mask, dtype=bool)
 
-            ok = slicer.util.saveNode(node, outpath)
-            print(f"[Auto-NRRD] {'✓' if ok else '✗'} Saved: {outpath}")
-            if ok:
-                node.SetAttribute("AutoNRRDExportDone", "1")
+    @property
+    def slices(self):
+        return tuple(slice(o, o + n) for o, n in zip(self.offset, self.mask.shape))
 
-    _tf_export_timer.timeout.connect(_tf_on_timeout)
-    _tf_export_timer.start()
-    
-# ============================================================
-# ADD-ON (ROBUST): Burn trajectories + TEXT labels into T1
-# - No changes to existing functions
-# - Uses VTK PolyData -> ImageStencil -> Labelmap (no Segmentation)
-# ============================================================
+    @property
+    def voxelCount(self):
+        return int(np.count_nonzero(self.mask))
 
-import os
-import vtk
-import slicer
-import qt
-from vtk.util.numpy_support import vtk_to_numpy
+    @property
+    def nbytes(self):
+        return int(self.mask.nbytes)
 
+    def toDense(self, shapeKJI, labelValue=1, dtype=np.uint8):
+        out = np.zeros(shapeKJI, dtype=dtype)
+        out[self.slices][self.mask] = labelValue
+        return out
 
-# ---------- Core: PolyData (in RAS) -> Labelmap aligned to reference volume ----------
-def _tf_polydata_ras_to_labelmap(refVolumeNode, polydataRAS, labelValue=1, nodeName="LabelTmp"):
-    import vtk
-    import slicer
+
+def _tf_polydata_ras_to_cropped_mask(refVolumeNode, polydataRAS):
+    """Stencil a closed RAS PolyData on the reference grid, within its bounding box only.
+
+    Returns a _TFCroppedMask (or None if the PolyData misses the grid). No MRML node
+    and no full-size image are allocated.
+    """
     from vtk.util.numpy_support import vtk_to_numpy
 
     if refVolumeNode is None or refVolumeNode.GetImageData() is None:
@@ -472,19 +820,31 @@ def _tf_polydata_ras_to_labelmap(refVolumeNode, polydataRAS, labelValue=1, nodeN
     tf.Update()
 
     polyIJK = tf.GetOutput()
+    if polyIJK.GetNumberOfPoints() == 0:
+        return None
+
+    # Extent of the PolyData bounds, clipped to the reference grid
+    b = polyIJK.GetBounds()
+    extent = []
+    for axis in range(3):
+        lo = max(0, int(np.floor(b[2 * axis])))
+        hi = min(dims[axis] - 1, int(np.ceil(b[2 * axis + 1])))
+        if hi < lo:
+            return None
+        extent += [lo, hi]
 
     img = vtk.vtkImageData()
-    img.SetDimensions(dims[0], dims[1], dims[2])
+    img.SetExtent(extent)
     img.SetSpacing(1.0, 1.0, 1.0)
     img.SetOrigin(0.0, 0.0, 0.0)
     img.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
-    img.GetPointData().GetScalars().Fill(int(labelValue))
+    img.GetPointData().GetScalars().Fill(1)
 
     p2s = vtk.vtkPolyDataToImageStencil()
     p2s.SetInputData(polyIJK)
     p2s.SetOutputSpacing(1.0, 1.0, 1.0)
     p2s.SetOutputOrigin(0.0, 0.0, 0.0)
-    p2s.SetOutputWholeExtent(img.GetExtent())
+    p2s.SetOutputWholeExtent(extent)
     p2s.Update()
 
     st = vtk.vtkImageStencil()
@@ -494,9 +854,25 @@ def _tf_polydata_ras_to_labelmap(refVolumeNode, polydataRAS, labelValue=1, nodeN
     st.SetBackgroundValue(0)
     st.Update()
 
-    outImg = st.GetOutput()
-    scalars = outImg.GetPointData().GetScalars()
-    arr = vtk_to_numpy(scalars).reshape(dims[2], dims[1], dims[0])  # (k,j,i)
+    boxDims = [extent[1] - extent[0] + 1, extent[3] - extent[2] + 1, extent[5] - extent[4] + 1]
+    arr = vtk_to_numpy(st.GetOutput().GetPointData().GetScalars()).reshape(boxDims[2], boxDims[1], boxDims[0])
+    return _TFCroppedMask((extent[4], extent[2], extent[0]), arr > 0)
+
+
+# ---------- Core: PolyData (in RAS) -> Labelmap aligned to reference volume ----------
+def _tf_polydata_ras_to_labelmap(refVolumeNode, polydataRAS, labelValue=1, nodeName="LabelTmp"):
+
+    if refVolumeNode is None or refVolumeNode.GetImageData() is None:
+        raise ValueError("Reference volume is invalid")
+
+    dims = refVolumeNode.GetImageData().GetDimensions()  # (x,y,z)
+    shapeKJI = (dims[2], dims[1], dims[0])
+
+    cropped = _tf_polydata_ras_to_cropped_mask(refVolumeNode, polydataRAS)
+    if cropped is None:
+        arr = np.zeros(shapeKJI, dtype=np.uint8)
+    else:
+        arr = cropped.toDense(shapeKJI, labelValue=int(labelValue))
 
     labelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode", nodeName)
     slicer.util.updateVolumeFromArray(labelNode, arr)
@@ -512,6 +888,137 @@ def _tf_polydata_ras_to_labelmap(refVolumeNode, polydataRAS, labelValue=1, nodeN
 
 
 
+# ---------- Core (no VTK): analytic capped cylinder -> mask on the reference grid ----------
+def _tf_ijk_to_ras_array(volumeNode):
+    """Return the IJK->RAS matrix of a volume node as a 4x4 NumPy array."""
+    m = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(m)
+    return np.array([[m.GetElement(r, c) for c in range(4)] for r in range(4)], dtype=float)
+
+
+# The rasterized tube only has to be right to a fraction of a voxel: chord error
+# (polygon vs circle) allowed per mm of the finest voxel spacing of the reference.
+# Exported volumes never go below the historical 20 sides (same voxels as before).
+_TF_TUBE_CHORD_ERROR_VOXELS = 0.1
+_TF_TUBE_MIN_SIDES = 20
+
+
+def _tf_tube_sides(ijkToRas, radius=2.0):
+    """Number of tube sides for `radius` on the grid of ijkToRas (MeshTemplates LOD policy).
+
+    The chord error tolerance is _TF_TUBE_CHORD_ERROR_VOXELS times the finest voxel
+    spacing; the result is never below the historical 20 sides, so only very fine
+    grids get a rounder tube.
+    """
+    spacing = np.linalg.norm(np.asarray(ijkToRas, dtype=float)[:3, :3], axis=0)
+    return MeshTemplates.sides_for_radius(radius, _TF_TUBE_CHORD_ERROR_VOXELS * float(spacing.min()),
+                                          minSides=_TF_TUBE_MIN_SIDES)
+
+
+def _tf_tube_effective_radius(radius, sides=None):
+    """Radius of the circle with the same area as a `sides`-gon tube of given radius.
+
+    vtkTubeFilter places its vertices on the circle, so the stencil of its output
+    is the inscribed polygon. Using the area-equivalent radius makes the analytic
+    mask match the stencil voxel count; `sides=None` keeps the exact circle.
+    """
+    if not sides or sides < 3:
+        return float(radius)
+    n = float(sides)
+    return float(radius) * np.sqrt(n * np.sin(2.0 * np.pi / n) / (2.0 * np.pi))
+
+
+def _tf_rasterize_tube_ijk(shapeKJI, ijkToRas, p1, p2, radius, maxChunkVoxels=2000000):
+    """Rasterize the capped cylinder p1->p2 (RAS, mm) on a voxel grid.
+
+    A voxel is inside when its centre projects onto the segment (flat caps, like
+    vtkTubeFilter.CappingOn) and lies within `radius` mm of the axis. This is the
+    point-inside test vtkPolyDataToImageStencil applies to voxel centres, but only
+    the voxels in the cylinder's bounding box are evaluated (in k-slabs of at most
+    `maxChunkVoxels` voxels, to bound temporary memory for oblique trajectories).
+
+    Returns (offsetKJI, mask): `mask` is a bool array covering the bounding box and
+    `offsetKJI` its first (k, j, i) index, or None if the tube misses the grid.
+    """
+    K, J, I = (int(x) for x in shapeKJI)
+    M = np.asarray(ijkToRas, dtype=float)
+    p1 = np.asarray(p1, dtype=float)
+    p2 = np.asarray(p2, dtype=float)
+    radius = float(radius)
+
+    axis = p2 - p1
+    length = float(np.linalg.norm(axis))
+    if length < 1e-9 or radius <= 0.0:
+        return None
+    u = axis / length
+
+    # RAS bounding box of the cylinder: a disk of radius r perpendicular to u
+    # extends r*sqrt(1-u_c^2) along each coordinate axis c.
+    ext = radius * np.sqrt(np.clip(1.0 - u * u, 0.0, 1.0))
+    lo = np.minimum(p1, p2) - ext
+    hi = np.maximum(p1, p2) + ext
+
+    # Bounding box corners -> IJK, then integer voxel-centre range (clipped to grid)
+    corners = np.array([[x, y, z, 1.0] for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])])
+    ijk = corners @ np.linalg.inv(M).T
+    ijkLo = np.maximum(np.floor(ijk[:, :3].min(axis=0)).astype(int) - 1, 0)
+    ijkHi = np.minimum(np.ceil(ijk[:, :3].max(axis=0)).astype(int) + 1, [I - 1, J - 1, K - 1])
+    if np.any(ijkHi < ijkLo):
+        return None
+
+    i0, j0, k0 = (int(x) for x in ijkLo)
+    i1, j1, k1 = (int(x) + 1 for x in ijkHi)
+    ii = np.arange(i0, i1, dtype=float)[None, None, :]
+    jj = np.arange(j0, j1, dtype=float)[None, :, None]
+
+    A = M[:3, :3]
+    t0 = M[:3, 3] - p1
+    r2max = radius * radius
+    mask = np.zeros((k1 - k0, j1 - j0, i1 - i0), dtype=bool)
+
+    chunk = max(1, int(maxChunkVoxels) // max(1, (j1 - j0) * (i1 - i0)))
+    for ks in range(k0, k1, chunk):
+        ke = min(k1, ks + chunk)
+        kk = np.arange(ks, ke, dtype=float)[:, None, None]
+        # voxel centre relative to p1, in RAS (mm)
+        x = A[0, 0] * ii + A[0, 1] * jj + A[0, 2] * kk + t0[0]
+        y = A[1, 0] * ii + A[1, 1] * jj + A[1, 2] * kk + t0[1]
+        z = A[2, 0] * ii + A[2, 1] * jj + A[2, 2] * kk + t0[2]
+        t = x * u[0] + y * u[1] + z * u[2]
+        r2 = x * x + y * y + z * z - t * t
+        mask[ks - k0:ke - k0] = (t >= 0.0) & (t <= length) & (r2 <= r2max)
+
+    return (k0, j0, i0), mask
+
+
+def _tf_tube_to_cropped_mask(refVolumeNode, p1, p2, radius=2.0, sides=20):
+    """Analytic replacement for createTubeBetweenPoints + _tf_polydata_ras_to_labelmap.
+
+    Returns a _TFCroppedMask on the reference grid (None if the tube misses it); no
+    PolyData and no MRML nodes are created. `sides` is the tube resolution whose
+    stencil is matched (see _tf_tube_effective_radius).
+    """
+    if refVolumeNode is None or refVolumeNode.GetImageData() is None:
+        raise ValueError("Reference volume is invalid")
+
+    dims = refVolumeNode.GetImageData().GetDimensions()  # (x,y,z)
+    res = _tf_rasterize_tube_ijk((dims[2], dims[1], dims[0]), _tf_ijk_to_ras_array(refVolumeNode), p1, p2,
+                                 _tf_tube_effective_radius(radius, sides))
+    if res is None:
+        return None
+    return _TFCroppedMask(*res)
+
+
+def _tf_tube_to_mask(refVolumeNode, p1, p2, radius=2.0, sides=20):
+    """Dense uint8 (k,j,i) variant of _tf_tube_to_cropped_mask."""
+    dims = refVolumeNode.GetImageData().GetDimensions()
+    shapeKJI = (dims[2], dims[1], dims[0])
+    cropped = _tf_tube_to_cropped_mask(refVolumeNode, p1, p2, radius=radius, sides=sides)
+    if cropped is None:
+        return np.zeros(shapeKJI, dtype=np.uint8)
+    return cropped.toDense(shapeKJI)
+
+
 # ---------- Text: label -> PolyData in RAS ----------
 def _tf_text_to_polydata_ras(text, rasXYZ, scaleMm=8.0, thicknessMm=2.0, offsetRAS=(1.0, 1.0, 1.0)):
     # 1) testo vettoriale
@@ -573,30 +1080,28 @@ def _tf_text_to_polydata_ras(text, rasXYZ, scaleMm=8.0, thicknessMm=2.0, offsetR
 
 # ---------- Markups parsing (same rule you already use) ----------
 def _tf_collect_trajectories_from_markup(markupNode):
-    traj = {}
-    for i in range(markupNode.GetNumberOfControlPoints()):
-        label = markupNode.GetNthControlPointLabel(i)
-        pos = [0.0, 0.0, 0.0]
-        markupNode.GetNthControlPointPositionWorld(i, pos)
-
-        if "_" in label:
-            base = label.split("_")[0]
-            traj.setdefault(base, {})["target"] = list(pos)
-            traj.setdefault(base, {})["targetLabel"] = label
-        else:
-            traj.setdefault(label, {})["entry"] = list(pos)
-            traj.setdefault(label, {})["entryLabel"] = label
-    return traj
+    # Righe A / A_<n> del registro (array tenuti aggiornati dagli observer dei Markups);
+    # un nodo non indicizzato (fuori da slicer.mrmlScene) viene letto direttamente
+    traj = TrajectoryRegistry.shared_registry().trajectories(markupNode)
+    return traj if traj is not None else Trajectories.collect_trajectories(markupNode)
 
 
 # ---------- Fuse masks into scalar array ----------
-import numpy as np
+def _tf_add_mask(refArray, maskArray, intensityValue, inPlace=False):
+    """Force at least intensityValue where the mask is on.
 
-def _tf_add_mask(refArray, maskArray, intensityValue):
-    out = refArray.copy()
-    on = (maskArray > 0)
+    maskArray is either a dense (k,j,i) array or a _TFCroppedMask; a cropped mask only
+    touches its bounding box. With inPlace=True refArray is modified and returned.
+    """
+    out = refArray if inPlace else refArray.copy()
+    if isinstance(maskArray, _TFCroppedMask):
+        region = out[maskArray.slices]
+        on = maskArray.mask
+    else:
+        region = out
+        on = (maskArray > 0)
     # forza almeno intensityValue dove c’è la maschera (non dipende dal contrasto della T1)
-    out[on] = np.maximum(out[on], intensityValue)
+    region[on] = np.maximum(region[on], intensityValue)
     return out
 
 def _tf_copy_geometry_from_ref(outVolumeNode, refVolumeNode):
@@ -607,6 +1112,374 @@ def _tf_copy_geometry_from_ref(outVolumeNode, refVolumeNode):
     outVolumeNode.SetIJKToRASMatrix(m)
 
 
+# ---------- Fusion engine: all masks computed once, outputs patched in place ----------
+# Label stamp geometry shared by every fusion mode
+_TF_LABEL_STAMP = {"pixelSize": 2, "thickness": 2, "spacing": 1, "offsetIJK": (2, 2, 0), "plane": "IJ"}
+
+
+def _tf_volume_grid(refVolumeNode):
+    """(shapeKJI, ijkToRas) of a volume: all the layer builders need from MRML."""
+    if refVolumeNode is None or refVolumeNode.GetImageData() is None:
+        raise ValueError("Reference volume is invalid")
+    dims = refVolumeNode.GetImageData().GetDimensions()
+    return (dims[2], dims[1], dims[0]), _tf_ijk_to_ras_array(refVolumeNode)
+
+
+def _tf_build_layer(grid, key, pts, labelMode, radius=2.0, sides=None):
+    """Masks of one trajectory on `grid` (see _tf_volume_grid), or None if incomplete.
+
+    Pure NumPy (no MRML access), so it can run on a worker thread. sides=None matches
+    the tube the segmentation mode builds on this grid (_tf_tube_sides).
+    """
+    if "entry" not in pts or "target" not in pts:
+        return None
+    shapeKJI, ijkToRas = grid
+    rasToIjk = np.linalg.inv(ijkToRas)
+    off = _TF_LABEL_STAMP["offsetIJK"]
+
+    def labelMask(text, ras):
+        ijk = rasToIjk @ np.array([ras[0], ras[1], ras[2], 1.0])
+        i0, j0, k0 = (int(round(float(x))) for x in ijk[:3])
+        return _tf_text_to_cropped_mask(
+            shapeKJI, (i0 + off[0], j0 + off[1], k0 + off[2]), text,
+            pixelSize=_TF_LABEL_STAMP["pixelSize"], thickness=_TF_LABEL_STAMP["thickness"],
+            spacing=_TF_LABEL_STAMP["spacing"], plane=_TF_LABEL_STAMP["plane"],
+        )
+
+    p1 = pts["entry"]
+    p2 = pts["target"]
+    entryLabel = pts.get("entryLabel", key)
+    targetLabel = pts.get("targetLabel", f"{key}_1")
+
+    labels = []
+    with Tracing.stage("label stamping") as traced:
+        if labelMode in ("Entry only", "Entry + Target"):
+            labels.append(labelMask(entryLabel, p1))
+        if labelMode in ("Target only", "Entry + Target"):
+            labels.append(labelMask(targetLabel, p2))
+        if Tracing.enabled():
+            traced["voxels"] = sum(m.voxelCount for m in labels if m is not None)
+
+    if sides is None:
+        sides = _tf_tube_sides(ijkToRas, radius)
+    with Tracing.stage("rasterization") as traced:
+        tube = _tf_rasterize_tube_ijk(shapeKJI, ijkToRas, p1, p2, _tf_tube_effective_radius(radius, sides))
+        if Tracing.enabled():
+            traced["voxels"] = int(np.count_nonzero(tube[1])) if tube is not None else 0
+    return {
+        "key": key,
+        "entry": p1,
+        "target": p2,
+        "tube": _TFCroppedMask(*tube) if tube is not None else None,
+        "labels": [m for m in labels if m is not None],
+    }
+
+
+def _tf_build_trajectory_layers(refVolumeNode, traj, labelMode, radius=2.0):
+    """Compute the masks of every complete trajectory once.
+
+    Returns a list of layers {"key", "entry", "target", "tube", "labels"} where
+    "tube" is a _TFCroppedMask (or None) and "labels" the stamped label masks
+    selected by labelMode ("Entry only" / "Target only" / "Entry + Target").
+    """
+    grid = _tf_volume_grid(refVolumeNode)
+    layers = []
+    for key, pts in traj.items():
+        layer = _tf_build_layer(grid, key, pts, labelMode, radius=radius)
+        if layer is not None:
+            layers.append(layer)
+    return layers
+
+
+def _tf_apply_layer(fusedArray, layer, intensityValue):
+    """Burn one trajectory (tube, then its labels) into fusedArray in place."""
+    if layer["tube"] is not None:
+        _tf_add_mask(fusedArray, layer["tube"], intensityValue, inPlace=True)
+    for m in layer["labels"]:
+        np.copyto(fusedArray[m.slices], intensityValue, where=m.mask, casting="unsafe")
+
+
+def _tf_restore_layer(fusedArray, refArray, layer):
+    """Undo _tf_apply_layer by copying back the reference voxels of its boxes."""
+    masks = ([layer["tube"]] if layer["tube"] is not None else []) + layer["labels"]
+    for m in masks:
+        fusedArray[m.slices] = refArray[m.slices]
+
+
+def _tf_new_fused_node(refVolumeNode, name):
+    """Scalar volume with the reference geometry and a copy of its voxels.
+
+    Returns (node, array) where array is the node's own voxel buffer (k,j,i): this is
+    the only full-volume copy made by the fusion modes.
+    """
+    node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", name)
+    slicer.util.updateVolumeFromArray(node, slicer.util.arrayFromVolume(refVolumeNode))
+    _tf_copy_geometry_from_ref(node, refVolumeNode)
+    return node, slicer.util.arrayFromVolume(node)
+
+
+# ---------- NIfTI writer (no MRML: safe on worker threads) ----------
+_TF_NIFTI_DATATYPES = {
+    "uint8": (2, 8), "int16": (4, 16), "int32": (8, 32), "float32": (16, 32), "float64": (64, 64),
+    "int8": (256, 8), "uint16": (512, 16), "uint32": (768, 32), "int64": (1024, 64), "uint64": (1280, 64),
+}
+
+
+def _tf_nifti_quaternion(direction):
+    """(b, c, d, qfac) of a 3x3 orthonormal direction matrix (nifti1_io convention)."""
+    R = np.array(direction, dtype=float)
+    qfac = 1.0
+    if np.linalg.det(R) < 0:
+        R[:, 2] = -R[:, 2]
+        qfac = -1.0
+    a = R[0, 0] + R[1, 1] + R[2, 2] + 1.0
+    if a > 0.5:
+        a = 0.5 * np.sqrt(a)
+        b = 0.25 * (R[2, 1] - R[1, 2]) / a
+        c = 0.25 * (R[0, 2] - R[2, 0]) / a
+        d = 0.25 * (R[1, 0] - R[0, 1]) / a
+    else:
+        xd = 1.0 + R[0, 0] - (R[1, 1] + R[2, 2])
+        yd = 1.0 + R[1, 1] - (R[0, 0] + R[2, 2])
+        zd = 1.0 + R[2, 2] - (R[0, 0] + R[1, 1])
+        if xd > 1.0:
+            b = 0.5 * np.sqrt(xd)
+            c = 0.25 * (R[0, 1] + R[1, 0]) / b
+            d = 0.25 * (R[0, 2] + R[2, 0]) / b
+            a = 0.25 * (R[2, 1] - R[1, 2]) / b
+        elif yd > 1.0:
+            c = 0.5 * np.sqrt(yd)
+            b = 0.25 * (R[0, 1] + R[1, 0]) / c
+            d = 0.25 * (R[1, 2] + R[2, 1]) / c
+            a = 0.25 * (R[0, 2] - R[2, 0]) / c
+        else:
+            d = 0.5 * np.sqrt(zd)
+            b = 0.25 * (R[0, 2] + R[2, 0]) / d
+            c = 0.25 * (R[1, 2] + R[2, 1]) / d
+            a = 0.25 * (R[1, 0] - R[0, 1]) / d
+        if a < 0.0:
+            b, c, d = -b, -c, -d
+    return float(b), float(c), float(d), qfac
+
+
+def _tf_write_nifti(path, array, ijkToRas, compresslevel=6, slabVoxels=8000000):
+    """Write a (k,j,i) array as NIfTI-1 (.nii or .nii.gz) with the given IJK->RAS matrix.
+
+    Same header content as Slicer's writer (qform + sform, mm units); the voxels are
+    streamed by _tf_stream_voxels.
+    """
+    import struct
+
+    arr = np.asarray(array)
+    if arr.ndim != 3:
+        raise ValueError("NIfTI export expects a 3D (k,j,i) array")
+    dtypeName = arr.dtype.newbyteorder("=").name
+    if dtypeName not in _TF_NIFTI_DATATYPES:
+        raise ValueError(f"Unsupported voxel type for NIfTI export: {arr.dtype}")
+    datatype, bitpix = _TF_NIFTI_DATATYPES[dtypeName]
+
+    M = np.asarray(ijkToRas, dtype=float)
+    spacing = np.linalg.norm(M[:3, :3], axis=0)
+    b, c, d, qfac = _tf_nifti_quaternion(M[:3, :3] / spacing)
+    K, J, I = arr.shape
+
+    header = struct.pack(
+        "<i10s18sihcc8h3f4h8ff2fhcc4f2i80s24s2h6f12f16s4s",
+        348, b"", b"", 0, 0, b"r", b"\0",
+        3, I, J, K, 1, 1, 1, 1,
+        0.0, 0.0, 0.0,
+        0, datatype, bitpix, 0,
+        qfac, spacing[0], spacing[1], spacing[2], 0.0, 0.0, 0.0, 0.0,
+        352.0,
+        1.0, 0.0,
+        0, b"\0", b"\x02",  # xyzt_units: mm
+        0.0, 0.0, 0.0, 0.0,
+        0, 0,
+        b"PLATiN TrajectoryFusion", b"",
+        1, 1,  # qform_code, sform_code: scanner
+        b, c, d, M[0, 3], M[1, 3], M[2, 3],
+        *M[0, :4], *M[1, :4], *M[2, :4],
+        b"", b"n+1\0",
+    )
+
+    return _tf_stream_voxels(path, arr, gzHeader=header + b"\0\0\0\0",
+                             compress=path.lower().endswith(".gz"), compresslevel=compresslevel,
+                             slabVoxels=slabVoxels)
+
+
+# NRRD type names (teem) by NumPy dtype name
+_TF_NRRD_TYPES = {
+    "int8": "signed char", "uint8": "unsigned char", "int16": "short", "uint16": "unsigned short",
+    "int32": "int", "uint32": "unsigned int", "int64": "long long", "uint64": "unsigned long long",
+    "float32": "float", "float64": "double",
+}
+
+
+def _tf_write_nrrd(path, array, ijkToRas, compresslevel=6, slabVoxels=8000000):
+    """Write a (k,j,i) array as a gzip-encoded .nrrd, in LPS space like Slicer's writer."""
+    arr = np.asarray(array)
+    if arr.ndim != 3:
+        raise ValueError("NRRD export expects a 3D (k,j,i) array")
+    dtypeName = arr.dtype.newbyteorder("=").name
+    if dtypeName not in _TF_NRRD_TYPES:
+        raise ValueError(f"Unsupported voxel type for NRRD export: {arr.dtype}")
+
+    ijkToLps = np.diag([-1.0, -1.0, 1.0, 1.0]) @ np.asarray(ijkToRas, dtype=float)
+    fmt = lambda v: "(" + ",".join(repr(float(x) + 0.0) for x in v) + ")"
+    K, J, I = arr.shape
+    header = "\n".join([
+        "NRRD0004",
+        "# Complete NRRD file format specification at:",
+        "# http://teem.sourceforge.net/nrrd/format.html",
+        f"type: {_TF_NRRD_TYPES[dtypeName]}",
+        "dimension: 3",
+        "space: left-posterior-superior",
+        f"sizes: {I} {J} {K}",
+        "space directions: " + " ".join(fmt(ijkToLps[:3, c]) for c in range(3)),
+        "kinds: domain domain domain",
+        "endian: little",
+        "encoding: gzip",
+        "space origin: " + fmt(ijkToLps[:3, 3]),
+        "", "",
+    ]).encode("ascii")
+    return _tf_stream_voxels(path, arr, plainHeader=header, compress=True,
+                             compresslevel=compresslevel, slabVoxels=slabVoxels)
+
+
+def _tf_stream_voxels(path, arr, plainHeader=b"", gzHeader=b"", compress=True, compresslevel=6,
+                      slabVoxels=8000000):
+    """Write plainHeader, then (gzip-compressed if `compress`) gzHeader and the voxels of arr.
+
+    Voxels are written little-endian in k-slabs of at most `slabVoxels`, so no second
+    full-size buffer is made; zlib releases the GIL, which lets several files compress in
+    parallel threads. The file appears under its final name only once it is complete.
+    """
+    import gzip
+
+    K, J, I = arr.shape
+    leDtype = arr.dtype.newbyteorder("<")
+    tmpPath = path + ".part"
+    try:
+        with open(tmpPath, "wb") as raw:
+            raw.write(plainHeader)
+            out = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=compresslevel) if compress else raw
+            out.write(gzHeader)
+            step = max(1, int(slabVoxels) // max(1, J * I))
+            for k0 in range(0, K, step):
+                out.write(np.ascontiguousarray(arr[k0:k0 + step], dtype=leDtype).tobytes())
+            if compress:
+                out.close()
+        os.replace(tmpPath, path)
+    except Exception:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+    return path
+
+
+def _tf_nrrd_path(niftiPath):
+    """r-A.nii.gz -> r-A.nrrd (same naming as the old auto-NRRD add-on)."""
+    low = niftiPath.lower()
+    if low.endswith(".nii.gz"):
+        return niftiPath[:-7] + ".nrrd"
+    if low.endswith(".nii"):
+        return niftiPath[:-4] + ".nrrd"
+    return niftiPath + ".nrrd"
+
+
+def _tf_write_volume(path, array, ijkToRas):
+    """Write array as .nrrd or .nii/.nii.gz depending on the extension of path."""
+    if path.lower().endswith(".nrrd"):
+        return _tf_write_nrrd(path, array, ijkToRas)
+    return _tf_write_nifti(path, array, ijkToRas)
+
+
+def _tf_write_volume_files(niftiPath, array, ijkToRas, exportNrrd=False, parallel=True):
+    """Write the NIfTI output and, if exportNrrd, its NRRD copy from the same array.
+
+    With parallel=True the two files are compressed on two threads. Returns the paths
+    written; raises the first error after both writes have finished.
+    """
+    paths = [niftiPath] + ([_tf_nrrd_path(niftiPath)] if exportNrrd else [])
+    with Tracing.stage("save", files=len(paths), voxels=array.size):
+        if len(paths) == 1 or not parallel:
+            return [_tf_write_volume(p, array, ijkToRas) for p in paths]
+
+        import concurrent.futures as cf
+        with cf.ThreadPoolExecutor(max_workers=len(paths), thread_name_prefix="tf-write") as pool:
+            futures = [pool.submit(_tf_write_volume, p, array, ijkToRas) for p in paths]
+            cf.wait(futures)
+    for f in futures:
+        if f.exception() is not None:
+            raise f.exception()
+    return [f.result() for f in futures]
+
+
+# ---------- Parallel export: NumPy/zlib work on threads, MRML/UI on the main thread ----------
+# Each in-flight trajectory holds one copy of the reference volume
+_TF_EXPORT_MEMORY_BUDGET = 4 * 1024 ** 3
+
+
+def _tf_export_worker_count(nTasks, bytesPerTask, requested=None):
+    """Number of export threads: `requested` if > 0, else CPUs bounded by the memory budget."""
+    if requested and int(requested) > 0:
+        return max(1, min(int(requested), nTasks))
+    byMemory = max(1, _TF_EXPORT_MEMORY_BUDGET // max(1, int(bytesPerTask)))
+    return max(1, min(nTasks, os.cpu_count() or 1, byMemory))
+
+
+def _tf_run_parallel(tasks, workers, progressCallback=None, pollSeconds=0.1):
+    """Run (label, fn, args) tasks on a thread pool; returns [(label, result, error)] in task order.
+
+    progressCallback(done, total, label) is called on the calling (main) thread between
+    polls, so it may update Qt widgets; returning False cancels the tasks not started yet.
+    """
+    import concurrent.futures as cf
+
+    results = [None] * len(tasks)
+    with cf.ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="tf-export") as pool:
+        pending = {pool.submit(fn, *args): n for n, (label, fn, args) in enumerate(tasks)}
+        done = 0
+        lastLabel = ""
+        cancelled = False
+        if progressCallback is not None and progressCallback(0, len(tasks), "") is False:
+            cancelled = True
+        while pending:
+            if cancelled:
+                for f in list(pending):
+                    if f.cancel():
+                        n = pending.pop(f)
+                        results[n] = (tasks[n][0], None, RuntimeError("Cancelled"))
+                        done += 1
+            finished, _ = cf.wait(list(pending), timeout=pollSeconds, return_when=cf.FIRST_COMPLETED)
+            for f in finished:
+                n = pending.pop(f)
+                error = f.exception()
+                results[n] = (tasks[n][0], None if error else f.result(), error)
+                done += 1
+                lastLabel = tasks[n][0]
+                print(f"[TrajectoryFusion] {'✓' if error is None else '✗'} {tasks[n][0]}"
+                      + (f": {error}" if error else ""))
+            if progressCallback is not None:
+                if progressCallback(done, len(tasks), lastLabel) is False:
+                    cancelled = True
+    return results
+
+
+def _tf_export_trajectory_nifti(refArray, grid, key, pts, labelMode, intensityValue, outPath, radius=2.0,
+                                exportNrrd=False):
+    """Worker task: masks of one trajectory burned into a copy of refArray, written to outPath.
+
+    Returns the list of files written (outPath, plus its .nrrd copy if exportNrrd).
+    Trajectories already run in parallel, so the two files are written one after the other.
+    """
+    layer = _tf_build_layer(grid, key, pts, labelMode, radius=radius)
+    with Tracing.stage("fusion", voxels=refArray.size):
+        fused = refArray.copy()
+        _tf_apply_layer(fused, layer, intensityValue)
+    return _tf_write_volume_files(outPath, fused, grid[1], exportNrrd=exportNrrd, parallel=False)
+
+
 # ---------- NEW MODE 1: per-trajectory (one file each) ----------
 def _tf_run_per_trajectory_with_labels(widgetSelf):
     markupNode = widgetSelf.markupSelector.currentNode()
@@ -618,50 +1491,31 @@ def _tf_run_per_trajectory_with_labels(widgetSelf):
         slicer.util.errorDisplay("Please select both a markup and a reference volume.")
         return
 
-    traj = _tf_collect_trajectories_from_markup(markupNode)
-
     # 👇 legge la modalità selezionata in UI
     mode = _tf_get_label_mode(widgetSelf)  # "Entry only" / "Target only" / "Entry + Target"
+    workersSpin = getattr(widgetSelf, "exportWorkersSpin", None)
+    workers = workersSpin.value if workersSpin is not None else None
 
-    for key, pts in traj.items():
-        if "entry" not in pts or "target" not in pts:
-            continue
-
-        p1 = pts["entry"]
-        p2 = pts["target"]
-        entryLabel = pts.get("entryLabel", key)
-        targetLabel = pts.get("targetLabel", f"{key}_1")
-
-        # Parto dalla T1
-        fused = slicer.util.arrayFromVolume(refVolume).copy()
-
-        # Traiettoria
-        tubePoly = createTubeBetweenPoints(p1, p2, radius=2.0)
-        tubeLabel = _tf_polydata_ras_to_labelmap(refVolume, tubePoly, labelValue=1, nodeName=f"Label_Tube_{key}")
-        tubeMask = slicer.util.arrayFromVolume(tubeLabel)
-        fused = _tf_add_mask(fused, tubeMask, intensityValue)
-
-        # Label (stampate) in base alla modalità
-        if mode in ("Entry only", "Entry + Target"):
-            _tf_stamp_text(
-                fused, refVolume, entryLabel, p1, value=intensityValue,
-                pixelSize=2, thickness=2, spacing=1, offsetIJK=(2, 2, 0)
-            )
-
-        if mode in ("Target only", "Entry + Target"):
-            _tf_stamp_text(
-                fused, refVolume, targetLabel, p2, value=intensityValue,
-                pixelSize=2, thickness=2, spacing=1, offsetIJK=(2, 2, 0)
-            )
+    progress = slicer.util.createProgressDialog(labelText="Exporting trajectories...", maximum=0)
 
-        # Salva volume per traiettoria
-        fusedNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", f"FusedLabel_{key}")
-        slicer.util.updateVolumeFromArray(fusedNode, fused)
-        _tf_copy_geometry_from_ref(fusedNode, refVolume)
+    def _onProgress(done, total, key):
+        progress.maximum = total
+        progress.value = done
+        if key:
+            progress.labelText = f"Exported {key} ({done}/{total})"
+        slicer.app.processEvents()
+        return not progress.wasCanceled
 
-        outPath = os.path.join(outDir, f"r-{key}-labels.nii.gz")
-        ok = slicer.util.saveNode(fusedNode, outPath)
-        print(f"[Save per-trajectory +Labels] {'✓' if ok else '✗'} {outPath}")
+    logic = TrajectoryFusionLogic()
+    try:
+        logic.fusePerTrajectory(markupNode, refVolume, outDir, intensityValue, mode,
+                                workers=workers, progressCallback=_onProgress,
+                                exportNrrd=_tf_get_export_nrrd(widgetSelf))
+    finally:
+        progress.close()
+    widgetSelf.tracePanel.refresh()
+    if logic.errors:
+        slicer.util.errorDisplay("\n".join(logic.errors))
 
 # ---------- NEW MODE 2: combined (single file with all trajectories + labels) ----------
 def _tf_run_combined_with_labels(widgetSelf):
@@ -674,170 +1528,31 @@ def _tf_run_combined_with_labels(widgetSelf):
         slicer.util.errorDisplay("Please select both a markup and a reference volume.")
         return
 
-    traj = _tf_collect_trajectories_from_markup(markupNode)
-    fused = slicer.util.arrayFromVolume(refVolume).copy()
-
     # 👇 legge la modalità selezionata in UI
     mode = _tf_get_label_mode(widgetSelf)  # "Entry only" / "Target only" / "Entry + Target"
 
-    for key, pts in traj.items():
-        if "entry" not in pts or "target" not in pts:
-            continue
-
-        p1 = pts["entry"]
-        p2 = pts["target"]
-        entryLabel = pts.get("entryLabel", key)
-        targetLabel = pts.get("targetLabel", f"{key}_1")
-
-        # Traiettoria
-        tubePoly = createTubeBetweenPoints(p1, p2, radius=2.0)
-        tubeLabel = _tf_polydata_ras_to_labelmap(refVolume, tubePoly, labelValue=1, nodeName=f"Label_Tube_{key}")
-        tubeMask = slicer.util.arrayFromVolume(tubeLabel)
-        fused = _tf_add_mask(fused, tubeMask, intensityValue)
-
-        # Label (stampate) in base alla modalità
-        if mode in ("Entry only", "Entry + Target"):
-            _tf_stamp_text(
-                fused, refVolume, entryLabel, p1, value=intensityValue,
-                pixelSize=2, thickness=2, spacing=1, offsetIJK=(2, 2, 0)
-            )
-
-        if mode in ("Target only", "Entry + Target"):
-            _tf_stamp_text(
-                fused, refVolume, targetLabel, p2, value=intensityValue,
-                pixelSize=2, thickness=2, spacing=1, offsetIJK=(2, 2, 0)
-            )
-
-    fusedNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", "FusedLabel_ALL")
-    slicer.util.updateVolumeFromArray(fusedNode, fused)
-    _tf_copy_geometry_from_ref(fusedNode, refVolume)
-
-    outPath = os.path.join(outDir, "r-ALL-labels.nii.gz")
-    ok = slicer.util.saveNode(fusedNode, outPath)
-    print(f"[Save ALL +Labels] {'✓' if ok else '✗'} {outPath}")
-
-
-# ---------- UI injection: add 2 buttons without touching your setup() ----------
-try:
-    _tf_ui_injection_timer_robust
-except NameError:
-    _tf_ui_injection_timer_robust = qt.QTimer()
-    _tf_ui_injection_timer_robust.setInterval(400)
+    keepNodes = bool(getattr(widgetSelf, "keepIntermediateCheck", None) and widgetSelf.keepIntermediateCheck.checked)
+    logic = TrajectoryFusionLogic()
+    with _TFSceneScope(keepNodes=keepNodes) as scope:
+        logic.fuseCombined(markupNode, refVolume, outDir, intensityValue, mode, scope=scope,
+                           exportNrrd=_tf_get_export_nrrd(widgetSelf))
+    widgetSelf.tracePanel.refresh()
+    if logic.errors:
+        slicer.util.errorDisplay("\n".join(logic.errors))
 
-    def _tf_try_inject_buttons_robust():
-        try:
-            w = slicer.modules.trajectoryfusion.widgetRepresentation()
-            if not w:
-                return
-            pyw = w.self()
-            if not pyw:
-                return
-
-            if getattr(pyw, "_tfButtonsInjectedRobust", False):
-                _tf_ui_injection_timer_robust.stop()
-                return
-
-            b1 = qt.QPushButton("Generate Trajectories + Labels (per file) [ROBUST]")
-            b1.toolTip = "1 NIfTI/NRRD per traiettoria, con label entry/target bruciate nel volume"
-            b1.connect('clicked()', lambda: _tf_run_per_trajectory_with_labels(pyw))
-
-            b2 = qt.QPushButton("Generate ALL Trajectories + Labels (single file) [ROBUST]")
-            b2.toolTip = "1 NIfTI/NRRD con tutte le traiettorie + label sovraimpresse"
-            b2.connect('clicked()', lambda: _tf_run_combined_with_labels(pyw))
-
-            pyw.layout.addWidget(b1)
-            pyw.layout.addWidget(b2)
-
-            pyw._tfButtonsInjectedRobust = True
-            print("[TrajectoryFusion] ROBUST add-on injected (stencil rasterization).")
-            _tf_ui_injection_timer_robust.stop()
-
-        except Exception:
-            pass
 
-    _tf_ui_injection_timer_robust.timeout.connect(_tf_try_inject_buttons_robust)
-    _tf_ui_injection_timer_robust.start()
-
-# ==========================
-# FORCE UI BUTTON INJECTION
-# ==========================
-import slicer, qt
-
-def _tf_force_add_buttons():
-    try:
-        w = slicer.modules.trajectoryfusion.widgetRepresentation()
-        if not w:
-            print("[TrajectoryFusion] widgetRepresentation() not ready")
-            return False
-
-        pyw = w.self()
-        if not pyw:
-            print("[TrajectoryFusion] widget self() not ready")
-            return False
-
-        if getattr(pyw, "_tfButtonsForced", False):
-            # già aggiunti
-            return True
-
-        # Safety: check that target functions exist
-        if "_tf_run_per_trajectory_with_labels" not in globals() or "_tf_run_combined_with_labels" not in globals():
-            print("[TrajectoryFusion] Missing functions _tf_run_per_trajectory_with_labels / _tf_run_combined_with_labels")
-            return False
-
-        # --- Label mode selector (Entry / Target / Both) ---
-        labelModeBox = qt.QComboBox()
-        labelModeBox.addItems(["Entry only", "Target only", "Entry + Target"])
-        labelModeBox.toolTip = "Scegli quali label stampare nel volume"
-        pyw.layout.addWidget(labelModeBox)
-
-        # store on widget so logic can read it
-        pyw._tfLabelModeBox = labelModeBox
-
-        # --- Buttons ---
-        b1 = qt.QPushButton("Create labels (per trajectory)")
-        b1.toolTip = "Crea un NIfTI/NRRD per traiettoria con traiettoria + lettere bruciate"
-        b1.connect("clicked()", lambda: _tf_run_per_trajectory_with_labels(pyw))
-
-        b2 = qt.QPushButton("Create labels (ALL in one file)")
-        b2.toolTip = "Crea un solo NIfTI/NRRD con tutte le traiettorie + lettere bruciate"
-        b2.connect("clicked()", lambda: _tf_run_combined_with_labels(pyw))
-
-        pyw.layout.addWidget(b1)
-        pyw.layout.addWidget(b2)
-
-        pyw._tfButtonsForced = True
-        print("[TrajectoryFusion] Buttons + label mode added OK")
-        return True
-
-    except Exception as e:
-        print("[TrajectoryFusion] Button injection error:", e)
-        return False
+def _tf_get_export_nrrd(widgetSelf):
+    check = getattr(widgetSelf, "exportNrrdCheck", None)
+    return bool(check is not None and check.checked)
 
 
 def _tf_get_label_mode(widgetSelf):
-    box = getattr(widgetSelf, "_tfLabelModeBox", None)
+    box = getattr(widgetSelf, "labelModeCombo", None)
     if box is None:
         return "Entry + Target"
     return box.currentText
 
 
-# Try a few times (module UI might not be ready immediately)
-def _tf_force_inject_with_retries(maxTries=15, intervalMs=300):
-    tries = {"n": 0}
-    t = qt.QTimer()
-    t.setInterval(intervalMs)
-
-    def _tick():
-        tries["n"] += 1
-        ok = _tf_force_add_buttons()
-        if ok or tries["n"] >= maxTries:
-            t.stop()
-
-    t.timeout.connect(_tick)
-    t.start()
-
-qt.QTimer.singleShot(0, lambda: _tf_force_inject_with_retries())
-
 # ---------- TEXT STAMP (no VTK stencil): draw 5x7 letters directly into volume array ----------
 
 def _tf_ras_to_ijk(refVolumeNode, rasXYZ):
@@ -892,62 +1607,93 @@ _TF_FONT_5x7 = {
 }
 
 
-def _tf_stamp_text(fusedArray, refVolumeNode, text, rasXYZ,
-                   value, pixelSize=2, thickness=2, spacing=1, offsetIJK=(2,2,0)):
-    """
-    Disegna testo 5x7 nel volume (array in KJI).
-    - pixelSize: quanto "grosso" è ogni pixel della font (in voxel)
-    - thickness: spessore in K (numero slice)
-    - spacing: spazio tra caratteri (in pixel font)
-    - offsetIJK: offset (i,j,k) per non sovrapporre al punto
-    """
-    if text is None:
-        return
+def _tf_compile_font(font):
+    """Glyph strings -> read-only bool arrays (7 rows x 5 columns), bottom row first."""
+    atlas = {}
+    for ch, rows in font.items():
+        glyph = np.array([[bit == "1" for bit in row] for row in reversed(rows)], dtype=bool)
+        glyph.setflags(write=False)
+        atlas[ch] = glyph
+    return atlas
 
-    text = str(text).upper()
 
-    i0, j0, k0 = _tf_ras_to_ijk(refVolumeNode, rasXYZ)
-    i0 += int(offsetIJK[0])
-    j0 += int(offsetIJK[1])
-    k0 += int(offsetIJK[2])
+_TF_FONT_ATLAS = _tf_compile_font(_TF_FONT_5x7)
+_TF_BLANK_GLYPH = np.zeros((7, 5), dtype=bool)
 
-    # fusedArray è KJI
-    K, J, I = fusedArray.shape
+# In-plane orientations: IJK axes of (text direction, glyph rows, thickness)
+_TF_TEXT_PLANES = {"IJ": (0, 1, 2), "IK": (0, 2, 1), "JK": (1, 2, 0)}
 
-    cursor_i = i0
 
+@functools.lru_cache(maxsize=256)
+def _tf_text_bitmap(text, pixelSize=2, spacing=1):
+    """2D bool bitmap (rows, columns) of upper-case text, each font pixel pixelSize wide."""
+    cells = []
+    gap = np.zeros((7, spacing), dtype=bool)
     for ch in text:
-        glyph = _TF_FONT_5x7.get(ch)
-        if glyph is None:
-            cursor_i += (5 + spacing) * pixelSize
-            continue
+        cells.append(_TF_FONT_ATLAS.get(ch, _TF_BLANK_GLYPH))
+        cells.append(gap)
+    bitmap = np.hstack(cells) if cells else np.zeros((7, 0), dtype=bool)
+    bitmap = bitmap.repeat(pixelSize, axis=0).repeat(pixelSize, axis=1)
+    bitmap.setflags(write=False)
+    return bitmap
 
-        for row in range(7):
-            bits = glyph[6 - row]
-            for col in range(5):
-                if bits[col] != "1":
-                    continue
 
-                # area in I,J
-                ii_start = cursor_i + col * pixelSize
-                jj_start = j0 + row * pixelSize
-                ii_end = ii_start + pixelSize
-                jj_end = jj_start + pixelSize
+def _tf_text_to_cropped_mask(shapeKJI, anchorIJK, text, pixelSize=2, thickness=2, spacing=1, plane="IJ"):
+    """Rasterize 5x7 text as a _TFCroppedMask on a (k,j,i) grid.
 
-                # clamp
-                if ii_end <= 0 or jj_end <= 0 or ii_start >= I or jj_start >= J:
-                    continue
+    The text starts at voxel anchorIJK (i,j,k). With plane="IJ" it grows along +I
+    (characters) and +J (rows) and is `thickness` slices deep along +K; "IK" and "JK"
+    write it in those planes instead. Returns None if nothing lands in the grid.
+    """
+    if text is None:
+        return None
+
+    bitmap = _tf_text_bitmap(str(text).upper(), int(pixelSize), int(spacing))
+    uAxis, vAxis, wAxis = _TF_TEXT_PLANES[plane]
+    dimsIJK = tuple(int(x) for x in shapeKJI)[::-1]
+    anchor = tuple(int(x) for x in anchorIJK)
+
+    size = [0, 0, 0]
+    size[uAxis], size[vAxis], size[wAxis] = bitmap.shape[1], bitmap.shape[0], int(thickness)
+    lo = [max(0, anchor[a]) for a in range(3)]
+    hi = [min(dimsIJK[a], anchor[a] + size[a]) for a in range(3)]
+    if any(h <= l for l, h in zip(lo, hi)):
+        return None
+
+    # (thickness, rows, columns) -> (k, j, i), cropped to the grid
+    local = (wAxis, vAxis, uAxis)
+    volume = np.broadcast_to(bitmap, (size[wAxis],) + bitmap.shape)
+    volume = volume.transpose([local.index(2 - b) for b in range(3)])
+    crop = volume[tuple(slice(lo[2 - b] - anchor[2 - b], hi[2 - b] - anchor[2 - b]) for b in range(3))]
+    if not crop.any():
+        return None
+    return _TFCroppedMask((lo[2], lo[1], lo[0]), np.ascontiguousarray(crop))
+
+
+@Tracing.traced("label stamping")
+def _tf_stamp_text(fusedArray, refVolumeNode, text, rasXYZ,
+                   value, pixelSize=2, thickness=2, spacing=1, offsetIJK=(2,2,0), plane="IJ"):
+    """
+    Disegna testo 5x7 nel volume (array in KJI).
+    - pixelSize: quanto "grosso" è ogni pixel della font (in voxel)
+    - thickness: spessore in K (numero slice)
+    - spacing: spazio tra caratteri (in pixel font)
+    - offsetIJK: offset (i,j,k) per non sovrapporre al punto
+    - plane: piano del testo ("IJ", "IK" o "JK")
 
-                ii_start = max(0, ii_start); ii_end = min(I, ii_end)
-                jj_start = max(0, jj_start); jj_end = min(J, jj_end)
+    Returns the stamped _TFCroppedMask (None if nothing was drawn).
+    """
+    if text is None:
+        return None
 
-                # thickness in K
-                for dk in range(thickness):
-                    kk = k0 + dk
-                    if 0 <= kk < K:
-                        fusedArray[kk, jj_start:jj_end, ii_start:ii_end] = value
+    i0, j0, k0 = _tf_ras_to_ijk(refVolumeNode, rasXYZ)
+    anchor = (i0 + int(offsetIJK[0]), j0 + int(offsetIJK[1]), k0 + int(offsetIJK[2]))
 
-        cursor_i += (5 + spacing) * pixelSize
+    mask = _tf_text_to_cropped_mask(fusedArray.shape, anchor, text,
+                                    pixelSize=pixelSize, thickness=thickness, spacing=spacing, plane=plane)
+    if mask is not None:
+        np.copyto(fusedArray[mask.slices], value, where=mask.mask, casting="unsafe")
+    return mask
 
 
 # ============================================================
@@ -963,7 +1709,6 @@ def _tf_make_ras_nifti_path(originalNiftiPath: str) -> str:
     - Never overwrites the original.
     - Prevents stacking '-RAS' repeatedly (e.g. '-RAS-RAS-RAS').
     """
-    import os
     import re
 
     p = originalNiftiPath
@@ -996,14 +1741,171 @@ def _tf_make_ras_nifti_path(originalNiftiPath: str) -> str:
 
 
 
+# ---------- In-process reorientation (axis-aligned volumes only) ----------
+# OrientScalarVolume "RAS" follows ITK's legacy naming, where each letter is the side the
+# axis comes *from*: its output i runs R->L, j A->P, k S->I. These are the RAS direction
+# signs of the output axes, so the in-memory path writes the same voxel order as the CLI.
+_TF_ORIENT_RAS_SIGNS = (-1.0, -1.0, -1.0)
+
+
+def _tf_axis_aligned_permutation(ijkToRas, tol=1e-6):
+    """For each IJK axis, (RAS axis, sign) it runs along; None if the volume is oblique."""
+    D = np.asarray(ijkToRas, dtype=float)[:3, :3]
+    D = D / np.linalg.norm(D, axis=0)
+    axes = []
+    for c in range(3):
+        w = int(np.argmax(np.abs(D[:, c])))
+        if abs(abs(D[w, c]) - 1.0) > tol:
+            return None
+        axes.append((w, 1.0 if D[w, c] > 0 else -1.0))
+    if sorted(w for w, _ in axes) != [0, 1, 2]:
+        return None
+    return axes
+
+
+def _tf_reorient_array_to_ras(array, ijkToRas, tol=1e-6):
+    """Reorient a (k,j,i) array like OrientScalarVolume "RAS", by axis transpose + flips only.
+
+    Returns (array, ijkToRas) of the reoriented volume (the array is a NumPy view, no voxel
+    is copied), or None if the volume is oblique and needs resampling (CLI fallback).
+    """
+    M = np.asarray(ijkToRas, dtype=float)
+    axes = _tf_axis_aligned_permutation(M, tol)
+    if axes is None:
+        return None
+    dimsIJK = array.shape[::-1]
+    spacing = np.linalg.norm(M[:3, :3], axis=0)
+
+    source = [None] * 3  # output IJK axis n <- input IJK axis
+    for c, (w, _) in enumerate(axes):
+        source[w] = c
+    out = np.transpose(array, [2 - source[2 - b] for b in range(3)])
+
+    newM = np.eye(4)
+    firstVoxel = np.zeros(3)
+    for n in range(3):
+        c = source[n]
+        flip = axes[c][1] != _TF_ORIENT_RAS_SIGNS[n]
+        if flip:
+            out = np.flip(out, axis=2 - n)
+            firstVoxel[c] = dimsIJK[c] - 1
+        newM[n, n] = _TF_ORIENT_RAS_SIGNS[n] * spacing[c]
+    newM[:3, 3] = M[:3, :3] @ firstVoxel + M[:3, 3]
+    return out, newM
+
+
+_TF_NIFTI_DTYPES_BY_CODE = {code: np.dtype(name) for name, (code, _) in _TF_NIFTI_DATATYPES.items()}
+
+
+def _tf_read_nifti_header(path):
+    """Parse the NIfTI-1 header of a .nii/.nii.gz file.
+
+    Returns dict(shapeKJI, dtype, ijkToRas, voxOffset, scaled, formsAgree); ijkToRas is the
+    sform if set, else the qform. Raises ValueError for files this reader does not handle.
+    """
+    import gzip
+    import struct
+
+    opener = gzip.open if path.lower().endswith(".gz") else open
+    with opener(path, "rb") as fh:
+        raw = fh.read(348)
+    if len(raw) < 348:
+        raise ValueError(f"Not a NIfTI-1 file: {path}")
+    endian = "<" if struct.unpack("<i", raw[:4])[0] == 348 else ">"
+    if struct.unpack(endian + "i", raw[:4])[0] != 348 or raw[344:347] not in (b"n+1", b"ni1"):
+        raise ValueError(f"Not a single-file NIfTI-1 image: {path}")
+
+    dim = struct.unpack(endian + "8h", raw[40:56])
+    datatype = struct.unpack(endian + "h", raw[70:72])[0]
+    pixdim = struct.unpack(endian + "8f", raw[76:108])
+    voxOffset = int(struct.unpack(endian + "f", raw[108:112])[0])
+    slope, inter = struct.unpack(endian + "2f", raw[112:120])
+    qformCode, sformCode = struct.unpack(endian + "2h", raw[252:256])
+    b, c, d, qx, qy, qz = struct.unpack(endian + "6f", raw[256:280])
+    srow = np.array(struct.unpack(endian + "12f", raw[280:328]), dtype=float).reshape(3, 4)
+
+    if dim[0] < 3 or any(n > 1 for n in dim[4:1 + dim[0]]):
+        raise ValueError(f"Only 3D NIfTI volumes are supported: {path}")
+    if datatype not in _TF_NIFTI_DTYPES_BY_CODE:
+        raise ValueError(f"Unsupported NIfTI datatype {datatype}: {path}")
+
+    a = np.sqrt(max(0.0, 1.0 - (b * b + c * c + d * d)))
+    R = np.array([
+        [a * a + b * b - c * c - d * d, 2 * (b * c - a * d), 2 * (b * d + a * c)],
+        [2 * (b * c + a * d), a * a + c * c - b * b - d * d, 2 * (c * d - a * b)],
+        [2 * (b * d - a * c), 2 * (c * d + a * b), a * a + d * d - c * c - b * b],
+    ])
+    qfac = -1.0 if pixdim[0] < 0 else 1.0
+    qform = np.eye(4)
+    qform[:3, :3] = R * np.array([pixdim[1], pixdim[2], pixdim[3] * qfac])
+    qform[:3, 3] = (qx, qy, qz)
+    sform = np.vstack([srow, [0.0, 0.0, 0.0, 1.0]])
+
+    if sformCode > 0:
+        ijkToRas = sform
+    elif qformCode > 0:
+        ijkToRas = qform
+    else:
+        ijkToRas = np.diag([pixdim[1], pixdim[2], pixdim[3], 1.0])
+    return {
+        "shapeKJI": (dim[3], dim[2], dim[1]),
+        "dtype": _TF_NIFTI_DTYPES_BY_CODE[datatype].newbyteorder(endian),
+        "ijkToRas": ijkToRas,
+        "voxOffset": voxOffset,
+        "scaled": slope not in (0.0, 1.0) or inter != 0.0,
+        "slope": slope if slope != 0.0 else 1.0,
+        "inter": inter,
+        "formsAgree": not (sformCode > 0 and qformCode > 0) or np.allclose(sform, qform, atol=1e-3),
+    }
+
+
+def _tf_read_nifti(path, header=None):
+    """Read a 3D NIfTI-1 file as ((k,j,i) array, ijkToRas). Voxel values are not rescaled."""
+    import gzip
+
+    header = header or _tf_read_nifti_header(path)
+    count = int(np.prod(header["shapeKJI"]))
+    opener = gzip.open if path.lower().endswith(".gz") else open
+    with opener(path, "rb") as fh:
+        fh.seek(header["voxOffset"])
+        data = fh.read(count * header["dtype"].itemsize)
+    array = np.frombuffer(data, dtype=header["dtype"], count=count).reshape(header["shapeKJI"])
+    return array, header["ijkToRas"]
+
+
+def _tf_nifti_reorients_in_process(path):
+    """True if _tf_reorient_nifti_file_in_process can handle this file (no CLI needed)."""
+    try:
+        header = _tf_read_nifti_header(path)
+    except Exception:
+        return False
+    return (not header["scaled"] and header["formsAgree"]
+            and _tf_axis_aligned_permutation(header["ijkToRas"]) is not None)
+
+
+@Tracing.traced("RAS reorientation")
+def _tf_reorient_nifti_file_in_process(inputPath, outputPath, required=False):
+    """File->file RAS reorientation without OrientScalarVolume; False if the CLI is needed.
+
+    With required=True a volume that needs the CLI raises instead. No MRML access, so it
+    can run on a worker thread.
+    """
+    if not _tf_nifti_reorients_in_process(inputPath):
+        if required:
+            raise RuntimeError(f"Oblique volume, OrientScalarVolume is needed: {inputPath}")
+        return False
+    array, ijkToRas = _tf_read_nifti(inputPath)
+    reoriented, rasMatrix = _tf_reorient_array_to_ras(array, ijkToRas)
+    _tf_write_nifti(outputPath, reoriented, rasMatrix)
+    return True
+
+
 def _tf_run_console_process(args, keep_ui_responsive=True):
     """Run a console process in Slicer and return (exitCode, stdout, stderr).
 
     Works across Slicer builds where slicer.util.launchConsoleProcess may return
     a qt.QProcess (common) or a subprocess.Popen (some packaged environments).
     """
-    import slicer
-    import qt
 
     p = slicer.util.launchConsoleProcess(args)
 
@@ -1044,15 +1946,231 @@ def _tf_run_console_process(args, keep_ui_responsive=True):
 
 
 
+# ---------- Asynchronous CLI queue (manual RAS + DICOM export) ----------
+# Stadio di tracciamento (PLATiNLib.Tracing) dei passi eseguiti come processi figli
+_TF_CLI_STAGES = {"OrientScalarVolume": "RAS reorientation", "CreateDICOMSeries": "DICOM CLI"}
+
+
+class _TFCliJob:
+    """One queued conversion: steps run one after another, each checked by its output path.
+
+    A step's args is either a command line or a Python callable (see _TFThreadStep).
+    """
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = list(steps)  # [(title, args, expectedOutputPath)]
+        self.status = "queued"    # queued / running / done / failed / cancelled
+        self.stepIndex = 0
+        self.message = ""
+        self.process = None
+        self.readers = []
+        self.stepStarted = None
+
+    @property
+    def statusText(self):
+        if self.status == "running" and self.stepIndex < len(self.steps):
+            return f"running: {self.steps[self.stepIndex][0]} ({self.stepIndex + 1}/{len(self.steps)})"
+        return f"{self.status}: {self.message}" if self.message else self.status
+
+
+class _TFThreadStep:
+    """Popen-like handle for a job step that is a Python callable run on a worker thread.
+
+    The callable must not touch MRML. terminate() cannot stop it: a cancelled job simply
+    ignores its result.
+    """
+
+    def __init__(self, fn, onError):
+        import threading
+        self.returncode = None
+        self._fn = fn
+        self._onError = onError
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._fn()
+            self.returncode = 0
+        except Exception as e:
+            self._onError(str(e))
+            self.returncode = 1
+
+    def poll(self):
+        return None if self._thread.is_alive() else self.returncode
+
+    def terminate(self):
+        pass
+
+
+class _TFCliQueue:
+    """Run _TFCliJob-s as child processes, at most `maxConcurrent` at a time, without blocking the UI.
+
+    stdout/stderr lines are read on background threads and handed to `log` on the main
+    thread by a QTimer that only runs while jobs are pending. onJobChanged(job) is called
+    on every status change, onFinished(jobs) once the queue is empty.
+    """
+
+    def __init__(self, maxConcurrent=4, log=print, onJobChanged=None, onFinished=None, pollMs=100):
+        import queue
+        self.maxConcurrent = max(1, int(maxConcurrent))
+        self.log = log
+        self.onJobChanged = onJobChanged
+        self.onFinished = onFinished
+        self.jobs = []
+        self._lines = queue.Queue()
+        self._pollSeconds = int(pollMs) / 1000.0
+        self._timer = qt.QTimer()
+        self._timer.setInterval(int(pollMs))
+        self._timer.timeout.connect(self._tick)
+
+    @property
+    def busy(self):
+        """True while jobs are queued or running, or cancelled processes have not exited yet."""
+        return any(j.status in ("queued", "running") or j.process is not None for j in self.jobs)
+
+    def add(self, name, steps):
+        job = _TFCliJob(name, steps)
+        self.jobs.append(job)
+        self._changed(job)
+        return job
+
+    def start(self):
+        if not self._timer.isActive():
+            self._timer.start()
+        self._tick()
+
+    def cancel(self, job=None):
+        """Cancel one job (or all pending jobs); running processes are terminated."""
+        for j in ([job] if job is not None else list(self.jobs)):
+            if j.status not in ("queued", "running"):
+                continue
+            if j.process is not None and j.process.poll() is None:
+                try:
+                    j.process.terminate()
+                except Exception:
+                    pass
+            j.status = "cancelled"
+            self._changed(j)
+
+    def wait(self):
+        """Block until every job has finished (headless use; keeps Qt events flowing)."""
+        self.start()
+        while self.busy:
+            slicer.app.processEvents()
+            time.sleep(self._pollSeconds)
+            self._tick()
+
+    # -- internals --
+    def _changed(self, job):
+        if self.onJobChanged is not None:
+            try:
+                self.onJobChanged(job)
+            except Exception:
+                pass
+
+    def _launch(self, job):
+        import subprocess
+        import threading
+
+        title, args, _ = job.steps[job.stepIndex]
+        if callable(args):
+            self.log(f"[{job.name}] {title} (in-process)")
+            job.process = _TFThreadStep(args, lambda line: self._lines.put((job, "stderr", line)))
+            job.readers = []
+            return
+        job.stepStarted = time.perf_counter()
+        env = slicer.util.startupEnvironment() if hasattr(slicer.util, "startupEnvironment") else None
+        startupinfo = None
+        if os.name == "nt":
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        self.log(f"[{job.name}] {title}: {' '.join(str(a) for a in args)}")
+        job.process = subprocess.Popen([str(a) for a in args], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       env=env, startupinfo=startupinfo)
+
+        def _reader(stream, streamName):
+            for raw in iter(stream.readline, b""):
+                self._lines.put((job, streamName, raw.decode("utf-8", errors="replace").rstrip()))
+            stream.close()
+
+        job.readers = [threading.Thread(target=_reader, args=(job.process.stdout, "stdout"), daemon=True),
+                       threading.Thread(target=_reader, args=(job.process.stderr, "stderr"), daemon=True)]
+        for t in job.readers:
+            t.start()
+
+    def _drainOutput(self):
+        import queue
+        while True:
+            try:
+                job, streamName, line = self._lines.get_nowait()
+            except queue.Empty:
+                return
+            if line:
+                self.log(f"[{job.name} {streamName}] {line}")
+
+    def _advance(self, job):
+        """Start the job's current step; on failure mark the job failed."""
+        try:
+            self._launch(job)
+        except Exception as e:
+            job.status, job.message, job.process = "failed", str(e), None
+        self._changed(job)
+
+    def _tick(self):
+        for job in self.jobs:
+            if job.status == "cancelled" and job.process is not None and job.process.poll() is not None:
+                job.process = None
+            if job.status != "running" or job.process is None:
+                continue
+            exitCode = job.process.poll()
+            if exitCode is None:
+                continue
+            for t in job.readers:
+                t.join(timeout=1.0)
+            self._drainOutput()
+            title, args, expected = job.steps[job.stepIndex]
+            job.process = None
+            if not callable(args):  # i passi in-process sono tracciati dalle loro funzioni
+                Tracing.tracer().record(_TF_CLI_STAGES.get(title, title), job.stepStarted, time.perf_counter(),
+                                        category="cli", job=job.name, exitCode=str(exitCode))
+            if exitCode != 0:
+                job.status, job.message = "failed", f"{title} exit code {exitCode}"
+            elif expected and not os.path.exists(expected):
+                job.status, job.message = "failed", f"{title} did not create {expected}"
+            elif job.stepIndex + 1 < len(job.steps):
+                job.stepIndex += 1
+                self._advance(job)
+                continue
+            else:
+                job.status, job.message = "done", ""
+            self._changed(job)
+        self._drainOutput()
+
+        running = sum(1 for j in self.jobs if j.status == "running" or j.process is not None)
+        for job in self.jobs:
+            if running >= self.maxConcurrent:
+                break
+            if job.status == "queued":
+                job.status = "running"
+                self._advance(job)
+                running += 1
+
+        if not self.busy:
+            self._timer.stop()
+            if self.onFinished is not None:
+                jobs, self.jobs = self.jobs, []
+                self.onFinished(jobs)
+
+
 def _tf_get_cli_executable(moduleName: str, exeBaseName: str) -> str:
     """Return full path to a Slicer CLI executable.
 
     Prefers `slicer.modules.<moduleName>.path` when available.
     Falls back to searching under slicer.app.slicerHome for 'cli-modules/<exeBaseName>'.
     """
-    import os
     import glob
-    import slicer
 
     mod = getattr(slicer.modules, moduleName.lower(), None)
     if mod is not None and hasattr(mod, "path") and mod.path:
@@ -1076,13 +2194,23 @@ def _tf_get_cli_executable(moduleName: str, exeBaseName: str) -> str:
     raise RuntimeError(f"CLI executable not found: {exeBaseName}")
 
 
+def _tf_orient_to_ras_args(inputPath: str, outputPath: str) -> list:
+    """Command line of OrientScalarVolume reorienting inputPath to RAS (file->file)."""
+    exe = _tf_get_cli_executable("orientscalarvolume", "OrientScalarVolume")
+    return [exe, inputPath, "-o", "RAS", outputPath]
+
+
 def _tf_orient_nifti_file_to_ras(inputPath: str, outputPath: str) -> None:
-    """Run OrientScalarVolume on disk (file->file), producing a RAS-oriented NIfTI."""
-    import os
-    import slicer
+    """Reorient on disk (file->file), producing a RAS-oriented NIfTI.
 
-    exe = _tf_get_cli_executable("orientscalarvolume", "OrientScalarVolume")
-    args = [exe, inputPath, "-o", "RAS", outputPath]
+    Axis-aligned volumes are reoriented in memory; OrientScalarVolume is only run for
+    oblique volumes (or NIfTI headers the in-process reader does not handle).
+    """
+
+    if _tf_reorient_nifti_file_in_process(inputPath, outputPath):
+        return
+
+    args = _tf_orient_to_ras_args(inputPath, outputPath)
 
     exitCode, stdout, stderr = _tf_run_console_process(args)
     if stdout.strip():
@@ -1097,6 +2225,7 @@ def _tf_orient_nifti_file_to_ras(inputPath: str, outputPath: str) -> None:
         raise RuntimeError(f"RAS output was not created: {outputPath}")
 
 
+@Tracing.traced("RAS reorientation")
 def _tf_reorient_volume_to_ras(inputVolumeNode):
     """Reorient a scalar volume to RAS using Slicer's OrientScalarVolume CLI.
 
@@ -1104,7 +2233,6 @@ def _tf_reorient_volume_to_ras(inputVolumeNode):
     This implementation tries a couple of known parameter-name variants to stay compatible
     across Slicer builds, without changing any other module behavior.
     """
-    import slicer
 
     if not hasattr(slicer.modules, "orientscalarvolume"):
         raise RuntimeError("OrientScalarVolume module is not available in this Slicer installation")
@@ -1152,30 +2280,9 @@ def _tf_reorient_volume_to_ras(inputVolumeNode):
         pass
     raise last_error
 
-def _tf_export_volume_to_dicom(volumeNode, dicomDir: str, patientName: str, modality: str, seriesDescription: str, dicomPrefix: str=None, studyDescription: str=None, **_ignored_kwargs):
-    """Export a NIfTI (or other readable image) to a DICOM series using Slicer's CLI executable.
-
-    IMPORTANT: We intentionally call the *CLI executable* directly (same as your working shell script),
-    instead of using `slicer.cli.run()`. In some packaged environments (e.g., PLATiN), the MRML-node
-    to temporary-file handoff used by `slicer.cli.run()` can fail, producing logs like:
-      - "No input data assigned to Input Volume"
-      - missing /T/Slicer-*/...vtkMRMLScalarVolumeNode*.nrrd
-
-    This direct call avoids the temp-NRRD mechanism entirely.
-    """
-    import os
-    import slicer
-    import qt
-
-    # We require a file path, because we call the CLI like:
-    #   CreateDICOMSeries <inputImage> --dicomDirectory <dir> ...
-    if not isinstance(volumeNode, str):
-        raise RuntimeError("DICOM export expects an input *file path* (string).")
-    inputPath = volumeNode
-    if not os.path.exists(inputPath):
-        raise RuntimeError(f"Input image file does not exist: {inputPath}")
-
-    os.makedirs(dicomDir, exist_ok=True)
+def _tf_create_dicom_series_args(inputPath: str, dicomDir: str, patientName: str, modality: str,
+                                 seriesDescription: str) -> list:
+    """Command line of the CreateDICOMSeries CLI writing inputPath as a series in dicomDir."""
 
     # Resolve CLI executable path (most reliable: module path)
     cliExe = None
@@ -1201,7 +2308,6 @@ def _tf_export_volume_to_dicom(volumeNode, dicomDir: str, patientName: str, moda
         raise RuntimeError("Cannot locate CreateDICOMSeries CLI executable (module not available or path not found).")
 
     # Match your working script's arguments
-    # NOTE: we keep studyDescription = studyDescription if studyDescription else seriesDescription unless caller wants something else.
     patientName = patientName if patientName else "Unknown"
     modality = modality if modality else "MR"
     seriesDescription = seriesDescription if seriesDescription else "TrajectoryFusion"
@@ -1217,6 +2323,34 @@ def _tf_export_volume_to_dicom(volumeNode, dicomDir: str, patientName: str, moda
         "--studyDescription", studyDescription,
     ]
 
+    return args
+
+
+@Tracing.traced("DICOM CLI")
+def _tf_export_volume_to_dicom(volumeNode, dicomDir: str, patientName: str, modality: str, seriesDescription: str, dicomPrefix: str=None, studyDescription: str=None, **_ignored_kwargs):
+    """Export a NIfTI (or other readable image) to a DICOM series using Slicer's CLI executable.
+
+    IMPORTANT: We intentionally call the *CLI executable* directly (same as your working shell script),
+    instead of using `slicer.cli.run()`. In some packaged environments (e.g., PLATiN), the MRML-node
+    to temporary-file handoff used by `slicer.cli.run()` can fail, producing logs like:
+      - "No input data assigned to Input Volume"
+      - missing /T/Slicer-*/...vtkMRMLScalarVolumeNode*.nrrd
+
+    This direct call avoids the temp-NRRD mechanism entirely.
+    """
+
+    # We require a file path, because we call the CLI like:
+    #   CreateDICOMSeries <inputImage> --dicomDirectory <dir> ...
+    if not isinstance(volumeNode, str):
+        raise RuntimeError("DICOM export expects an input *file path* (string).")
+    inputPath = volumeNode
+    if not os.path.exists(inputPath):
+        raise RuntimeError(f"Input image file does not exist: {inputPath}")
+
+    os.makedirs(dicomDir, exist_ok=True)
+
+    args = _tf_create_dicom_series_args(inputPath, dicomDir, patientName, modality, seriesDescription)
+
     # Launch and wait (robust across QProcess/Popen)
     exitCode, stdout, stderr = _tf_run_console_process(args)
 
@@ -1229,45 +2363,234 @@ def _tf_export_volume_to_dicom(volumeNode, dicomDir: str, patientName: str, moda
         raise RuntimeError(f"CreateDICOMSeries failed with exit code {exitCode}")
 
 
+# ---------- In-process DICOM writer (pydicom, bundled with Slicer) ----------
+_TF_DICOM_SOP_CLASSES = {
+    "MR": "1.2.840.10008.5.1.4.1.1.4",  # MR Image Storage
+    "CT": "1.2.840.10008.5.1.4.1.1.2",  # CT Image Storage
+}
+_TF_DICOM_SECONDARY_CAPTURE = "1.2.840.10008.5.1.4.1.1.7"
+
+
+def _tf_pydicom():
+    """pydicom module, or None if it is not installed (the CreateDICOMSeries CLI is used then)."""
+    try:
+        import pydicom
+        return pydicom
+    except ImportError:
+        return None
+
+
+def _tf_new_dicom_uid():
+    pydicom = _tf_pydicom()
+    return pydicom.uid.generate_uid() if pydicom is not None else None
+
+
+def _tf_dicom_pixels(array):
+    """Stored pixel values of a volume: (int array, rescaleSlope, rescaleIntercept).
+
+    Integer data (or float data holding integers) that fits 16 bits is stored as is;
+    anything else is mapped linearly onto int16 with a shared slope/intercept.
+    """
+    arr = np.asarray(array)
+    lo = float(arr.min()) if arr.size else 0.0
+    hi = float(arr.max()) if arr.size else 0.0
+    integral = np.issubdtype(arr.dtype, np.integer) or bool(np.all(np.mod(arr, 1) == 0))
+    if integral and lo >= -32768 and hi <= 32767:
+        return (arr if arr.dtype == np.int16 else arr.astype(np.int16)), 1.0, 0.0
+    if integral and lo >= 0 and hi <= 65535:
+        return (arr if arr.dtype == np.uint16 else arr.astype(np.uint16)), 1.0, 0.0
+    slope = (hi - lo) / 65535.0 if hi > lo else 1.0
+    intercept = lo + 32768.0 * slope
+    return np.round((arr - intercept) / slope).clip(-32768, 32767).astype(np.int16), slope, intercept
+
+
+def _tf_ds(value):
+    """DICOM decimal string (at most 16 characters)."""
+    return "%.10g" % float(value)
+
+
+def _tf_dicom_save(ds, path):
+    try:
+        ds.save_as(path, enforce_file_format=True)  # pydicom >= 3
+    except TypeError:
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.save_as(path, write_like_original=False)
+
+
+@Tracing.traced("DICOM export")
+def _tf_write_dicom_series(array, ijkToRas, dicomDir, patientName="", modality="MR",
+                           seriesDescription="TrajectoryFusion", studyDescription=None,
+                           studyInstanceUID=None, frameOfReferenceUID=None, seriesNumber=1,
+                           workers=None, filePrefix="IMG"):
+    """Write a (k,j,i) volume as a DICOM series (one file per k slice) without any CLI.
+
+    Geometry comes from ijkToRas (converted to LPS): one slice per k, rows along j,
+    columns along i. Pass the same studyInstanceUID / frameOfReferenceUID to put several
+    series of a case in one study. Slices are encoded on `workers` threads (no MRML
+    access). Returns the list of files written.
+    """
+    import datetime
+    import concurrent.futures as cf
+
+    pydicom = _tf_pydicom()
+    if pydicom is None:
+        raise RuntimeError("pydicom is not available")
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    arr = np.asarray(array)
+    if arr.ndim != 3:
+        raise ValueError("DICOM export expects a 3D (k,j,i) array")
+    K, J, I = arr.shape
+    pixels, slope, intercept = _tf_dicom_pixels(arr)
+    leDtype = pixels.dtype.newbyteorder("<")
+
+    ijkToLps = np.diag([-1.0, -1.0, 1.0, 1.0]) @ np.asarray(ijkToRas, dtype=float)
+    spacing = np.linalg.norm(ijkToLps[:3, :3], axis=0)
+    rowDir, colDir = ijkToLps[:3, 0] / spacing[0], ijkToLps[:3, 1] / spacing[1]
+    normal = np.cross(rowDir, colDir)
+
+    modality = (modality or "MR").upper()
+    seriesDescription = seriesDescription or "TrajectoryFusion"
+    patientName = patientName or "Unknown"
+    sopClassUID = _TF_DICOM_SOP_CLASSES.get(modality, _TF_DICOM_SECONDARY_CAPTURE)
+    studyUID = studyInstanceUID or generate_uid()
+    seriesUID = generate_uid()
+    forUID = frameOfReferenceUID or generate_uid()
+    now = datetime.datetime.now()
+    date, time = now.strftime("%Y%m%d"), now.strftime("%H%M%S")
+    windowLo, windowHi = float(arr.min()), float(arr.max())
+
+    common = [
+        ("SOPClassUID", sopClassUID), ("Modality", modality),
+        ("PatientName", patientName), ("PatientID", patientName), ("PatientBirthDate", ""), ("PatientSex", ""),
+        ("StudyInstanceUID", studyUID), ("StudyDate", date), ("StudyTime", time), ("StudyID", "1"),
+        ("StudyDescription", studyDescription or seriesDescription), ("AccessionNumber", ""),
+        ("ReferringPhysicianName", ""),
+        ("SeriesInstanceUID", seriesUID), ("SeriesNumber", int(seriesNumber)), ("SeriesDate", date),
+        ("SeriesTime", time), ("SeriesDescription", seriesDescription),
+        ("FrameOfReferenceUID", forUID), ("PositionReferenceIndicator", ""),
+        ("ImageOrientationPatient", [_tf_ds(v) for v in np.concatenate([rowDir, colDir])]),
+        ("PixelSpacing", [_tf_ds(spacing[1]), _tf_ds(spacing[0])]), ("SliceThickness", _tf_ds(spacing[2])),
+        ("ImageType", ["DERIVED", "SECONDARY"]), ("SamplesPerPixel", 1), ("PhotometricInterpretation", "MONOCHROME2"),
+        ("Rows", J), ("Columns", I), ("BitsAllocated", 16), ("BitsStored", 16), ("HighBit", 15),
+        ("PixelRepresentation", 1 if pixels.dtype == np.int16 else 0),
+        ("RescaleIntercept", _tf_ds(intercept)), ("RescaleSlope", _tf_ds(slope)),
+        ("WindowCenter", _tf_ds((windowLo + windowHi) / 2.0)), ("WindowWidth", _tf_ds(max(1.0, windowHi - windowLo))),
+    ]
+    if modality == "MR":
+        common += [("ScanningSequence", "RM"), ("SequenceVariant", "NONE"), ("ScanOptions", ""),
+                   ("MRAcquisitionType", "3D")]
+    elif modality == "CT":
+        common += [("KVP", "")]
+    else:
+        common += [("ConversionType", "WSD")]
+
+    os.makedirs(dicomDir, exist_ok=True)
+
+    def _writeSlice(k):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = sopClassUID
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = Dataset()
+        ds.file_meta = meta
+        for keyword, value in common:
+            setattr(ds, keyword, value)
+        position = ijkToLps[:3, :3] @ np.array([0.0, 0.0, float(k)]) + ijkToLps[:3, 3]
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.InstanceNumber = k + 1
+        ds.ImagePositionPatient = [_tf_ds(v) for v in position]
+        ds.SliceLocation = _tf_ds(float(np.dot(position, normal)))
+        ds.PixelData = np.ascontiguousarray(pixels[k], dtype=leDtype).tobytes()
+        path = os.path.join(dicomDir, f"{filePrefix}{k + 1:04d}.dcm")
+        _tf_dicom_save(ds, path)
+        return path
+
+    nWorkers = max(1, min(K, int(workers) if workers else min(8, os.cpu_count() or 1)))
+    with cf.ThreadPoolExecutor(max_workers=nWorkers, thread_name_prefix="tf-dicom") as pool:
+        return list(pool.map(_writeSlice, range(K)))
+
+
+def _tf_export_nifti_file_to_dicom(niftiPath, dicomDir, patientName, modality, seriesDescription,
+                                   studyInstanceUID=None, frameOfReferenceUID=None, seriesNumber=1):
+    """File->DICOM with the in-process writer (no MRML access: safe on a worker thread)."""
+    header = _tf_read_nifti_header(niftiPath)
+    array, ijkToRas = _tf_read_nifti(niftiPath, header)
+    if header["scaled"]:
+        array = array * header["slope"] + header["inter"]
+    return _tf_write_dicom_series(array, ijkToRas, dicomDir, patientName=patientName, modality=modality,
+                                  seriesDescription=seriesDescription, studyInstanceUID=studyInstanceUID,
+                                  frameOfReferenceUID=frameOfReferenceUID, seriesNumber=seriesNumber)
+
+
 def _tf_export_nifti_as_ras_and_dicom(inputVolumeNode, originalNiftiPath: str, outputDirectory: str,
-                                     patientName: str, modality: str, seriesDescription: str):
+                                     patientName: str, modality: str, seriesDescription: str,
+                                     studyInstanceUID: str=None, frameOfReferenceUID: str=None,
+                                     seriesNumber: int=1):
     """
-    1) Reorient generated volume to RAS (creates a temporary RAS node)
+    1) Reorient generated volume to RAS (in memory; a temporary RAS node only for oblique volumes)
     2) Save additional RAS-oriented NIfTI next to the original output
     3) Export the RAS volume as a DICOM series (one series per output volume)
-    """
-    import os
-    import slicer
 
-    # 1) Reorient
-    rasNode = _tf_reorient_volume_to_ras(inputVolumeNode)
+    With pydicom the series is written from the RAS array while the NIfTI is compressed,
+    sharing studyInstanceUID / frameOfReferenceUID across the series of a case; without it,
+    CreateDICOMSeries converts the saved RAS NIfTI.
+    """
+    import concurrent.futures as cf
+
+    # 1) Reorient: axis-aligned volumes in memory, oblique ones through the CLI
+    rasNiftiPath = _tf_make_ras_nifti_path(originalNiftiPath)
+    rasNode = None
+    with Tracing.stage("RAS reorientation"):
+        reoriented = _tf_reorient_array_to_ras(slicer.util.arrayFromVolume(inputVolumeNode),
+                                               _tf_ijk_to_ras_array(inputVolumeNode))
+    if reoriented is None:
+        rasNode = _tf_reorient_volume_to_ras(inputVolumeNode)
+        reoriented = (slicer.util.arrayFromVolume(rasNode), _tf_ijk_to_ras_array(rasNode))
 
     try:
-        # 2) Save RAS NIfTI (do NOT overwrite the original file)
-        rasNiftiPath = _tf_make_ras_nifti_path(originalNiftiPath)
-        ok = slicer.util.saveNode(rasNode, rasNiftiPath)
-        print(f"[RAS Save] {'✓' if ok else '✗'} {rasNiftiPath}")
-
-        # 3) Export DICOM
         dicomRoot = os.path.join(outputDirectory, "DICOM")
         seriesKey = os.path.basename(originalNiftiPath).replace(".nii.gz", "").replace(".nii", "")
         dicomDir = os.path.join(dicomRoot, seriesKey)
         # Make series description unique but keep user-provided base name
         seriesDescFull = seriesDescription if seriesDescription else "TrajectoryFusion"
         seriesDescFull = f"{seriesDescFull} ({seriesKey})"
-        _tf_export_volume_to_dicom(
-            volumeNode=rasNiftiPath,
-            dicomDir=dicomDir,
-            patientName=patientName,
-            modality=modality,
-            seriesDescription=seriesDescFull,
-            dicomPrefix=seriesKey,
-        )
+
+        # 2) Save RAS NIfTI (do NOT overwrite the original file), in the background
+        with cf.ThreadPoolExecutor(max_workers=1, thread_name_prefix="tf-ras") as pool:
+            rasSave = pool.submit(_tf_write_nifti, rasNiftiPath, *reoriented)
+
+            # 3) Export DICOM
+            if _tf_pydicom() is not None:
+                _tf_write_dicom_series(*reoriented, dicomDir, patientName=patientName, modality=modality,
+                                       seriesDescription=seriesDescFull, studyInstanceUID=studyInstanceUID,
+                                       frameOfReferenceUID=frameOfReferenceUID, seriesNumber=seriesNumber)
+            cf.wait([rasSave])
+        ok = rasSave.exception() is None
+        print(f"[RAS Save] {'✓' if ok else '✗'} {rasNiftiPath}")
+        if not ok:
+            raise rasSave.exception()
+
+        if _tf_pydicom() is None:
+            _tf_export_volume_to_dicom(
+                volumeNode=rasNiftiPath,
+                dicomDir=dicomDir,
+                patientName=patientName,
+                modality=modality,
+                seriesDescription=seriesDescFull,
+                dicomPrefix=seriesKey,
+            )
         print(f"[DICOM Export] ✓ {dicomDir}")
 
     finally:
-        # cleanup temp node
-        try:
-            slicer.mrmlScene.RemoveNode(rasNode)
-        except Exception:
-            pass
+        # cleanup temp node (and the storage node created by saveNode)
+        if rasNode is not None:
+            try:
+                _tf_remove_node(rasNode)
+            except Exception:
+                pass
+
+
+Tracing.note_startup("TrajectoryFusion", "import", time.perf_counter() - _IMPORT_T0)